@@ -1,37 +1,51 @@
 """DataCite API Router."""
-import json
 # Setup logging
 import logging
 import time
 from typing import Annotated
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 from app.auth import get_admin, get_user
 from app.config import config_app
 from app.logic.datacite import (
     DoiErrors,
     DoiSuccess,
+    conversion_pool,
+    datacite_xml_cache,
     get_error_message,
-    publish_datacite,
     reserve_draft_doi_datacite,
     validate_doi,
-    is_valid_doi,
 )
+from app.logic.external import import_external_dois, normalize_doi
+from app.logic.jobs import enqueue_publish_job, job_worker
 from app.logic.mail import (
-    approval_granted_email,
     datacite_failed_email,
     request_approval_email,
 )
 from app.logic.minter import create_db_doi
-from app.logic.remote_ckan import ckan_package_patch, ckan_package_show
+from app.logic.publish import publish_package, publish_packages
+from app.logic.reconcile import reconcile_dois
+from app.logic.remote_ckan import (
+    CkanPackageUnitOfWork,
+    ckan_package_patch,
+    ckan_package_search_names,
+    ckan_package_show,
+)
+from app.logic.retry import datacite_retry_policy
+from app.logic.timing import ServerTimingRoute, timed
+from app.models.job import DataciteJob, DataciteJobPydantic
 
 log = logging.getLogger(__name__)
 
 
 # Setup datacite router
-router = APIRouter(prefix="/datacite", tags=["datacite"])
+router = APIRouter(
+    prefix="/datacite", tags=["datacite"], route_class=ServerTimingRoute
+)
 
 
 @router.get(
@@ -65,7 +79,7 @@ async def reserve_draft_doi(
     user_info = user.get("info")
     ckan = user.get("ckan")
 
-    package = ckan_package_show(package_id, ckan)
+    package = await ckan_package_show(package_id, ckan)
 
     if not (user_name := user_info.get("name", None)):
         log.error("Failure extracting username using Authorization header")
@@ -83,23 +97,31 @@ async def reserve_draft_doi(
                                    f"package '{package_id}' already has value assigned "
                                    f"for publication_state: '{publication_state}'")
 
-    # Check if doi has already been assigned
-    if not (doi := package.get("doi", None)):
+    # CKAN package is updated once, with DOI and 'publication_state' if the
+    # reservation succeeds, or only with a newly minted DOI if it fails.
+    # Minted DOIs are stored in the DOI database, which returns the same DOI
+    # if the reservation is retried.
+    async with CkanPackageUnitOfWork(package_id, ckan) as package_update:
 
-        # Mint new DOI in DOI database if it does not exist
-        if (doi := await create_db_doi(user_name, package)) is None:
-            log.error("Failed creating new DOI in database")
-            return HTTPException(status_code=500, detail="New DOI creation failed")
+        # Check if doi has already been assigned
+        if not (doi := package.get("doi", None)):
 
-        # Add DOI to dataset prior to DataCite call
-        ckan_package_patch(package_id, {"doi": doi}, ckan)
+            # Mint new DOI in DOI database if it does not exist
+            with timed("mint"):
+                doi = await create_db_doi(user_name, package)
+            if doi is None:
+                log.error("Failed creating new DOI in database")
+                raise HTTPException(status_code=500, detail="New DOI creation failed")
 
-    successful_status_codes = range(200, 300)
-    datacite_response = {}
-    retry_count = 0
+            # Add DOI to dataset
+            package_update.update({"doi": doi})
 
-    while retry_count <= config_app.DATACITE_RETRIES:
-        datacite_response = reserve_draft_doi_datacite(doi)
+        # Reserve DOI with DataCite, temporary failures are retried
+        # according to datacite_retry_policy
+        successful_status_codes = range(200, 300)
+        datacite_response = await datacite_retry_policy.run(
+            reserve_draft_doi_datacite, doi
+        )
         log.debug(f"DataCite response: {datacite_response}")
 
         if datacite_response.get("status_code") in successful_status_codes:
@@ -107,36 +129,24 @@ async def reserve_draft_doi(
                 "DataCite draft reservation successful, "
                 f"patching CKAN package ID: {package_id} with DOI: {doi}"
             )
-            ckan_package_patch(
-                package_id,
-                {"publication_state": "reserved"},
-                ckan,
-            )
+            package_update.update({"publication_state": "reserved"})
+            await package_update.flush()
 
-            return JSONResponse(
+            return ORJSONResponse(
                 datacite_response, status_code=datacite_response.get("status_code")
             )
 
-        # Break loop if DataCite returns 422 status code,
-        # this means that the DOI already has been taken
-        elif datacite_response.get("status_code") == 422:
-            log.debug(
-                f"DataCite draft reservation failed for CKAN package ID:"
-                f" {package_id} with DOI: {doi} "
-                f"because the DOI had already been taken "
-            )
-            break
+        # Save DOI to dataset even though reservation failed
+        await package_update.flush()
 
-        # Else attempt to call DataCite API again
-        retry_count += 1
+    # DataCite returns 422 status code if the DOI already has been taken
+    if datacite_response.get("status_code") == 422:
         log.debug(
-            "Failure publishing draft DOI, attempting again. " f"Retry: {retry_count}"
+            f"DataCite draft reservation failed for CKAN package ID:"
+            f" {package_id} with DOI: {doi} "
+            f"because the DOI had already been taken "
         )
 
-        # Wait sleep_time seconds before trying to call DataCite again
-        log.debug(f"Waiting {config_app.DATACITE_SLEEP_TIME} seconds...")
-        time.sleep(config_app.DATACITE_SLEEP_TIME)
-
     # Get error message
     error_msg = get_error_message(datacite_response)
 
@@ -144,7 +154,7 @@ async def reserve_draft_doi(
     await datacite_failed_email(package_id, user_name, user_email, error_msg)
 
     # Return DataCite response
-    return JSONResponse(
+    return ORJSONResponse(
         datacite_response, status_code=datacite_response.get("status_code", 500)
     )
 
@@ -167,7 +177,7 @@ async def request_publish_or_update(
     user_info = user.get("info")
     ckan = user.get("ckan")
 
-    package = ckan_package_show(package_id, ckan)
+    package = await ckan_package_show(package_id, ckan)
 
     # Validate doi, if 'doi' does not exist then raises HTTPException
     validate_doi(package)
@@ -224,9 +234,9 @@ async def request_publish_or_update(
     )
 
     log.debug(f"Updating package {package_id} to publication_state={publication_state}")
-    ckan_package_patch(package_id, {"publication_state": publication_state}, ckan)
+    await ckan_package_patch(package_id, {"publication_state": publication_state}, ckan)
     log.debug("Successfully updated CKAN package")
-    return JSONResponse(status_code=200, content={"success": True})
+    return ORJSONResponse(status_code=200, content={"success": True})
 
 
 @router.get(
@@ -254,6 +264,14 @@ async def publish_or_update_datacite(
                         "Default value is False."
         )
     ] = False,
+    run_async: Annotated[
+        bool, Query(
+            alias="async",
+            description="Set to True to queue publication as a background job. "
+                        "Returns 202 with a job id, see '/datacite/jobs/{job_id}'. "
+                        "Default value is False."
+        )
+    ] = False,
     admin=Depends(get_admin),
 ):
     """Publish or update dataset with DataCite.
@@ -272,138 +290,252 @@ async def publish_or_update_datacite(
     Also updates 'publication_state' to 'published' in CKAN for datasets that had the
     value of 'approved'.
     """
-    admin_info = admin.get("info")
+    if run_async:
+        if not job_worker.enabled:
+            raise HTTPException(
+                status_code=503, detail="Background publishing is not configured"
+            )
+        job = await enqueue_publish_job(package_id, admin.get("info"), is_external_doi)
+        status_url = f"{config_app.ROOT_PATH}/datacite/jobs/{job.job_pk}"
+        return ORJSONResponse(
+            status_code=202,
+            content={
+                "job_id": job.job_pk,
+                "status": job.status.value,
+                "status_url": status_url,
+            },
+            headers={"Location": status_url},
+        )
+
+    return await publish_package(
+        package_id, admin.get("ckan"), admin.get("info"), is_external_doi
+    )
+
+
+@router.get(
+    "/jobs/{job_id}",
+    name="Get background job status",
+    response_model=DataciteJobPydantic,
+    dependencies=[Depends(get_admin)],
+)
+async def get_job_status(job_id: int):
+    """Get status and result of a background job.
+
+    Only authorized admin can use this endpoint.
+    """
+    log.debug(f"Getting job ID {job_id}")
+    if not (job := await DataciteJob.get_or_none(job_pk=job_id)):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return await DataciteJobPydantic.from_tortoise_orm(job)
+
+
+@router.get(
+    "/conversion/stats",
+    name="Get DataCite conversion statistics",
+    dependencies=[Depends(get_admin)],
+)
+async def get_conversion_stats():
+    """Get utilisation of conversion process pool and conversion cache.
+
+    Only authorized admin can use this endpoint.
+    """
+    return {"pool": conversion_pool.stats(), "cache": datacite_xml_cache.stats()}
+
+
+@router.get(
+    "/reconcile",
+    name="Reconcile DOIs with CKAN and DataCite",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One JSON line per mismatch, followed by a summary line",
+        },
+    },
+)
+async def reconcile_dois_datacite(admin: Annotated[dict, Depends(get_admin)]):
+    """Report mismatches between DOI database, CKAN packages and DataCite.
+
+    Only authorized admin can use this endpoint.
+
+    Mismatch types: 'missing_in_datacite', 'missing_in_db', 'ckan_package_missing',
+    'doi_mismatch', 'missing_publication_state' and 'state_drift'.
+    Mismatches are streamed as newline delimited JSON while DOIs are read in
+    chunks, the last line contains a 'summary', or an 'error' if CKAN or
+    DataCite failed. For the nightly run see 'scripts/reconcile_dois.py'.
+    """
     ckan = admin.get("ckan")
 
-    # Get package,
-    # if package_id invalid or user not authorized then raises HTTPException
-    package = ckan_package_show(package_id, ckan)
+    async def stream_report():
+        try:
+            async for item in reconcile_dois(ckan):
+                yield orjson.dumps(item) + b"\n"
+        except HTTPException as e:
+            log.error(f"DOI reconciliation failed: {e.detail}")
+            yield orjson.dumps(
+                {"error": {"status_code": e.status_code, "detail": e.detail}}
+            ) + b"\n"
 
-    # Extract publication_state
-    publication_state = package.get("publication_state")
-    if not publication_state:
-        log.error("Package does not have a 'publication_state'")
-        raise HTTPException(
-            status_code=500, detail="Package does not have a 'publication_state'"
-        )
+    return StreamingResponse(stream_report(), media_type="application/x-ndjson")
 
-    # Get maintainer user name
-    maintainer = package.get("maintainer", {})
-    maintainer = json.loads(maintainer)
-    maintainer_name = f"{maintainer.get('given_name', '')} {maintainer.get('name', '')}"
-    if not (maintainer_email := maintainer.get("email", None)):
-        raise HTTPException(status_code=500, detail="Package maintainer not extracted")
-    if not (admin_email := admin_info.get("email", None)):
-        raise HTTPException(status_code=500, detail="Admin email not extracted")
-
-    # Check if publication_state can be processed
-    if publication_state not in ["pub_pending", "published", "approved"]:
-        log.error(f"Publication state '{publication_state}' is not one of the "
-                  f"following: 'pub_pending', 'published', 'approved'")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Value for 'publication_state' cannot be processed: "
-                   f"'{publication_state}' is not one of the "
-                   f"following: 'pub_pending', 'published', 'approved'",
-        )
 
-    #################  Publish external DOIs  ###########################
-    if is_external_doi:
+class BulkPublishRequest(BaseModel):
+    """Packages to publish/update with the bulk publish endpoint."""
 
-        # Validate DOI exists on package and returns a 200 when called
-        if not (doi := package.get("doi", None)):
-            raise HTTPException(
-                status_code=400,
-                detail=f"'doi' is not available for CKAN package '{package_id}'"
-            )
-        # Raises HTTPException if DOI does not exist or does not
-        # return a successful response when called
-        is_valid_doi(doi)
-
-        # Publish and make dataset visible in CKAN
-        ckan_response = ckan_package_patch(
-            package_id,
-            {
-                "private": False,
-                "publication_state": "published",
-            },
+    package_ids: list[str] = Field(
+        default=[], description="CKAN package ids or names"
+    )
+    query: str | None = Field(
+        default=None,
+        description="CKAN package_search query, matching packages are published "
+                    "in addition to 'package_ids'",
+    )
+    is_external_doi: bool = False
+    send_email: bool = Field(
+        default=False,
+        description="Send publication complete email for each package",
+    )
+    concurrency: int = Field(
+        default=config_app.BULK_PUBLISH_CONCURRENCY,
+        ge=1,
+        le=config_app.BULK_PUBLISH_MAX_CONCURRENCY,
+    )
+
+    @model_validator(mode="after")
+    def check_packages_selected(self):
+        """Validate that 'package_ids' or 'query' is provided."""
+        if not self.package_ids and not self.query:
+            raise ValueError("Either 'package_ids' or 'query' is required")
+        return self
+
+
+@router.post(
+    "/publish/bulk",
+    name="Publish/update many datasets",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One JSON line per package, followed by a summary line",
+        },
+    },
+)
+async def bulk_publish_or_update_datacite(
+    bulk_request: BulkPublishRequest,
+    admin: Annotated[dict, Depends(get_admin)],
+):
+    """Publish or update many datasets with DataCite concurrently.
+
+    Only authorized admin can use this endpoint.
+
+    Each package is processed like '/datacite/publish', at most 'concurrency'
+    at a time. Results are streamed as newline delimited JSON in order of
+    completion, the last line contains a 'summary'.
+    """
+    ckan = admin.get("ckan")
+
+    async def iter_package_ids():
+        for package_id in bulk_request.package_ids:
+            yield package_id
+        if bulk_request.query:
+            async for package_id in ckan_package_search_names(bulk_request.query, ckan):
+                yield package_id
+
+    async def stream_results():
+        start = time.monotonic()
+        summary = {"total": 0, "succeeded": 0, "unchanged": 0, "failed": 0}
+        async for result in publish_packages(
+            iter_package_ids(),
             ckan,
-        )
-        log.debug(f"CKAN package_patch response: {ckan_response}")
+            admin.get("info"),
+            concurrency=bulk_request.concurrency,
+            is_external_doi=bulk_request.is_external_doi,
+            send_email=bulk_request.send_email,
+        ):
+            if result.get("package_id") is not None:
+                summary["total"] += 1
+                succeeded = result.get("status_code") in range(200, 300)
+                summary["succeeded" if succeeded else "failed"] += 1
+                response = result.get("response")
+                if isinstance(response, dict) and response.get("unchanged"):
+                    summary["unchanged"] += 1
+            yield orjson.dumps(result) + b"\n"
+
+        summary["duration_seconds"] = round(time.monotonic() - start, 3)
+        log.info(f"Bulk publish finished: {summary}")
+        yield orjson.dumps({"summary": summary}) + b"\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+class ExternalDoi(BaseModel):
+    """CKAN package and the DOI it was registered with on an external platform."""
+
+    package_id: str = Field(description="CKAN package id or name")
+    doi: str = Field(
+        description="DOI in short (10.5281/zenodo.6514932) "
+                    "or URL (https://doi.org/10.5281/zenodo.6514932) format"
+    )
 
-        # Email user that publication complete
-        await approval_granted_email(
-            package_id, maintainer_name, [maintainer_email, admin_email]
-        )
+    @field_validator("doi")
+    @classmethod
+    def check_doi(cls, value: str) -> str:
+        """Validate DOI format, return it in short format."""
+        doi = normalize_doi(value)
+        prefix, _, suffix = doi.partition("/")
+        if not prefix.startswith("10.") or not suffix:
+            raise ValueError(f"'{value}' is not a DOI")
+        return doi
 
-        return JSONResponse(
-            status_code=200,
-            content=f"CKAN package '{package_id}' with external DOI '{doi}' "
-                    f"published and visible in EnviDat system"
-        )
 
-    #################  Publish internal EnviDat DOIs  ####################
-    else:
-        # Publish/update dataset in Datacite,
-        # if response status_code not in successful_status_codes
-        # then try again "retries" times
-        successful_status_codes = range(200, 300)
-        datacite_response = {}
-        retry_count = 0
-        err_msg = "Unknown error"
-
-        while retry_count <= config_app.DATACITE_RETRIES:
-            # Send package to DataCite
-            try:
-                datacite_response = publish_datacite(package)
-                log.debug(f"DataCite response: {datacite_response}")
-            except Exception as e:
-                log.error(e)
-                err_msg = str(e)
-
-            if datacite_response.get("status_code") in successful_status_codes:
-                log.debug(
-                    "DataCite publish successful, patching "
-                    f"CKAN package ID: {package_id} to publication_state=published"
-                )
-                # Publish and make visible dataset in CKAN
-                ckan_response = ckan_package_patch(
-                    package_id,
-                    {
-                        "private": False,
-                        "publication_state": "published",
-                    },
-                    ckan,
-                )
-                log.debug(f"CKAN package_patch response: {ckan_response}")
-
-                # Email user that publication complete
-                await approval_granted_email(
-                    package_id, maintainer_name, [maintainer_email, admin_email]
-                )
-
-                # Return successful datacite_response
-                return JSONResponse(
-                    datacite_response, status_code=datacite_response.get("status_code")
-                )
-
-            # Else attempt to call DataCite API again
-            retry_count += 1
-
-            # Wait sleep_time seconds before trying to call DataCite again
-            time.sleep(config_app.DATACITE_SLEEP_TIME)
-
-        # Get error message
-        if datacite_response:
-            error_msg = get_error_message(datacite_response)
-        else:
-            error_msg = err_msg 
-
-        await datacite_failed_email(
-            package_id, maintainer_name, maintainer_email, error_msg
-        )
+class ExternalImportRequest(BaseModel):
+    """External DOIs to import with the external import endpoint."""
 
-        # Return error datacite_response
-        return JSONResponse(
-            datacite_response, status_code=datacite_response.get("status_code", 500)
-        )
+    dois: list[ExternalDoi] = Field(
+        min_length=1, max_length=config_app.EXTERNAL_IMPORT_MAX_SIZE
+    )
+    send_email: bool = Field(
+        default=False,
+        description="Send one summary email to the admin, requires the "
+                    "'datacite-external-import' template of the mailer",
+    )
+    concurrency: int = Field(
+        default=config_app.BULK_PUBLISH_CONCURRENCY,
+        ge=1,
+        le=config_app.BULK_PUBLISH_MAX_CONCURRENCY,
+    )
+
+    @model_validator(mode="after")
+    def check_unique(self):
+        """Validate that each package and DOI is imported once."""
+        if len({item.package_id for item in self.dois}) != len(self.dois):
+            raise ValueError("Each package can only be imported once")
+        if len({item.doi.lower() for item in self.dois}) != len(self.dois):
+            raise ValueError("Each DOI can only be imported once")
+        return self
+
+
+@router.post("/import/external", name="Import many external DOIs")
+async def import_external_dois_datacite(
+    import_request: ExternalImportRequest,
+    admin: Annotated[dict, Depends(get_admin)],
+):
+    """Import DOIs registered on external platforms for many datasets.
+
+    Only authorized admin can use this endpoint.
+
+    Each DOI must resolve with doi.org and each dataset must have a
+    'publication_state' of 'pub_pending', 'published' or 'approved'.
+    DOIs are registered in the DOI database, then the datasets are updated
+    with their DOI and published in CKAN. DOIs are not published with DataCite.
+
+    Returns a result for each dataset and a 'summary'. If 'send_email' is true,
+    sends one summary email to the admin instead of an email for each dataset.
+    """
+    return await import_external_dois(
+        {item.package_id: item.doi for item in import_request.dois},
+        admin.get("ckan"),
+        admin.get("info"),
+        concurrency=import_request.concurrency,
+        send_email=import_request.send_email,
+    )
@@ -1,22 +1,34 @@
 """DOIs API Router."""
 
 import logging
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from tortoise.queryset import QuerySet
 
 from app.auth import get_admin
 from app.config import config_app
+from app.logic.pagination import iter_keyset_chunks, keyset_page
+from app.logic.timing import ServerTimingRoute
 from app.models.doi import (
+    DOI_REALISATION_SUMMARY_FIELDS,
     DoiRealisation,
     DoiRealisationEditPydantic,
     DoiRealisationInPydantic,
     DoiRealisationPydantic,
+    DoiRealisationSummaryPydantic,
 )
 
 log = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/dois", tags=["dois"], dependencies=[Depends(get_admin)])
+router = APIRouter(
+    prefix="/dois",
+    tags=["dois"],
+    dependencies=[Depends(get_admin)],
+    route_class=ServerTimingRoute,
+)
 
 
 class Status(BaseModel):
@@ -25,35 +37,121 @@ class Status(BaseModel):
     message: str
 
 
-@router.get("", response_model=list[DoiRealisationPydantic])
-async def get_all_dois():
-    """Get all dois."""
-    log.debug("Getting all dois")
-    return await DoiRealisationPydantic.from_queryset(DoiRealisation.all())
+DoiView = Annotated[
+    Literal["summary", "full"],
+    Query(
+        description="'summary' returns identifiers, CKAN package and dates only, "
+                    "'full' also includes 'metadata'. Default value is 'full'.",
+    ),
+]
+
+
+def doi_view_query(queryset: QuerySet, view: str) -> tuple[QuerySet, type[BaseModel]]:
+    """Return query selecting only the columns of view, and its Pydantic model."""
+    if view == "summary":
+        return (
+            queryset.only(*DOI_REALISATION_SUMMARY_FIELDS),
+            DoiRealisationSummaryPydantic,
+        )
+    return queryset, DoiRealisationPydantic
+
+
+@router.get(
+    "",
+    response_model=list[DoiRealisationPydantic] | list[DoiRealisationSummaryPydantic],
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "List of dois, or one doi per line if format is 'ndjson'. "
+                           "Header 'X-Next-Cursor' is set if more dois follow.",
+        },
+    },
+)
+async def get_all_dois(
+    response: Response,
+    limit: Annotated[
+        int | None,
+        Query(
+            ge=1,
+            le=config_app.DOIS_PAGE_SIZE_MAX,
+            description="Maximum number of dois returned. Default is all dois.",
+        ),
+    ] = None,
+    after: Annotated[
+        int | None,
+        Query(
+            description="Only return dois with 'doi_pk' greater than this value. "
+                        "Use 'X-Next-Cursor' header of previous page.",
+        ),
+    ] = None,
+    format: Annotated[
+        Literal["json", "ndjson"],
+        Query(
+            description="'json' returns a list, 'ndjson' streams one doi per line "
+                        "while reading them from the database in chunks.",
+        ),
+    ] = "json",
+    view: DoiView = "full",
+):
+    """Get dois ordered by 'doi_pk', with keyset pagination."""
+    log.debug(
+        f"Getting dois after {after} with limit {limit}, "
+        f"format '{format}' and view '{view}'"
+    )
+    queryset, pydantic_model = doi_view_query(DoiRealisation.all(), view)
+
+    if format == "ndjson":
+
+        async def stream_dois():
+            async for chunk in iter_keyset_chunks(
+                queryset,
+                "doi_pk",
+                config_app.DOIS_STREAM_CHUNK_SIZE,
+                after=after,
+                limit=limit,
+            ):
+                yield "".join(
+                    pydantic_model.model_validate(doi).model_dump_json() + "\n"
+                    for doi in chunk
+                )
+
+        return StreamingResponse(stream_dois(), media_type="application/x-ndjson")
+
+    if limit is None:
+        return await pydantic_model.from_queryset(
+            keyset_page(queryset, "doi_pk", after, None)
+        )
+
+    # Fetch one extra row to know if there is a next page
+    dois = await keyset_page(queryset, "doi_pk", after, limit + 1)
+    if len(dois) > limit:
+        dois = dois[:limit]
+        response.headers["X-Next-Cursor"] = str(dois[-1].doi_pk)
+    return [pydantic_model.model_validate(doi) for doi in dois]
 
 
 @router.get(
     "/{id}",
-    response_model=DoiRealisationPydantic,
+    response_model=DoiRealisationPydantic | DoiRealisationSummaryPydantic,
 )
-async def get_doi_by_id(id: str):
+async def get_doi_by_id(id: str, view: DoiView = "full"):
     """Get specific doi."""
     log.debug(f"Getting doi ID {id}")
-    return await DoiRealisationPydantic.from_queryset_single(
-        DoiRealisation.get(doi_pk=id)
-    )
+    queryset, pydantic_model = doi_view_query(DoiRealisation.filter(doi_pk=id), view)
+    return await pydantic_model.from_queryset_single(queryset.get())
 
 
 @router.get(
     "/{prefix}/{suffix}",
-    response_model=DoiRealisationPydantic,
+    response_model=DoiRealisationPydantic | DoiRealisationSummaryPydantic,
 )
-async def get_doi_by_prefix_suffix(prefix: str, suffix: str):
+async def get_doi_by_prefix_suffix(prefix: str, suffix: str, view: DoiView = "full"):
     """Get specific doi by prefix/suffix combo."""
     log.debug(f"Getting doi {prefix}/{suffix}")
-    return await DoiRealisationPydantic.from_queryset_single(
-        DoiRealisation.get(prefix_id=prefix, suffix_id=suffix)
+    queryset, pydantic_model = doi_view_query(
+        DoiRealisation.filter(prefix_id=prefix, suffix_id=suffix), view
     )
+    return await pydantic_model.from_queryset_single(queryset.get())
 
 
 @router.post("", response_model=DoiRealisationInPydantic)
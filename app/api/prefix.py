@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 
 from app.auth import get_admin
+from app.logic.timing import ServerTimingRoute
 from app.models.doi import (
     DoiPrefix,
     DoiPrefixEditPydantic,
@@ -19,6 +20,7 @@ router = APIRouter(
     prefix="/prefix",
     tags=["doi_prefix"],
     dependencies=[Depends(get_admin)],
+    route_class=ServerTimingRoute,
 )
 
 
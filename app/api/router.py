@@ -3,12 +3,14 @@
 import logging
 from typing import Callable
 
-from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import RedirectResponse
 from fastapi.routing import APIRoute
 
 from app.api import datacite, doi, prefix
+from app.auth import check_metrics_token
 from app.config import config_app
+from app.logic.metrics import metrics_response_body
 
 log = logging.getLogger(__name__)
 
@@ -42,6 +44,18 @@ api_router.include_router(prefix.router)
 error_router = APIRouter(route_class=RouteErrorHandler)
 
 
+@api_router.get(
+    "/metrics", include_in_schema=False, dependencies=[Depends(check_metrics_token)]
+)
+async def metrics():
+    """Return metrics in Prometheus text format.
+
+    Requires 'Authorization: Bearer <METRICS_TOKEN>'.
+    """
+    body, content_type = metrics_response_body()
+    return Response(content=body, media_type=content_type)
+
+
 @api_router.get("/", include_in_schema=False)
 async def home(request: Request):
     """Redirect home to docs."""
@@ -1,18 +1,29 @@
 """Validate authorization header and get user details."""
 
+import hmac
 import logging
 from typing import Annotated
 
-from ckanapi import NotFound
+from ckanapi import NotAuthorized, NotFound
 from fastapi import Depends, Header, HTTPException
 
-from app.logic.remote_ckan import get_ckan
+from app.config import config_app
+from app.logic.remote_ckan import (
+    ckan_user_cache,
+    get_ckan,
+    get_user_cache_key,
+    invalidate_cached_user,
+)
 
 log = logging.getLogger(__name__)
 
 
-def get_user(authorization: Annotated[str | None, Header()] = None) -> dict:
-    """Return a CKAN API instance for a standard user."""
+async def get_user(authorization: Annotated[str | None, Header()] = None) -> dict:
+    """Return a CKAN API instance for a standard user.
+
+    User info returned by CKAN 'user_show' is cached per Authorization header
+    for 'CKAN_USER_CACHE_TTL' seconds.
+    """
     if not authorization:
         log.debug(f"Authorization is: {authorization}")
         log.error("No Authorization header present")
@@ -20,21 +31,34 @@ def get_user(authorization: Annotated[str | None, Header()] = None) -> dict:
 
     log.debug("Authorization header extracted from request headers")
 
+    ckan = get_ckan(authorization)
+    cache_key = get_user_cache_key(authorization)
+
+    if (user_info := ckan_user_cache.get(cache_key)) is not None:
+        log.debug(f"User info loaded from cache: {ckan_user_cache.stats()}")
+        return {"info": user_info, "ckan": ckan}
+
     try:
-        ckan = get_ckan(authorization)
-        user_info = ckan.call_action("user_show")
+        user_info = await ckan.call_action("user_show")
     except NotFound as e:
         raise HTTPException(status_code=404, detail="User not found") from e
+    except NotAuthorized as e:
+        invalidate_cached_user(authorization)
+        raise HTTPException(
+            status_code=401, detail="Could not authenticate user"
+        ) from e
     except Exception as e:
         log.error(e)
         raise HTTPException(
             status_code=500, detail="Could not authenticate user"
         ) from e
 
+    ckan_user_cache.set(cache_key, user_info)
+
     return {"info": user_info, "ckan": ckan}
 
 
-def get_admin(user=Depends(get_user)) -> dict:
+async def get_admin(user=Depends(get_user)) -> dict:
     """Return a CKAN API instance for an admin user."""
     user_info = user.get("info")
     # Determine if is an admin
@@ -48,3 +72,22 @@ def get_admin(user=Depends(get_user)) -> dict:
 
     return user
 
+
+async def check_metrics_token(authorization: Annotated[str | None, Header()] = None):
+    """Validate 'Bearer' token sent by Prometheus to scrape metrics.
+
+    Metrics are disabled, responding 404, if 'METRICS_TOKEN' is not set.
+    """
+    if not config_app.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), config_app.METRICS_TOKEN.encode()
+    ):
+        log.error("Invalid metrics token")
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -37,15 +37,36 @@ class ConfigAppModel(BaseModel):
     APP_VERSION: str
     ROOT_PATH: Optional[str] = ""
     DEBUG: bool = False
+    SLOW_REQUEST_THRESHOLD: int | float = 5
+    METRICS_TOKEN: str | None = None
 
     CKAN_API_URL: str = "https://www.envidat.ch"
+    CKAN_API_TOKEN: str | None = None
+    CKAN_TIMEOUT: int | float = 10
+    CKAN_POOL_SIZE: int = 20
+    CKAN_USER_CACHE_TTL: int | float = 300
+    CKAN_USER_CACHE_SIZE: int = 1000
+    CKAN_PACKAGE_CACHE_SIZE: int = 256
+    CKAN_PACKAGE_CACHE_TTL: int | float = 300
     DATACITE_API_URL: str
 
     DATACITE_CLIENT_ID: str
     DATACITE_PASSWORD: str
     DATACITE_TIMEOUT: int | float = 3
+    DATACITE_POOL_SIZE: int = 10
     DATACITE_RETRIES: int = 1
     DATACITE_SLEEP_TIME: int = 3
+    DATACITE_MAX_SLEEP_TIME: int | float = 30
+    DATACITE_RETRY_DEADLINE: int | float = 60
+    DATACITE_XML_CACHE_SIZE: int = 256
+    DATACITE_XML_CACHE_TTL: int | float = 3600
+    CONVERSION_PROCESSES: int = 2
+    CONVERSION_INPROCESS_MAX_SIZE: int = 50000
+    DOI_RESOLVE_TIMEOUT: int | float = 5
+    DOI_RESOLVE_CACHE_SIZE: int = 10000
+    DOI_RESOLVE_CACHE_TTL: int | float = 86400
+    DOI_RESOLVE_NEGATIVE_TTL: int | float = 600
+    DOI_RESOLVE_ERROR_TTL: int | float = 30
     DATACITE_DATA_URL_PREFIX: str = "https://www.envidat.ch/#/metadata"
     DOI_PREFIX: str
     DOI_SUFFIX_TAG: Optional[str] = ""
@@ -82,6 +103,26 @@ class ConfigAppModel(BaseModel):
 
     EMAIL_ENDPOINT: AnyHttpUrl
     EMAIL_FROM: str
+    MAIL_TIMEOUT: int | float = 10
+    MAIL_CONCURRENCY: int = 2
+    MAIL_MAX_ATTEMPTS: int = 5
+    MAIL_RETRY_DELAY: int | float = 30
+    MAIL_POLL_INTERVAL: int | float = 30
+
+    DOIS_PAGE_SIZE_MAX: int = 1000
+    DOIS_STREAM_CHUNK_SIZE: int = 500
+
+    BULK_PUBLISH_CONCURRENCY: int = 4
+    BULK_PUBLISH_MAX_CONCURRENCY: int = 16
+    EXTERNAL_IMPORT_MAX_SIZE: int = 1000
+
+    RECONCILE_CHUNK_SIZE: int = 100
+    RECONCILE_DATACITE_PAGE_SIZE: int = 1000
+
+    JOB_CONCURRENCY: int = 2
+    JOB_POLL_INTERVAL: int | float = 5
+    JOB_TIMEOUT: int | float = 900
+    JOB_MAX_ATTEMPTS: int = 3
 
 
 @lru_cache
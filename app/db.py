@@ -3,18 +3,30 @@
 import logging
 
 from fastapi import FastAPI
+from tortoise.backends.base.config_generator import expand_db_url
 from tortoise.contrib.fastapi import register_tortoise
 
 from app.config import config_app
+from app.logic.metrics import InstrumentedConnection
 
 log = logging.getLogger(__name__)
 
+
+def get_db_connection_config() -> dict:
+    """Return connection config for DB_URI, with query metrics enabled."""
+    connection = expand_db_url(config_app.DB_URI)
+    connection["credentials"]["connection_class"] = InstrumentedConnection
+    return connection
+
+
 TORTOISE_ORM = {
-    "connections": {"default": config_app.DB_URI},
+    "connections": {"default": get_db_connection_config()},
     "apps": {
         config_app.__NAME__: {
             "models": [
                 "app.models.doi",
+                "app.models.job",
+                "app.models.mail",
             ],
             "default_connection": "default",
         },
@@ -0,0 +1,161 @@
+"""Convert EnviDat packages to DataCite XML, in a process pool if configured.
+
+Conversion is CPU bound, running it in worker processes keeps the event loop
+free to serve other requests and uses all cores of the container.
+Functions run in worker processes are kept in this module, which imports
+only what the conversion needs.
+"""
+
+import asyncio
+import base64
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from envidat_converters.logic.converter_logic.envidat_to_datacite import (
+    EnviDatToDataCite,
+)
+
+log = logging.getLogger(__name__)
+
+
+def xml_to_base64(xml: str | bytes) -> str:
+    """Converts XML to base64 formatted string.
+
+       Returns string in base64 format (not bytes)
+
+    Args:
+        xml (str | bytes): XML as string or UTF-8 encoded bytes
+
+    Returns:
+        str: base64 formatted string conversion of input xml
+    """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    if isinstance(xml, bytes):
+        # base64 output is ASCII, decoding it is a plain copy
+        return base64.b64encode(xml).decode("ascii")
+
+
+def convert_package_to_datacite(package: dict) -> str | None:
+    """Return base64 encoded DataCite XML for package, None if conversion fails."""
+    try:
+        xml = EnviDatToDataCite(package)
+        if not xml:
+            return None
+        return xml_to_base64(xml.__str__())
+    except ValueError as e:
+        log.error(e)
+        return None
+
+
+def _warm_up() -> bool:
+    """Run in each worker process at startup, so first conversion is fast."""
+    return True
+
+
+class ConversionPool:
+    """Run conversions in a process pool, small packages in the event loop.
+
+    With 'processes' 0 all conversions run in the event loop process.
+    Packages smaller than 'inprocess_max_size' (characters of JSON) are
+    converted in process, sending them to a worker would cost more than it saves.
+    """
+
+    def __init__(self, processes: int, inprocess_max_size: int):
+        """Create stopped pool."""
+        self.processes = processes
+        self.inprocess_max_size = inprocess_max_size
+        self._executor: ProcessPoolExecutor | None = None
+        self.active = 0
+        self.completed = 0
+        self.inprocess = 0
+        self.failed = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+
+    async def start(self):
+        """Start worker processes and wait until each is ready."""
+        if self.processes <= 0 or self._executor is not None:
+            return
+        log.debug(f"Starting conversion pool with {self.processes} processes")
+        # 'spawn' as forking a process running an event loop and threads is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self._executor, _warm_up)
+                for _ in range(self.processes)
+            )
+        )
+
+    async def stop(self):
+        """Shut down worker processes."""
+        if self._executor is None:
+            return
+        log.debug("Stopping conversion pool")
+        executor, self._executor = self._executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def convert(self, package: dict, size: int) -> str | None:
+        """Return base64 encoded DataCite XML for package.
+
+        Args:
+            package (dict): EnviDat package to convert
+            size (int): size of package, for example length of its JSON
+        """
+        if self._executor is None or size < self.inprocess_max_size:
+            self.inprocess += 1
+            return convert_package_to_datacite(package)
+
+        executor = self._executor
+        self.active += 1
+        start = time.monotonic()
+        try:
+            xml_encoded = await asyncio.get_running_loop().run_in_executor(
+                executor, convert_package_to_datacite, package
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory), replace pool and convert here
+            log.exception("Conversion pool broken, restarting it")
+            self.restarts += 1
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            await self.start()
+            self.inprocess += 1
+            return convert_package_to_datacite(package)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self.busy_seconds += time.monotonic() - start
+
+        self.completed += 1
+        return xml_encoded
+
+    def stats(self) -> dict:
+        """Return pool size and utilisation counters.
+
+        'completed' and 'failed' count conversions by workers that returned or
+        raised, 'inprocess' conversions in the event loop process and 'restarts'
+        how often the pool was replaced after a worker died.
+        """
+        processes = self.processes if self._executor is not None else 0
+        return {
+            "processes": processes,
+            "active": self.active,
+            "queued": max(self.active - processes, 0),
+            "utilisation": min(self.active, processes) / processes if processes else 0,
+            "completed": self.completed,
+            "inprocess": self.inprocess,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
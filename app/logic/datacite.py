@@ -1,26 +1,62 @@
 """Reserve and Publish DOIs to Datacite."""
 
-import base64
-import json
-import requests
-from fastapi import HTTPException
-from requests import HTTPError
-from typing_extensions import TypedDict
+import hashlib
+from collections.abc import AsyncIterator
+from importlib.metadata import PackageNotFoundError, version
 
-from envidat_converters.logic.converter_logic.envidat_to_datacite import EnviDatToDataCite
+import httpx
+import orjson
+from fastapi import HTTPException
+from typing_extensions import NotRequired, TypedDict
 
 from app.config import config_app
+from app.logic.conversion import ConversionPool
+from app.logic.metrics import instrumented_transport, stats_collector
+from app.logic.retry import parse_retry_after
+from app.logic.timing import timed
+from app.utils import TTLCache, stable_hash, stable_json
 
 # Setup logging
 import logging
 log = logging.getLogger(__name__)
 
+try:
+    CONVERTER_VERSION = version("envidat-converter")
+except PackageNotFoundError:
+    CONVERTER_VERSION = "unknown"
+
+# Base64 encoded DataCite XML, keyed by hash of package and converter version
+datacite_xml_cache = TTLCache(
+    maxsize=config_app.DATACITE_XML_CACHE_SIZE,
+    ttl=config_app.DATACITE_XML_CACHE_TTL,
+)
+
+# Worker processes for conversion, started and stopped with the app
+conversion_pool = ConversionPool(
+    processes=config_app.CONVERSION_PROCESSES,
+    inprocess_max_size=config_app.CONVERSION_INPROCESS_MAX_SIZE,
+)
+# Resolution of external DOIs by doi.org, as (status code to raise, detail)
+doi_resolution_cache = TTLCache(
+    maxsize=config_app.DOI_RESOLVE_CACHE_SIZE,
+    ttl=config_app.DOI_RESOLVE_CACHE_TTL,
+)
+
+stats_collector.register("conversion_pool", conversion_pool.stats)
+stats_collector.register("datacite_xml_cache", datacite_xml_cache.stats)
+stats_collector.register("doi_resolution_cache", doi_resolution_cache.stats)
+
 
 class DoiSuccess(TypedDict):
-    """DOI success class."""
+    """DOI success class.
+
+    'unchanged' is True if publication was skipped because DataCite already has
+    the same metadata.
+    """
 
     status_code: int
     result: dict
+    unchanged: NotRequired[bool]
 
 
 class DoiErrors(TypedDict):
@@ -28,9 +64,47 @@ class DoiErrors(TypedDict):
 
     status_code: int
     errors: list[dict]
+    retry_after: NotRequired[float]
+
+
+# Shared connection pool for DataCite and doi.org calls
+_datacite_client: httpx.AsyncClient | None = None
+
+
+def get_datacite_client() -> httpx.AsyncClient:
+    """Return shared async HTTP client for DataCite, creating it if needed.
+
+    Timeouts are derived from 'DATACITE_TIMEOUT' and the client keeps up to
+    'DATACITE_POOL_SIZE' keep-alive connections open.
+    DataCite credentials are passed per request, not set on the client, because
+    the client is also used to resolve external DOIs.
+    """
+    global _datacite_client
+    if _datacite_client is None or _datacite_client.is_closed:
+        log.debug("Opening DataCite HTTP client")
+        _datacite_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config_app.DATACITE_TIMEOUT),
+            transport=instrumented_transport(
+                "datacite",
+                limits=httpx.Limits(
+                    max_connections=config_app.DATACITE_POOL_SIZE,
+                    max_keepalive_connections=config_app.DATACITE_POOL_SIZE,
+                ),
+            ),
+        )
+    return _datacite_client
 
 
-def reserve_draft_doi_datacite(doi: str) -> DoiSuccess | DoiErrors:
+async def close_datacite_client():
+    """Close shared DataCite HTTP client and its connections."""
+    global _datacite_client
+    if _datacite_client is not None:
+        log.debug("Closing DataCite HTTP client")
+        await _datacite_client.aclose()
+        _datacite_client = None
+
+
+async def reserve_draft_doi_datacite(doi: str) -> DoiSuccess | DoiErrors:
     """Reserve a DOI identifer in "Draft" state with DataCite.
 
     For relevant DataCite documentation see:
@@ -48,26 +122,25 @@ def reserve_draft_doi_datacite(doi: str) -> DoiSuccess | DoiErrors:
     api_url = config_app.DATACITE_API_URL
     client_id = config_app.DATACITE_CLIENT_ID
     password = config_app.DATACITE_PASSWORD
-    timeout = config_app.DATACITE_TIMEOUT
 
     # Assign DOI to payload in DataCite format
     payload = {"data": {"type": "dois", "attributes": {"doi": doi}}}
 
     # Convert payload to JSON and then send POST request to DataCite API
-    payload_json = json.dumps(payload)
+    payload_json = orjson.dumps(payload)
     headers = {"Content-Type": "application/vnd.api+json"}
 
     try:
-        log.debug(f"Attempting POST to {api_url} with params: {payload_json}")
-        response = requests.post(
+        log.debug(f"Attempting POST to {api_url} with params: {payload}")
+        response = await get_datacite_client().post(
             api_url,
             headers=headers,
             auth=(client_id, password),
-            data=payload_json,
-            timeout=timeout,
+            content=payload_json,
+            extensions={"operation": "reserve_draft"},
         )
 
-    except requests.exceptions.ConnectTimeout as e:
+    except httpx.ConnectTimeout as e:
         log.exception(e)
         return {"status_code": 408, "errors": [{"error": "Connection timed out"}]}
 
@@ -82,7 +155,7 @@ def reserve_draft_doi_datacite(doi: str) -> DoiSuccess | DoiErrors:
     return format_response(response)
 
 
-def publish_datacite(package: dict) -> DoiSuccess | DoiErrors:
+async def publish_datacite(package: dict) -> DoiSuccess | DoiErrors:
     """Publish/update an EnviDat record in DataCite.
 
        Converts EnviDat record to DataCite XML format before publication.
@@ -103,40 +176,22 @@ def publish_datacite(package: dict) -> DoiSuccess | DoiErrors:
     api_url = config_app.DATACITE_API_URL
     client_id = config_app.DATACITE_CLIENT_ID
     password = config_app.DATACITE_PASSWORD
-    site_url = config_app.DATACITE_DATA_URL_PREFIX
-    timeout = config_app.DATACITE_TIMEOUT
 
     # Extract and validate doi, if 'doi' does not exist then raises HTTPException
     # Validate that prefix assigned to 'doi' is the configured EnviDat DOI prefix
     doi = validate_doi(package, has_envidat_prefix=True)
 
     # Get metadata record URL
-    name = package.get("name", package["id"])
-    url = f"{site_url}/{name}"
-
-    # Assign name_doi_map used in DataCite conversion
-
-    # Assign conversion_error to return if conversion of package to
-    # DataCite XML fails
-    conversion_error = {
-        "status_code": 500,
-        "errors": [{"error": "Failed to convert package to DataCite format XML"}],
-    }
+    url = get_package_url(package)
 
     # Convert metadata record to DataCite formatted XML
     # and encode to base64 formatted string
-    try:
-        xml = EnviDatToDataCite(package)
-        if xml:
-            xml_to_str = xml.__str__()
-            xml_encoded = xml_to_base64(xml_to_str)
-            if not xml_encoded:
-                return conversion_error
-        else:
-            return conversion_error
-    except ValueError as e:
-        log.error(e)
-        return conversion_error
+    xml_encoded = await package_to_datacite_xml_base64(package)
+    if not xml_encoded:
+        return {
+            "status_code": 500,
+            "errors": [{"error": "Failed to convert package to DataCite format XML"}],
+        }
 
     # Create payload, set "event" to "publish"
     payload = {
@@ -154,19 +209,19 @@ def publish_datacite(package: dict) -> DoiSuccess | DoiErrors:
 
     # Convert payload to JSON and then send PUT request to DataCite
     url = f"{api_url}/{doi}"
-    payload_json = json.dumps(payload)
+    payload_json = orjson.dumps(payload)
     headers = {"Content-Type": "application/vnd.api+json"}
 
     try:
-        response = requests.put(
+        response = await get_datacite_client().put(
             url,
             headers=headers,
             auth=(client_id, password),
-            data=payload_json,
-            timeout=timeout,
+            content=payload_json,
+            extensions={"operation": "publish"},
         )
 
-    except requests.exceptions.ConnectTimeout as e:
+    except httpx.ConnectTimeout as e:
         log.exception(e)
         return {"status_code": 408, "errors": [{"error": "Connection timed out"}]}
 
@@ -181,24 +236,132 @@ def publish_datacite(package: dict) -> DoiSuccess | DoiErrors:
     return format_response(response)
 
 
-def format_response(response: requests.models.Response) -> DoiSuccess | DoiErrors:
+async def iter_datacite_dois(page_size: int) -> AsyncIterator[list[dict]]:
+    """Yield DOIs of the DataCite client page by page, as 'doi' and 'state'.
+
+    DOIs are sorted by DOI ('name'), following DataCite cursor pagination.
+    Only one page is held in memory.
+    Draft DOIs are included because the request is authenticated.
+    Raises HTTPException if DataCite does not return a page.
+
+    For relevant DataCite documentation see:
+    https://support.datacite.org/docs/pagination#method-2-cursor
+
+    Args:
+        page_size (int): number of DOIs requested per page, at most 1000
+    """
+    url = config_app.DATACITE_API_URL
+    params = {
+        "client-id": config_app.DATACITE_CLIENT_ID.lower(),
+        "page[size]": page_size,
+        "page[cursor]": 1,
+        "sort": "name",
+        "fields[dois]": "doi,state",
+    }
+    while url:
+        try:
+            response = await get_datacite_client().get(
+                url,
+                params=params,
+                auth=(config_app.DATACITE_CLIENT_ID, config_app.DATACITE_PASSWORD),
+                extensions={"operation": "list_dois"},
+            )
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            log.exception("Failed listing DOIs with DataCite")
+            raise HTTPException(
+                status_code=502, detail="Failed listing DOIs with DataCite"
+            ) from e
+
+        data = body.get("data") or []
+        if not data:
+            return
+        yield [
+            {
+                "doi": item.get("attributes", {}).get("doi") or item.get("id"),
+                "state": item.get("attributes", {}).get("state"),
+            }
+            for item in data
+        ]
+        # Link to next page already contains all query parameters
+        url = body.get("links", {}).get("next")
+        params = None
+
+
+def get_package_url(package: dict) -> str:
+    """Return URL of EnviDat package registered with DataCite."""
+    name = package.get("name", package["id"])
+    return f"{config_app.DATACITE_DATA_URL_PREFIX}/{name}"
+
+
+async def datacite_digest(package: dict) -> str | None:
+    """Return digest of DataCite XML and URL published for package.
+
+    Equal digests mean publishing the package would not change DataCite.
+    Returns None if conversion to DataCite XML fails.
+    """
+    if not (xml_encoded := await package_to_datacite_xml_base64(package)):
+        return None
+    return stable_hash({"xml": xml_encoded, "url": get_package_url(package)})
+
+
+async def package_to_datacite_xml_base64(package: dict) -> str | None:
+    """Convert EnviDat package to base64 encoded DataCite XML.
+
+    Results are cached by a hash of the package and converter version, so
+    retries and repeated publication of unchanged packages skip the conversion.
+    Large packages are converted in 'conversion_pool' worker processes.
+    Returns None if conversion fails, failures are not cached.
+
+    Args:
+        package (dict): Individual EnviDat metadata entry record dictionary.
+    """
+    package_json = stable_json(package)
+    key = (hashlib.sha256(package_json).hexdigest(), CONVERTER_VERSION)
+    if (xml_encoded := datacite_xml_cache.get(key)) is not None:
+        return xml_encoded
+
+    with timed("conversion"):
+        xml_encoded = await conversion_pool.convert(package, len(package_json))
+    if xml_encoded:
+        datacite_xml_cache.set(key, xml_encoded)
+    return xml_encoded
+
+
+def format_response(response: httpx.Response) -> DoiSuccess | DoiErrors:
     """Format the DataCite response.
 
     Checks if response has successful HTTP status code (200-299) and returns
     DataCite response object formatted in DoiSuccess or DoiErrors format.
+    DoiErrors includes 'retry_after' (seconds) if DataCite sent a Retry-After header.
+    Bodies that are not JSON, for example HTML error pages of a gateway, are
+    returned as error 'title'.
 
     Args:
-        response (requests.models.Response): Response from call to DataCite API
+        response (httpx.Response): Response from call to DataCite API
 
     Returns:
         DoiSuccess | DoiErrors: See TypedDict class definitions
     """
-    response_json = response.json()
+    try:
+        response_json = response.json()
+    except ValueError:
+        response_json = None
+    if not isinstance(response_json, dict):
+        response_json = {
+            "errors": [
+                {
+                    "status": str(response.status_code),
+                    "title": response.text[:1000] or response.reason_phrase,
+                }
+            ]
+        }
 
     successful_status_codes = range(200, 300)
 
     if response.status_code in successful_status_codes:
-        doi = response_json.get("data").get("id")
+        doi = (response_json.get("data") or {}).get("id")
         if doi:
             return {"status_code": response.status_code, "result": response_json}
         else:
@@ -212,10 +375,15 @@ def format_response(response: requests.models.Response) -> DoiSuccess | DoiError
                 ],
             }
     else:
-        return {
+        datacite_errors = {
             "status_code": response.status_code,
             "errors": response_json.get("errors"),
         }
+        if (
+            retry_after := parse_retry_after(response.headers.get("Retry-After"))
+        ) is not None:
+            datacite_errors["retry_after"] = retry_after
+        return datacite_errors
 
 
 def validate_doi(package: dict, has_envidat_prefix: bool = False):
@@ -253,24 +421,6 @@ def validate_doi(package: dict, has_envidat_prefix: bool = False):
     return doi
 
 
-def xml_to_base64(xml: str) -> str:
-    """Converts XML formatted string to base64 formatted string.
-
-       Returns string in base64 format (not bytes)
-
-    Args:
-        xml (str): String in XML format
-
-    Returns:
-        str: base64 formatted string conversion of input xml_str
-    """
-    if isinstance(xml, str):
-        xml_bytes = xml.encode("utf-8")
-        xml_encoded = base64.b64encode(xml_bytes)
-        xml_str = xml_encoded.decode()
-        return xml_str
-
-
 def get_error_message(datacite_response: DoiSuccess | DoiErrors) -> str:
     """Returns error message string extracted from formatted DataCite response.
 
@@ -281,17 +431,89 @@ def get_error_message(datacite_response: DoiSuccess | DoiErrors) -> str:
     """
     try:
         errors = datacite_response.get("errors", {})
-        return json.dumps(errors)
+        return orjson.dumps(errors).decode()
     except Exception as e:
         log.exception(f"ERROR getting error message from DataCite response:  {e}")
         return "Unknown error"
 
 
-def is_valid_doi(doi: str) -> bool | None:
+def get_doi_cache_key(doi: str) -> str:
+    """Return 'doi_resolution_cache' key, DOIs are case-insensitive."""
+    return doi.removeprefix("https://doi.org/").lower()
+
+
+async def resolve_doi(doi_url: str) -> tuple[int | None, str, float]:
+    """Resolve DOI with doi.org without following the redirect to its target.
+
+    Sends a HEAD request, falls back to GET if HEAD is not allowed.
+
+    Args:
+         doi_url (str): DOI in full URL format (https://doi.org/10.5281/zenodo.6514932)
+
+    Returns:
+        tuple: HTTP status code to raise (None if DOI is valid), error detail and
+               seconds the result may be cached
+    """
+    client = get_datacite_client()
+    try:
+        response = await client.head(
+            doi_url,
+            timeout=config_app.DOI_RESOLVE_TIMEOUT,
+            extensions={"operation": "resolve_doi"},
+        )
+        if response.status_code in (405, 501):
+            response = await client.get(
+                doi_url,
+                timeout=config_app.DOI_RESOLVE_TIMEOUT,
+                extensions={"operation": "resolve_doi"},
+            )
+    except Exception as e:
+        log.exception(e)
+        return (
+            500,
+            f"DOI {doi_url} did not return valid response",
+            config_app.DOI_RESOLVE_ERROR_TTL,
+        )
+
+    status = response.status_code
+    # doi.org redirects registered DOIs to their landing page
+    if response.is_success or response.is_redirect:
+        return None, "", config_app.DOI_RESOLVE_CACHE_TTL
+
+    if status == 404:
+        return (
+            404,
+            f"DOI {doi_url} does not exist",
+            config_app.DOI_RESOLVE_NEGATIVE_TTL,
+        )
+
+    if status == 408:
+        return (
+            408,
+            f"Connection timed out for DOI {doi_url}",
+            config_app.DOI_RESOLVE_ERROR_TTL,
+        )
+
+    log.error(f"HTTP error occurred resolving DOI {doi_url}: {status}")
+    transient = status == 429 or status >= 500
+    return (
+        status,
+        f"DOI {doi_url} did not return a valid response, failed with status {status}",
+        config_app.DOI_RESOLVE_ERROR_TTL
+        if transient
+        else config_app.DOI_RESOLVE_NEGATIVE_TTL,
+    )
+
+
+async def is_valid_doi(doi: str) -> bool | None:
     """Returns True if DOI is valid when called and returns a valid response.
 
     Else raises HTTP exception.
 
+    Results are cached in 'doi_resolution_cache', DOIs that do not exist for
+    'DOI_RESOLVE_NEGATIVE_TTL' seconds and temporary failures for
+    'DOI_RESOLVE_ERROR_TTL' seconds.
+
     Args:
          doi (str): DOI string in either short format (10.5281/zenodo.6514932) or
                     full URL format (https://doi.org/10.5281/zenodo.6514932)
@@ -300,35 +522,13 @@ def is_valid_doi(doi: str) -> bool | None:
     if not doi.startswith("https://doi.org/"):
         doi = f"https://doi.org/{doi}"
 
-    try:
-        response = requests.get(doi, timeout=5)
-
-        if response.ok:
-            return True
-
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail=f"DOI {doi} does not exist")
-
-        if response.status_code == 408:
-            raise HTTPException(
-                status_code=408,
-                detail=f"Connection timed out for DOI {doi}"
-            )
+    cache_key = get_doi_cache_key(doi)
+    if (result := doi_resolution_cache.get(cache_key)) is None:
+        status_code, detail, ttl = await resolve_doi(doi)
+        result = (status_code, detail)
+        doi_resolution_cache.set(cache_key, result, ttl=ttl)
 
-        response.raise_for_status()
-
-    except HTTPError as e:
-        status = e.response.status_code if e.response else 500
-        log.exception(f"HTTP error occurred: {e}")
-        raise HTTPException(
-            status_code=status,
-            detail=f"DOI {doi} did not return a valid response,"
-                   f" failed with status {status}: {str(e)}"
-        )
-
-    except Exception as e:
-        log.exception(e)
-        raise HTTPException(
-            status_code=500,
-            detail=f"DOI {doi} did not return valid response"
-        )
\ No newline at end of file
+    status_code, detail = result
+    if status_code is not None:
+        raise HTTPException(status_code=status_code, detail=detail)
+    return True
@@ -0,0 +1,323 @@
+"""Import DOIs registered on external platforms for many CKAN packages."""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from typing import TypeVar
+
+import orjson
+from fastapi import HTTPException
+from tortoise.expressions import Q
+
+from app.logic.datacite import is_valid_doi
+from app.logic.mail import external_import_email
+from app.logic.remote_ckan import (
+    AsyncRemoteCKAN,
+    ckan_package_patch,
+    ckan_package_show,
+)
+from app.models.doi import DoiPrefix, DoiRealisation
+
+log = logging.getLogger(__name__)
+
+# 'site_id' of DOIs imported from external platforms, see minter.DOI_SITE_ID
+EXTERNAL_DOI_SITE_ID = "external"
+
+# Publication states of packages whose external DOI can be imported
+IMPORTABLE_STATES = ("pub_pending", "published", "approved")
+
+T = TypeVar("T")
+
+
+def normalize_doi(doi: str) -> str:
+    """Return DOI in short format (10.5281/zenodo.6514932), also given as URL."""
+    return doi.strip().removeprefix("https://doi.org/")
+
+
+def get_doi_query(dois: Iterable[str]) -> Q:
+    """Return query matching any of the DOIs, case-insensitively."""
+    return Q(
+        *[
+            Q(prefix_id=doi.partition("/")[0], suffix_id__iexact=doi.partition("/")[2])
+            for doi in dois
+        ],
+        join_type=Q.OR,
+    )
+
+
+async def gather_limited(
+    items: Iterable[T], func: Callable[[T], Awaitable], concurrency: int
+) -> list:
+    """Return results of func for each item, at most 'concurrency' at a time.
+
+    HTTPExceptions raised by func are returned as result.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item: T):
+        async with semaphore:
+            try:
+                return await func(item)
+            except HTTPException as e:
+                return e
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+async def check_external_doi(package_id: str, doi: str, ckan: AsyncRemoteCKAN) -> dict:
+    """Return package if its external DOI can be imported.
+
+    Raises HTTPException if the package cannot be read, is not in an importable
+    publication state or has another DOI, or if the DOI does not resolve.
+    """
+    package = await ckan_package_show(package_id, ckan)
+
+    publication_state = package.get("publication_state")
+    if publication_state not in IMPORTABLE_STATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Value for 'publication_state' cannot be processed: "
+                   f"'{publication_state}' is not one of the following: "
+                   f"{', '.join(IMPORTABLE_STATES)}",
+        )
+
+    package_doi = normalize_doi(package.get("doi") or "")
+    if package_doi and package_doi.lower() != normalize_doi(doi).lower():
+        raise HTTPException(
+            status_code=409,
+            detail=f"Package already has DOI '{package_doi}'",
+        )
+
+    await is_valid_doi(doi)
+    return package
+
+
+async def register_doi_prefixes(prefix_ids: set[str]):
+    """Insert DOI prefixes missing from 'doi_prefix'.
+
+    DOI rows reference their prefix, so prefixes of external DOIs
+    must be registered before the DOIs.
+    """
+    existing = await DoiPrefix.filter(prefix_id__in=prefix_ids).values_list(
+        "prefix_id", flat=True
+    )
+    # Prefixes inserted concurrently by another import are skipped
+    await DoiPrefix.bulk_create(
+        [
+            DoiPrefix(prefix_id=prefix_id, description="External DOI prefix")
+            for prefix_id in sorted(prefix_ids - set(existing))
+        ],
+        ignore_conflicts=True,
+    )
+
+
+async def register_external_dois(
+    packages: dict[str, tuple[str, dict]], user_name: str
+) -> dict[str, HTTPException]:
+    """Insert DOIs of packages into the DOI database with one bulk insert.
+
+    DOIs already registered for the same package are skipped, so imports can
+    be repeated. DOIs are compared case-insensitively.
+
+    Args:
+        packages (dict): (DOI, CKAN package) by requested package id or name
+        user_name (str): CKAN user name of admin importing the DOIs
+
+    Returns:
+        dict: errors by package id or name, for DOIs registered for another
+              package
+    """
+    if not packages:
+        return {}
+
+    query = get_doi_query(doi for doi, _ in packages.values())
+    registered = {
+        f"{row['prefix_id']}/{row['suffix_id']}".lower(): str(row["ckan_id"])
+        for row in await DoiRealisation.filter(query).values(
+            "prefix_id", "suffix_id", "ckan_id"
+        )
+    }
+
+    errors = {}
+    new_dois = {}
+    for package_id, (doi, package) in packages.items():
+        if (ckan_id := registered.get(doi.lower())) is None:
+            registered[doi.lower()] = package.get("id")
+            new_dois[package_id] = (doi, package)
+        elif ckan_id != package.get("id"):
+            errors[package_id] = HTTPException(
+                status_code=409,
+                detail=f"DOI '{doi}' is already registered for another package",
+            )
+
+    await register_doi_prefixes(
+        {doi.partition("/")[0] for doi, _ in new_dois.values()}
+    )
+    # Rows of DOIs inserted concurrently by another import are skipped
+    await DoiRealisation.bulk_create(
+        [
+            DoiRealisation(
+                prefix_id=doi.partition("/")[0],
+                suffix_id=doi.partition("/")[2],
+                ckan_id=package.get("id"),
+                ckan_name=package.get("name"),
+                site_id=EXTERNAL_DOI_SITE_ID,
+                tag_id=EXTERNAL_DOI_SITE_ID,
+                ckan_user=user_name,
+                metadata=orjson.dumps(package).decode(),
+                metadata_format="ckan",
+                ckan_entity="package",
+            )
+            for doi, package in new_dois.values()
+        ],
+        ignore_conflicts=True,
+    )
+    errors.update(await check_registered_dois(new_dois))
+    log.info(f"Registered {len(new_dois)} external DOIs, {len(errors)} conflicts")
+    return errors
+
+
+async def check_registered_dois(
+    new_dois: dict[str, tuple[str, dict]],
+) -> dict[str, HTTPException]:
+    """Return errors for DOIs registered for another package by a concurrent import.
+
+    The unique constraints are case-sensitive, so the same DOI in another case
+    can be inserted concurrently. The earliest row of a DOI is kept, rows
+    inserted for other packages are deleted.
+
+    Args:
+        new_dois (dict): (DOI, CKAN package) by requested package id or name,
+                         inserted by register_external_dois()
+
+    Returns:
+        dict: errors by package id or name
+    """
+    if not new_dois:
+        return {}
+
+    first_rows = {}
+    for row in await DoiRealisation.filter(
+        get_doi_query(doi for doi, _ in new_dois.values())
+    ).order_by("doi_pk").values("doi_pk", "prefix_id", "suffix_id", "ckan_id"):
+        first_rows.setdefault(f"{row['prefix_id']}/{row['suffix_id']}".lower(), row)
+
+    errors = {}
+    for package_id, (doi, package) in new_dois.items():
+        row = first_rows.get(doi.lower())
+        if row is not None and str(row["ckan_id"]) == package.get("id"):
+            continue
+        errors[package_id] = HTTPException(
+            status_code=409,
+            detail=f"DOI '{doi}' is already registered for another package",
+        )
+        own_rows = DoiRealisation.filter(
+            get_doi_query([doi]),
+            ckan_id=package.get("id"),
+            site_id=EXTERNAL_DOI_SITE_ID,
+        )
+        if row is not None:
+            own_rows = own_rows.exclude(doi_pk=row["doi_pk"])
+        await own_rows.delete()
+    return errors
+
+
+async def import_external_dois(
+    dois: dict[str, str],
+    ckan: AsyncRemoteCKAN,
+    admin_info: dict,
+    concurrency: int,
+    send_email: bool = False,
+) -> dict:
+    """Import external DOIs of many CKAN packages.
+
+    DOIs are validated concurrently, registered in the DOI database with one
+    bulk insert and the packages are then published in CKAN concurrently.
+    One summary email is sent to the admin if 'send_email' is True.
+
+    Args:
+        dois (dict): external DOI by CKAN package id or name
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
+        admin_info (dict): CKAN user info of admin importing the DOIs
+        concurrency (int): maximum packages validated or patched at a time
+        send_email (bool): True to send the summary email
+
+    Returns:
+        dict: 'results' with 'package_id', 'doi', 'status_code' and 'detail'
+              for each package, and a 'summary'
+    """
+    start = time.monotonic()
+    errors: dict[str, HTTPException] = {}
+
+    checked = await gather_limited(
+        dois.items(),
+        lambda item: check_external_doi(item[0], item[1], ckan),
+        concurrency,
+    )
+    packages = {}
+    for (package_id, doi), package in zip(dois.items(), checked):
+        if isinstance(package, HTTPException):
+            errors[package_id] = package
+        else:
+            packages[package_id] = (doi, package)
+
+    errors.update(
+        await register_external_dois(packages, admin_info.get("name") or "admin")
+    )
+    to_publish = [
+        (package_id, doi)
+        for package_id, doi in dois.items()
+        if package_id not in errors
+    ]
+
+    patched = await gather_limited(
+        to_publish,
+        lambda item: ckan_package_patch(
+            item[0],
+            {"doi": item[1], "private": False, "publication_state": "published"},
+            ckan,
+        ),
+        concurrency,
+    )
+    for (package_id, _), response in zip(to_publish, patched):
+        if isinstance(response, HTTPException):
+            errors[package_id] = response
+
+    results = []
+    for package_id, doi in dois.items():
+        if error := errors.get(package_id):
+            results.append(
+                {
+                    "package_id": package_id,
+                    "doi": doi,
+                    "status_code": error.status_code,
+                    "detail": error.detail,
+                }
+            )
+        else:
+            results.append(
+                {
+                    "package_id": package_id,
+                    "doi": doi,
+                    "status_code": 200,
+                    "detail": "Published with external DOI",
+                }
+            )
+
+    summary = {
+        "total": len(results),
+        "imported": len(results) - len(errors),
+        "failed": len(errors),
+        "duration_seconds": round(time.monotonic() - start, 3),
+    }
+    log.info(f"External DOI import finished: {summary}")
+
+    if send_email and (admin_email := admin_info.get("email")):
+        await external_import_email(
+            admin_info.get("display_name") or admin_info.get("name", ""),
+            admin_email,
+            results,
+        )
+
+    return {"results": results, "summary": summary}
@@ -0,0 +1,240 @@
+"""Background processing of queued DataCite jobs.
+
+Jobs are stored in the 'datacite_job' table so they survive restarts.
+Each worker claims queued jobs with SELECT ... FOR UPDATE SKIP LOCKED,
+so several API workers can process the same queue without running a job twice.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+
+import orjson
+from fastapi import HTTPException
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from app.config import config_app
+from app.logic.publish import publish_package
+from app.logic.remote_ckan import get_ckan
+from app.models.job import DataciteJob, JobStatus, JobType
+
+log = logging.getLogger(__name__)
+
+# Seconds after 'JOB_TIMEOUT' until a running job is considered stale,
+# so the worker running it has time to record its timeout first
+STALE_JOB_GRACE_PERIOD = 60
+
+
+async def enqueue_publish_job(
+    package_id: str, admin_info: dict, is_external_doi: bool = False
+) -> DataciteJob:
+    """Queue job to publish or update CKAN package with DataCite.
+
+    If a publish job for the package is already queued or running then that job
+    is returned instead of creating a new one.
+    """
+    if job := await DataciteJob.filter(
+        job_type=JobType.PUBLISH,
+        package_id=package_id,
+        status__in=[JobStatus.QUEUED, JobStatus.RUNNING],
+    ).first():
+        log.debug(f"Publish job already exists for package '{package_id}': {job}")
+        return job
+
+    job = await DataciteJob.create(
+        job_type=JobType.PUBLISH,
+        package_id=package_id,
+        params={
+            "is_external_doi": is_external_doi,
+            "admin_info": {
+                "name": admin_info.get("name"),
+                "email": admin_info.get("email"),
+            },
+        },
+        ckan_user=admin_info.get("name") or "admin",
+    )
+    log.info(f"Queued {job} for package '{package_id}'")
+    job_worker.notify()
+    return job
+
+
+async def claim_next_job() -> DataciteJob | None:
+    """Mark oldest queued job as running and return it, or None if queue is empty.
+
+    Rows locked by other workers are skipped.
+    """
+    async with in_transaction() as conn:
+        job = (
+            await DataciteJob.filter(status=JobStatus.QUEUED)
+            .order_by("date_created")
+            .select_for_update(skip_locked=True)
+            .using_db(conn)
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = JobStatus.RUNNING
+        job.attempts += 1
+        job.date_started = timezone.now()
+        await job.save(
+            using_db=conn, update_fields=["status", "attempts", "date_started"]
+        )
+
+    return job
+
+
+async def requeue_stale_jobs() -> int:
+    """Requeue jobs left running after a crash.
+
+    Running jobs are stopped by run_job() after 'JOB_TIMEOUT', so jobs still
+    running after 'STALE_JOB_GRACE_PERIOD' more seconds were abandoned.
+    Jobs that already used 'JOB_MAX_ATTEMPTS' attempts are marked as failed.
+    Returns number of requeued jobs.
+    """
+    stale = DataciteJob.filter(
+        status=JobStatus.RUNNING,
+        date_started__lt=timezone.now()
+        - timedelta(seconds=config_app.JOB_TIMEOUT + STALE_JOB_GRACE_PERIOD),
+    )
+    failed_count = await stale.filter(attempts__gte=config_app.JOB_MAX_ATTEMPTS).update(
+        status=JobStatus.FAILED,
+        status_code=504,
+        result={"detail": "Job did not finish in time"},
+        date_finished=timezone.now(),
+    )
+    requeued_count = await stale.filter(
+        attempts__lt=config_app.JOB_MAX_ATTEMPTS
+    ).update(status=JobStatus.QUEUED)
+
+    if failed_count or requeued_count:
+        log.warning(
+            f"Stale jobs: {requeued_count} requeued, {failed_count} marked failed"
+        )
+    return requeued_count
+
+
+async def run_job(job: DataciteJob):
+    """Run claimed job and store its result.
+
+    Jobs running longer than 'JOB_TIMEOUT' are stopped and marked as failed,
+    they are not requeued as they may have been published already.
+    """
+    log.info(f"Running {job} for package '{job.package_id}'")
+    ckan = get_ckan(config_app.CKAN_API_TOKEN)
+
+    try:
+        response = await asyncio.wait_for(
+            publish_package(
+                job.package_id,
+                ckan,
+                job.params.get("admin_info", {}),
+                job.params.get("is_external_doi", False),
+            ),
+            config_app.JOB_TIMEOUT,
+        )
+        status_code = response.status_code
+        result = orjson.loads(response.body)
+    except asyncio.TimeoutError:
+        log.error(f"{job} did not finish within {config_app.JOB_TIMEOUT}s")
+        status_code = 504
+        result = {"detail": "Job did not finish in time"}
+    except HTTPException as e:
+        status_code = e.status_code
+        result = {"detail": e.detail}
+    except Exception as e:
+        log.exception(f"Unexpected error running {job}")
+        status_code = 500
+        result = {"detail": str(e)}
+
+    job.status = (
+        JobStatus.SUCCEEDED if status_code in range(200, 300) else JobStatus.FAILED
+    )
+    job.status_code = status_code
+    job.result = result
+    job.date_finished = timezone.now()
+    await job.save(
+        update_fields=["status", "status_code", "result", "date_finished"]
+    )
+    log.info(f"Finished {job} with status '{job.status.value}' ({status_code})")
+
+
+class JobWorker:
+    """Poll job queue and run up to 'concurrency' jobs at a time."""
+
+    def __init__(self, concurrency: int, poll_interval: float):
+        """Create stopped worker."""
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if worker can process jobs."""
+        return bool(config_app.CKAN_API_TOKEN) and self.concurrency > 0
+
+    def notify(self):
+        """Wake up worker to check queue immediately."""
+        self._wakeup.set()
+
+    def start(self):
+        """Start polling in background task."""
+        if not self.enabled:
+            log.warning("Job worker disabled, CKAN_API_TOKEN or JOB_CONCURRENCY unset")
+            return
+        if self._task is None:
+            log.debug(f"Starting job worker with concurrency {self.concurrency}")
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Stop polling and cancel running jobs, which are queued again."""
+        if self._task is None:
+            return
+        log.debug("Stopping job worker")
+        self._task.cancel()
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(self._task, *self._running, return_exceptions=True)
+        self._task = None
+
+    async def _poll(self):
+        """Claim queued jobs while below concurrency limit, then wait."""
+        while True:
+            try:
+                await requeue_stale_jobs()
+                while len(self._running) < self.concurrency:
+                    if (job := await claim_next_job()) is None:
+                        break
+                    task = asyncio.create_task(self._process(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            except Exception:
+                log.exception("Job worker failed polling queue")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, job: DataciteJob):
+        """Run job, requeue it if worker is stopped before it finishes."""
+        try:
+            await run_job(job)
+        except asyncio.CancelledError:
+            log.warning(f"{job} interrupted, returning it to queue")
+            job.status = JobStatus.QUEUED
+            await job.save(update_fields=["status"])
+            raise
+        finally:
+            self.notify()
+
+
+job_worker = JobWorker(
+    concurrency=config_app.JOB_CONCURRENCY,
+    poll_interval=config_app.JOB_POLL_INTERVAL,
+)
@@ -1,14 +1,222 @@
-"""Send emails via mailer API."""
+"""Send emails via mailer API.
 
+Emails are written to the 'email_outbox' table and delivered by MailSender
+in the background, so callers do not wait for the mailer API.
+Failed deliveries are retried with backoff, after 'MAIL_MAX_ATTEMPTS' failed
+attempts an email is marked as dead and left in the outbox for inspection.
+"""
+
+import asyncio
 import logging
+from datetime import timedelta
 
-import requests
+import httpx
+from tortoise import timezone
+from tortoise.expressions import F
 
 from app.config import config_app
+from app.logic.metrics import instrumented_transport, record_retry
+from app.logic.retry import RetryPolicy
+from app.logic.timing import timed
+from app.models.mail import EmailMessage, EmailStatus
 from app.utils import fix_url_double_slash
 
 log = logging.getLogger(__name__)
 
+# Shared connection pool for mailer API calls
+_mail_client: httpx.AsyncClient | None = None
+
+mail_retry_policy = RetryPolicy(
+    retries=config_app.MAIL_MAX_ATTEMPTS,
+    base_delay=config_app.MAIL_RETRY_DELAY,
+    max_delay=config_app.MAIL_RETRY_DELAY * 2**config_app.MAIL_MAX_ATTEMPTS,
+    deadline=float("inf"),
+    upstream="mailer",
+)
+
+
+def get_mail_client() -> httpx.AsyncClient:
+    """Return shared async HTTP client for mailer API, creating it if needed."""
+    global _mail_client
+    if _mail_client is None or _mail_client.is_closed:
+        log.debug("Opening mailer HTTP client")
+        _mail_client = httpx.AsyncClient(
+            timeout=config_app.MAIL_TIMEOUT,
+            headers={"Content-Type": "application/json"},
+            transport=instrumented_transport("mailer"),
+        )
+    return _mail_client
+
+
+async def close_mail_client():
+    """Close shared mailer HTTP client and its connections."""
+    global _mail_client
+    if _mail_client is not None:
+        log.debug("Closing mailer HTTP client")
+        await _mail_client.aclose()
+        _mail_client = None
+
+
+async def queue_email(template: str, params: dict) -> EmailMessage | None:
+    """Save email to outbox and hand it to the background sender.
+
+    Errors are logged and not raised, a failed email must not fail the
+    request that triggered it.
+
+    Args:
+        template (str): mailer API template name, for example 'datacite-request'
+        params (dict): JSON payload for the template
+    """
+    try:
+        with timed("email"):
+            message = await EmailMessage.create(
+                template=template, payload=params, next_attempt_at=timezone.now()
+            )
+    except Exception:
+        log.exception(f"Failed queuing '{template}' email")
+        return None
+
+    log.debug(f"Queued {message}")
+    mail_sender.submit(message.message_pk)
+    return message
+
+
+async def deliver_email(message_pk: int) -> EmailStatus | None:
+    """Send email from outbox to mailer API and record the outcome.
+
+    The email is claimed first, so it is skipped if it was already sent or is
+    being sent by another worker.
+
+    Returns:
+        EmailStatus | None: new status, None if email was not claimed
+    """
+    now = timezone.now()
+    # Claim email, next_attempt_at acts as lease in case the worker dies
+    claimed = await EmailMessage.filter(
+        message_pk=message_pk,
+        status=EmailStatus.PENDING,
+        next_attempt_at__lte=now,
+    ).update(
+        status=EmailStatus.SENDING,
+        attempts=F("attempts") + 1,
+        next_attempt_at=now + timedelta(seconds=config_app.MAIL_TIMEOUT * 10),
+    )
+    if not claimed:
+        return None
+
+    message = await EmailMessage.get(message_pk=message_pk)
+    url = f"{config_app.EMAIL_ENDPOINT}/templates/{message.template}/json"
+    log.debug(f"Sending {message} to {url}")
+
+    try:
+        r = await get_mail_client().post(
+            fix_url_double_slash(url),
+            json=message.payload,
+            extensions={"operation": message.template},
+        )
+        log.debug(f"Email API response: {r.status_code}")
+        r.raise_for_status()
+    # Any failure is recorded on the row, so it is retried or marked dead
+    except Exception as e:  # noqa: BLE001
+        message.last_error = repr(e)
+        if message.attempts >= config_app.MAIL_MAX_ATTEMPTS:
+            log.error(f"Giving up on {message} after {message.attempts} attempts: {e}")
+            message.status = EmailStatus.DEAD
+        else:
+            delay = mail_retry_policy.get_delay(message.attempts)
+            response = getattr(e, "response", None)
+            record_retry(
+                "mailer",
+                response.status_code if response is not None else type(e).__name__,
+            )
+            log.warning(f"Failed sending {message}, retrying in {delay:.0f}s: {e}")
+            message.status = EmailStatus.PENDING
+            message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    else:
+        message.status = EmailStatus.SENT
+        message.date_sent = timezone.now()
+
+    await message.save(
+        update_fields=["status", "last_error", "next_attempt_at", "date_sent"]
+    )
+    return message.status
+
+
+async def reset_stale_emails() -> int:
+    """Return emails stuck in 'sending' (lease expired) to 'pending'."""
+    return await EmailMessage.filter(
+        status=EmailStatus.SENDING, next_attempt_at__lt=timezone.now()
+    ).update(status=EmailStatus.PENDING)
+
+
+class MailSender:
+    """Deliver emails from outbox with up to 'concurrency' parallel sends.
+
+    New emails are passed in-process via submit(), emails that are due for a
+    retry or were queued before a restart are picked up by polling the outbox.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float):
+        """Create stopped sender."""
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._queue: asyncio.Queue[int] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def submit(self, message_pk: int):
+        """Send email as soon as a sender task is free."""
+        if self._tasks:
+            self._queue.put_nowait(message_pk)
+
+    def start(self):
+        """Start sender and outbox polling background tasks."""
+        if self._tasks:
+            return
+        log.debug(f"Starting mail sender with concurrency {self.concurrency}")
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._poll())] + [
+            asyncio.create_task(self._send()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """Stop background tasks, unsent emails stay in the outbox."""
+        log.debug("Stopping mail sender")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _send(self):
+        """Deliver emails from in-process queue."""
+        while True:
+            message_pk = await self._queue.get()
+            try:
+                await deliver_email(message_pk)
+            except Exception:
+                log.exception(f"Mail sender failed for email {message_pk}")
+
+    async def _poll(self):
+        """Queue emails from outbox that are due to be sent."""
+        while True:
+            try:
+                await reset_stale_emails()
+                due = await EmailMessage.filter(
+                    status=EmailStatus.PENDING, next_attempt_at__lte=timezone.now()
+                ).order_by("next_attempt_at").limit(100).values_list(
+                    "message_pk", flat=True
+                )
+                for message_pk in due:
+                    self._queue.put_nowait(message_pk)
+            except Exception:
+                log.exception("Mail sender failed polling outbox")
+            await asyncio.sleep(self.poll_interval)
+
+
+mail_sender = MailSender(
+    concurrency=config_app.MAIL_CONCURRENCY,
+    poll_interval=config_app.MAIL_POLL_INTERVAL,
+)
+
 
 async def datacite_failed_email(
     package_id: str, user_name: str, user_email: str, error_msg: str
@@ -26,15 +234,8 @@ async def datacite_failed_email(
             "site_url": config_app.CKAN_API_URL,
         },
     }
-    log.debug(f"Sending DOI task failure email to admin {config_app.EMAIL_FROM}")
-    url = f"{config_app.EMAIL_ENDPOINT}/templates/datacite-task-failed/json"
-    log.debug(f"Email URL: {url}")
-    r = requests.post(
-        fix_url_double_slash(url),
-        headers={"Content-Type": "application/json"},
-        json=params,
-    )
-    log.debug(f"Email API response: {r.status_code}")
+    log.debug(f"Queuing DOI task failure email to admin {config_app.EMAIL_FROM}")
+    await queue_email("datacite-task-failed", params)
 
 
 async def request_approval_email(
@@ -56,15 +257,8 @@ async def request_approval_email(
             "site_url": config_app.CKAN_API_URL,
         },
     }
-    log.debug(f"Sending DOI approval email to admin {config_app.EMAIL_FROM}")
-    url = f"{config_app.EMAIL_ENDPOINT}/templates/datacite-request/json"
-    log.debug(f"Email URL: {url}")
-    r = requests.post(
-        fix_url_double_slash(url),
-        headers={"Content-Type": "application/json"},
-        json=params,
-    )
-    log.debug(f"Email API response: {r.status_code}")
+    log.debug(f"Queuing DOI approval email to admin {config_app.EMAIL_FROM}")
+    await queue_email("datacite-request", params)
 
 
 async def approval_granted_email(package_id: str, user_name: str, emails: list[str]):
@@ -79,12 +273,38 @@ async def approval_granted_email(package_id: str, user_name: str, emails: list[s
             "site_url": config_app.CKAN_API_URL,
         },
     }
-    log.debug(f"Sending DOI approval granted email to {emails}")
-    url = f"{config_app.EMAIL_ENDPOINT}/templates/datacite-published/json"
-    log.debug(f"Email URL: {url}")
-    r = requests.post(
-        fix_url_double_slash(url),
-        headers={"Content-Type": "application/json"},
-        json=params,
-    )
-    log.debug(f"Email API response: {r.status_code}")
+    log.debug(f"Queuing DOI approval granted email to {emails}")
+    await queue_email("datacite-published", params)
+
+
+async def external_import_email(user_name: str, user_email: str, results: list[dict]):
+    """Inform the admin about imported external DOIs, one email per import.
+
+    The 'datacite-external-import' template is not yet provided by the mailer,
+    so the email is only sent on request, see import_external_dois().
+    """
+    params = {
+        "from": config_app.EMAIL_FROM,
+        "to": [user_email, config_app.EMAIL_FROM],
+        "params": {
+            "user_name": user_name,
+            "imported": [
+                {"package_title": result["package_id"], "doi": result["doi"]}
+                for result in results
+                if result["status_code"] in range(200, 300)
+            ],
+            "failed": [
+                {
+                    "package_title": result["package_id"],
+                    "doi": result["doi"],
+                    "error_msg": result["detail"],
+                }
+                for result in results
+                if result["status_code"] not in range(200, 300)
+            ],
+            "package_url_prefix": config_app.DATACITE_DATA_URL_PREFIX,
+            "site_url": config_app.CKAN_API_URL,
+        },
+    }
+    log.debug(f"Queuing external DOI import email to {user_email}")
+    await queue_email("datacite-external-import", params)
@@ -0,0 +1,288 @@
+"""Prometheus metrics for API routes and upstream services.
+
+Upstreams are CKAN, DataCite (including doi.org resolution), the mailer API
+and the database. Metrics are served in Prometheus text format at '/metrics'.
+
+With several server worker processes, set 'PROMETHEUS_MULTIPROC_DIR' to an empty
+directory shared by the workers, so each scrape reports the sum of all workers.
+"""
+
+import logging
+import os
+import time
+from collections.abc import Callable
+
+import httpx
+from asyncpg import Connection
+from asyncpg.connection import LoggedQuery
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY, Collector
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.logic.timing import record_phase
+
+log = logging.getLogger(__name__)
+
+# Directory where prometheus_client stores metrics of all worker processes,
+# read by prometheus_client itself, so not part of the app config
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Keys of stats() dicts that only ever increase, exposed as counters
+COUNTER_STATS = frozenset(
+    {"hits", "misses", "completed", "inprocess", "failed", "restarts", "busy_seconds"}
+)
+
+# Buckets in seconds, from fast DB queries up to slow DataCite publications
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "doi_api_upstream_request_duration_seconds",
+    "Duration of requests to upstream services",
+    ["upstream", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_REQUESTS = Counter(
+    "doi_api_upstream_requests_total",
+    "Requests to upstream services by status code, or exception name on errors",
+    ["upstream", "operation", "status"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "doi_api_upstream_requests_in_flight",
+    "Requests to upstream services waiting for a response",
+    ["upstream"],
+    multiprocess_mode="livesum",
+)
+UPSTREAM_RETRIES = Counter(
+    "doi_api_upstream_retries_total",
+    "Retries of failed upstream requests by status code of the failed attempt",
+    ["upstream", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "doi_api_http_request_duration_seconds",
+    "Duration of API requests until the response is sent",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS = Counter(
+    "doi_api_http_requests_total",
+    "API requests by status code",
+    ["method", "route", "status"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "doi_api_http_requests_in_flight",
+    "API requests being processed",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+
+
+def record_upstream(upstream: str, operation: str, status: str, seconds: float):
+    """Record finished upstream request."""
+    UPSTREAM_LATENCY.labels(upstream, operation).observe(seconds)
+    UPSTREAM_REQUESTS.labels(upstream, operation, status).inc()
+
+
+def record_retry(upstream: str, status: int | str | None):
+    """Record retry of a failed upstream request."""
+    UPSTREAM_RETRIES.labels(upstream, str(status)).inc()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport recording latency, status and in-flight requests.
+
+    The operation label is read from request extension 'operation', pass it with
+    e.g. client.post(url, extensions={"operation": "package_show"}).
+    Duration is also recorded as request phase, named by 'phases' mapping
+    operations to phases, or by upstream for operations not in 'phases'.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        transport: httpx.AsyncBaseTransport,
+        phases: dict[str, str] | None = None,
+    ):
+        """Wrap transport, recording metrics with label 'upstream'."""
+        self.upstream = upstream
+        self.transport = transport
+        self.phases = phases or {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send request and record metrics."""
+        operation = request.extensions.get("operation", "other")
+        in_flight = UPSTREAM_IN_FLIGHT.labels(self.upstream)
+        in_flight.inc()
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            in_flight.dec()
+            seconds = time.perf_counter() - start
+            record_upstream(self.upstream, operation, status, seconds)
+            record_phase(self.phases.get(operation, self.upstream), seconds)
+
+    async def aclose(self):
+        """Close wrapped transport."""
+        await self.transport.aclose()
+
+
+def instrumented_transport(
+    upstream: str, phases: dict[str, str] | None = None, **kwargs
+) -> InstrumentedTransport:
+    """Return instrumented httpx transport, kwargs are passed to the transport."""
+    return InstrumentedTransport(upstream, httpx.AsyncHTTPTransport(**kwargs), phases)
+
+
+def record_db_query(query: LoggedQuery):
+    """Record database query, called by asyncpg after each query."""
+    operation = query.query.lstrip().split(None, 1)[0].upper() if query.query else ""
+    if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        operation = "other"
+    status = "ok" if query.exception is None else type(query.exception).__name__
+    record_upstream("database", operation, status, query.elapsed)
+    record_phase("db", query.elapsed)
+
+
+class InstrumentedConnection(Connection):
+    """asyncpg connection recording query metrics.
+
+    Used as 'connection_class' in the Tortoise ORM credentials.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create connection and register query logger."""
+        super().__init__(*args, **kwargs)
+        self.add_query_logger(record_db_query)
+
+
+class StatsCollector(Collector):
+    """Expose stats() of caches and pools, read when metrics are scraped.
+
+    Caches and pools belong to one process, with 'PROMETHEUS_MULTIPROC_DIR' set
+    they are labelled with the 'pid' of the worker that served the scrape.
+    """
+
+    def __init__(self):
+        """Create collector without sources."""
+        self.sources: dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, stats: Callable[[], dict]):
+        """Add source, 'stats' returns dict of numbers, see COUNTER_STATS."""
+        self.sources[name] = stats
+
+    def collect(self):
+        """Yield one metric per stats key, labelled with source name."""
+        metrics = {}
+        labels = ["component", "pid"] if MULTIPROCESS_DIR else ["component"]
+        pid = str(os.getpid())
+        for name, stats in self.sources.items():
+            try:
+                values = stats()
+            # A failing source must not fail the whole scrape
+            except Exception as e:  # noqa: BLE001
+                log.warning(f"Failed reading stats of '{name}': {e}")
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key not in metrics:
+                    if key in COUNTER_STATS:
+                        family = CounterMetricFamily
+                    else:
+                        family = GaugeMetricFamily
+                    metrics[key] = family(
+                        f"doi_api_component_{key}",
+                        f"'{key}' of cache or pool",
+                        labels=labels,
+                    )
+                metrics[key].add_metric([name, pid][: len(labels)], value)
+        yield from metrics.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def metrics_response_body() -> tuple[bytes, str]:
+    """Return metrics in Prometheus text format and its content type.
+
+    With 'PROMETHEUS_MULTIPROC_DIR' set, metrics of all worker processes are
+    combined from the files in that directory.
+    """
+    if not MULTIPROCESS_DIR:
+        return generate_latest(), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROCESS_DIR)
+    registry.register(stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_metrics_process_dead():
+    """Remove live gauges of this process from 'PROMETHEUS_MULTIPROC_DIR'."""
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(os.getpid(), MULTIPROCESS_DIR)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight API requests.
+
+    Requests are labelled with the route path template, e.g. '/dois/{id}',
+    so label values do not grow with the number of DOIs.
+    """
+
+    def __init__(self, app: ASGIApp, router: Router):
+        """Wrap app, 'router' is used to find the route of a request."""
+        self.app = app
+        self.router = router
+
+    def get_route(self, scope: Scope) -> str:
+        """Return path template of route matching request."""
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unknown")
+        return "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Process request and record metrics."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.get_route(scope)
+        status = "500"
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, status).inc()
@@ -1,48 +1,119 @@
 """Mint new DOIs."""
 
-import json
 import logging
 
+import orjson
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+
 from app.config import config_app
-from app.models.doi import DoiRealisation, DoiRealisationInPydantic
+from app.models.doi import (
+    DoiRealisation,
+    DoiRealisationInPydantic,
+    DoiSuffixCounter,
+)
 
 log = logging.getLogger(__name__)
 
+DOI_SITE_ID = "doi-publishing-api"
 
-async def get_next_doi_suffix_id():
-    """Get the next suffix ID in a prefix sequence."""
-    suffix_ids = (
-        await DoiRealisation.filter(
-            prefix_id=config_app.DOI_PREFIX,
-            suffix_id__startswith=config_app.DOI_SUFFIX_TAG,
-        )
-        .order_by("-suffix_id")
-        .values_list("suffix_id", flat=True)
+# Suffix IDs tried before giving up if they are already taken in the DB
+DOI_MINT_ATTEMPTS = 10
+
+
+async def get_package_db_doi(package_id: str) -> DoiRealisation | None:
+    """Return DOI minted by this API for a CKAN package, or None."""
+    return await DoiRealisation.get_or_none(
+        ckan_id=package_id, site_id=DOI_SITE_ID, ckan_entity="package"
     )
-    ids_only = ", ".join(
-        [suffix.lstrip(config_app.DOI_SUFFIX_TAG) for suffix in suffix_ids]
+
+
+async def get_max_doi_suffix_id(prefix_id: str, tag_id: str) -> int:
+    """Return highest numeric suffix ID minted so far for prefix and suffix tag.
+
+    Scans every matching DOI, so only used to seed DoiSuffixCounter.
+    """
+    suffix_ids = await DoiRealisation.filter(
+        prefix_id=prefix_id,
+        suffix_id__startswith=tag_id,
+    ).values_list("suffix_id", flat=True)
+
+    numeric_ids = []
+    for suffix_id in suffix_ids:
+        try:
+            numeric_ids.append(int(suffix_id.split(".")[-1]))
+        except ValueError:
+            log.warning(f"Skipping non-numeric DOI suffix: {suffix_id}")
+
+    return max(numeric_ids, default=0)
+
+
+async def init_doi_suffix_counter(
+    prefix_id: str = config_app.DOI_PREFIX,
+    tag_id: str = config_app.DOI_SUFFIX_TAG,
+) -> DoiSuffixCounter:
+    """Create suffix counter for prefix and tag, seeded from the current max.
+
+    One-off initializer, returns existing counter if it has already been created
+    (for example by another worker).
+    """
+    counter = await DoiSuffixCounter.get_or_none(prefix_id=prefix_id, tag_id=tag_id)
+    if counter:
+        return counter
+
+    max_suffix_id = await get_max_doi_suffix_id(prefix_id, tag_id)
+    log.info(
+        f"Initializing DOI suffix counter for '{prefix_id}/{tag_id}' "
+        f"at {max_suffix_id}"
     )
-    log.debug(f"Filtered suffix IDs: {ids_only}")
+    try:
+        return await DoiSuffixCounter.create(
+            prefix_id=prefix_id, tag_id=tag_id, last_value=max_suffix_id
+        )
+    except IntegrityError:
+        log.debug("DOI suffix counter already initialized by another process")
+        return await DoiSuffixCounter.get(prefix_id=prefix_id, tag_id=tag_id)
+
 
-    numeric_ids = [int(suffix_id.split(".")[-1]) for suffix_id in suffix_ids]
-    log.debug(f"numeric_ids:  {numeric_ids}")
+async def get_next_doi_suffix_id() -> int:
+    """Get the next suffix ID in a prefix sequence.
 
-    next_suffix_id = max(numeric_ids, default=0) + 1
+    Atomically increments the DoiSuffixCounter row for the configured prefix
+    and suffix tag, so cost does not depend on the number of minted DOIs.
+    """
+    prefix_id = config_app.DOI_PREFIX
+    tag_id = config_app.DOI_SUFFIX_TAG
+
+    if not await DoiSuffixCounter.exists(prefix_id=prefix_id, tag_id=tag_id):
+        await init_doi_suffix_counter(prefix_id, tag_id)
+
+    async with in_transaction() as conn:
+        counter = (
+            await DoiSuffixCounter.select_for_update()
+            .using_db(conn)
+            .get(prefix_id=prefix_id, tag_id=tag_id)
+        )
+        counter.last_value += 1
+        await counter.save(using_db=conn, update_fields=["last_value"])
+
+    next_suffix_id = counter.last_value
     log.debug(f"Generating next DOI suffix in sequence: {next_suffix_id}")
 
     return next_suffix_id
 
 
 async def create_db_doi(user_name: str, package_metadata: dict):
-    """Create a new DOI in the DB."""
+    """Create a new DOI in the DB.
+
+    Safe to call concurrently, also from several workers: suffix IDs are
+    allocated atomically and a suffix ID that is already taken is skipped.
+    If the package already has a DOI in the DB then that DOI is returned.
+    """
     # Return DOI if exists already
     if existing_doi := package_metadata.get("doi", None):
         log.warning(f"DOI already exists for package: {existing_doi}")
         return existing_doi
 
-    next_id = await get_next_doi_suffix_id()
-    log.info(f"Creating new DOI in database: {next_id}")
-
     if not (package_id := package_metadata.get("id", None)):
         log.error("No id present in package metadata")
         return None
@@ -50,42 +121,48 @@ async def create_db_doi(user_name: str, package_metadata: dict):
         log.error("No name present in package metadata")
         return None
 
-    log.debug(f"Creating new DOI for package id: {package_id}")
+    log.debug("Checking database for existing DOI for package")
+    if database_doi := await get_package_db_doi(package_id):
+        log.warning(f"DOI already exists in DB for package: {database_doi}")
+        return str(database_doi)
 
-    new_doi = {
-        "prefix_id": config_app.DOI_PREFIX,
-        "suffix_id": f"{config_app.DOI_SUFFIX_TAG}{next_id}",
-        "ckan_id": package_id,
-        "ckan_name": package_name,
-        "site_id": "doi-publishing-api",
-        "tag_id": config_app.DOI_SUFFIX_TAG,
-        "ckan_user": user_name,
-        "metadata": json.dumps(package_metadata),
-        "metadata_format": "ckan",
-        "ckan_entity": "package",
-    }
-
-    log.debug("Checking database for existing DOI in database")
-    database_doi = await DoiRealisation.get_or_none(
-        prefix_id=new_doi.get("prefix_id"),
-        suffix_id=new_doi.get("suffix_id"),
-    )
+    log.debug(f"Creating new DOI for package id: {package_id}")
+    metadata = orjson.dumps(package_metadata).decode()
+
+    for _ in range(DOI_MINT_ATTEMPTS):
+        next_id = await get_next_doi_suffix_id()
+        log.info(f"Creating new DOI in database: {next_id}")
+
+        new_doi = {
+            "prefix_id": config_app.DOI_PREFIX,
+            "suffix_id": f"{config_app.DOI_SUFFIX_TAG}{next_id}",
+            "ckan_id": package_id,
+            "ckan_name": package_name,
+            "site_id": DOI_SITE_ID,
+            "tag_id": config_app.DOI_SUFFIX_TAG,
+            "ckan_user": user_name,
+            "metadata": metadata,
+            "metadata_format": "ckan",
+            "ckan_entity": "package",
+        }
 
-    if database_doi:
-        log.debug("DOI already exists in DB, continuing to datacite logic")
-    else:
-        log.debug(f"New DOI for validation: {new_doi}")
         try:
             validated_doi = DoiRealisationInPydantic(**new_doi)
             new_doi_dict = validated_doi.dict(exclude_unset=True)
-            log.debug(
-                f"Creating new database DOI with ID: {new_doi_dict.get('doi_pk')}"
-            )
-            await DoiRealisation.create(**new_doi_dict)
         except ValueError as e:
             log.error(f"DOI data failed validation: {e}")
             return None
 
-    return (
-        f"{new_doi_dict.get('prefix_id', None)}/{new_doi_dict.get('suffix_id', None)}"
-    )
+        try:
+            database_doi = await DoiRealisation.create(**new_doi_dict)
+            log.debug(f"Created new database DOI with ID: {database_doi.doi_pk}")
+            return str(database_doi)
+        except IntegrityError as e:
+            # Package DOI was minted by a concurrent request
+            if database_doi := await get_package_db_doi(package_id):
+                log.warning(f"DOI minted concurrently for package: {database_doi}")
+                return str(database_doi)
+            log.warning(f"DOI suffix {next_id} already taken, trying next: {e}")
+
+    log.error(f"Failed creating DOI after {DOI_MINT_ATTEMPTS} attempts")
+    return None
@@ -0,0 +1,61 @@
+"""Keyset pagination of database queries."""
+
+from collections.abc import AsyncIterator
+
+from tortoise.queryset import QuerySet
+
+
+def keyset_page(
+    queryset: QuerySet, key: str, after: int | None, limit: int | None
+) -> QuerySet:
+    """Return query for the 'limit' rows following 'after', ordered by 'key'.
+
+    Unlike OFFSET, cost does not grow with the position in the table.
+
+    Args:
+        queryset (QuerySet): query to paginate
+        key (str): unique, indexed field to order by, for example the primary key
+        after (int | None): value of 'key' of the last row of the previous page,
+                            None for the first page
+        limit (int | None): maximum number of rows, None for all following rows
+    """
+    if after is not None:
+        queryset = queryset.filter(**{f"{key}__gt": after})
+    queryset = queryset.order_by(key)
+    if limit is not None:
+        queryset = queryset.limit(limit)
+    return queryset
+
+
+async def iter_keyset_chunks(
+    queryset: QuerySet,
+    key: str,
+    chunk_size: int,
+    after: int | None = None,
+    limit: int | None = None,
+) -> AsyncIterator[list]:
+    """Yield rows of query in chunks of up to 'chunk_size' rows.
+
+    Only one chunk is held in memory at a time.
+    Works with queries returning models and with '.values()' queries.
+
+    Args:
+        queryset (QuerySet): query to iterate
+        key (str): unique, indexed field to order by, for example the primary key
+        chunk_size (int): maximum number of rows fetched per database query
+        after (int | None): only yield rows with 'key' greater than this value
+        limit (int | None): maximum number of rows yielded in total, default all
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = await keyset_page(queryset, key, after, size)
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < size:
+            return
+        if remaining is not None:
+            remaining -= len(chunk)
+        last = chunk[-1]
+        after = last[key] if isinstance(last, dict) else getattr(last, key)
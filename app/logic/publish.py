@@ -0,0 +1,320 @@
+"""Publish or update CKAN packages with DataCite."""
+
+import asyncio
+import logging
+from collections.abc import AsyncIterable, AsyncIterator
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+
+from app.logic.datacite import (
+    datacite_digest,
+    get_error_message,
+    is_valid_doi,
+    publish_datacite,
+)
+from app.logic.mail import approval_granted_email, datacite_failed_email
+from app.logic.remote_ckan import (
+    AsyncRemoteCKAN,
+    ckan_package_patch,
+    ckan_package_show,
+)
+from app.logic.retry import datacite_retry_policy
+from app.models.doi import DoiRealisation
+
+log = logging.getLogger(__name__)
+
+# Publications started by publish_packages(), referenced so they always finish
+_running_publish_tasks: set[asyncio.Task] = set()
+
+
+async def get_published_digest(doi: str | None) -> dict | None:
+    """Return 'doi_pk' and 'datacite_digest' of DOI in database, or None."""
+    if not doi:
+        return None
+    prefix_id, _, suffix_id = doi.partition("/")
+    return (
+        await DoiRealisation.filter(prefix_id=prefix_id, suffix_id=suffix_id)
+        .first()
+        .values("doi_pk", "datacite_digest")
+    )
+
+
+async def publish_package(
+    package_id: str,
+    ckan: AsyncRemoteCKAN,
+    admin_info: dict,
+    is_external_doi: bool = False,
+    send_email: bool = True,
+) -> ORJSONResponse:
+    """Publish or update CKAN package with DataCite.
+
+    If 'is_external_doi' is True then the DOI was imported from an external
+    platform, it is validated but not published or updated with DataCite.
+
+    Updates 'publication_state' to 'published' and makes the dataset public
+    in CKAN, then sends email to maintainer and admin if 'send_email' is True.
+    If call to DataCite API fails then sends error email to admin.
+
+    Args:
+        package_id (str): CKAN package id or name
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
+        admin_info (dict): CKAN user info of admin publishing the package
+        is_external_doi (bool): True if DOI is imported from an external platform
+        send_email (bool): False to skip the publication complete email
+
+    Returns:
+        ORJSONResponse: response returned by the publish endpoint
+    """
+    # Get package,
+    # if package_id invalid or user not authorized then raises HTTPException
+    package = await ckan_package_show(package_id, ckan)
+
+    # Extract publication_state
+    publication_state = package.get("publication_state")
+    if not publication_state:
+        log.error("Package does not have a 'publication_state'")
+        raise HTTPException(
+            status_code=500, detail="Package does not have a 'publication_state'"
+        )
+
+    # Get maintainer user name
+    maintainer = package.get("maintainer", {})
+    maintainer = orjson.loads(maintainer)
+    maintainer_name = f"{maintainer.get('given_name', '')} {maintainer.get('name', '')}"
+    if not (maintainer_email := maintainer.get("email", None)):
+        raise HTTPException(status_code=500, detail="Package maintainer not extracted")
+    if not (admin_email := admin_info.get("email", None)):
+        raise HTTPException(status_code=500, detail="Admin email not extracted")
+
+    # Check if publication_state can be processed
+    if publication_state not in ["pub_pending", "published", "approved"]:
+        log.error(f"Publication state '{publication_state}' is not one of the "
+                  f"following: 'pub_pending', 'published', 'approved'")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Value for 'publication_state' cannot be processed: "
+                   f"'{publication_state}' is not one of the "
+                   f"following: 'pub_pending', 'published', 'approved'",
+        )
+
+    #################  Publish external DOIs  ###########################
+    if is_external_doi:
+
+        # Validate DOI exists on package and returns a 200 when called
+        if not (doi := package.get("doi", None)):
+            raise HTTPException(
+                status_code=400,
+                detail=f"'doi' is not available for CKAN package '{package_id}'"
+            )
+        # Raises HTTPException if DOI does not exist or does not
+        # return a successful response when called
+        await is_valid_doi(doi)
+
+        # Publish and make dataset visible in CKAN
+        ckan_response = await ckan_package_patch(
+            package_id,
+            {
+                "private": False,
+                "publication_state": "published",
+            },
+            ckan,
+        )
+        log.debug(f"CKAN package_patch response: {ckan_response}")
+
+        # Email user that publication complete
+        if send_email:
+            await approval_granted_email(
+                package_id, maintainer_name, [maintainer_email, admin_email]
+            )
+
+        return ORJSONResponse(
+            status_code=200,
+            content=f"CKAN package '{package_id}' with external DOI '{doi}' "
+                    f"published and visible in EnviDat system"
+        )
+
+    #################  Publish internal EnviDat DOIs  ####################
+    else:
+        # Publish/update dataset in Datacite, temporary failures are retried
+        # according to datacite_retry_policy
+        successful_status_codes = range(200, 300)
+        datacite_response = {}
+        err_msg = "Unknown error"
+
+        # Skip DataCite if metadata is unchanged since last successful publication,
+        # if conversion fails publish_datacite() below reports the error
+        try:
+            digest = await datacite_digest(package)
+        except Exception:
+            log.exception(f"Failed computing DataCite digest of '{package_id}'")
+            digest = None
+        published = await get_published_digest(package.get("doi"))
+
+        if digest and published and published["datacite_digest"] == digest:
+            log.info(
+                f"DataCite metadata of package '{package_id}' unchanged, "
+                "skipping DataCite update"
+            )
+            datacite_response = {
+                "status_code": 200,
+                "result": {"data": {"id": package.get("doi")}},
+                "unchanged": True,
+            }
+        else:
+            # Send package to DataCite
+            try:
+                datacite_response = await datacite_retry_policy.run(
+                    publish_datacite, package
+                )
+                log.debug(f"DataCite response: {datacite_response}")
+            # Error is sent to the admin with the DataCite failed email below
+            except Exception as e:  # noqa: BLE001
+                log.error(e)
+                err_msg = str(e)
+
+            if (
+                digest
+                and published
+                and datacite_response.get("status_code") in successful_status_codes
+            ):
+                await DoiRealisation.filter(doi_pk=published["doi_pk"]).update(
+                    datacite_digest=digest
+                )
+
+        if datacite_response.get("status_code") in successful_status_codes:
+            log.debug(
+                "DataCite publish successful, patching "
+                f"CKAN package ID: {package_id} to publication_state=published"
+            )
+            # Publish and make visible dataset in CKAN
+            ckan_response = await ckan_package_patch(
+                package_id,
+                {
+                    "private": False,
+                    "publication_state": "published",
+                },
+                ckan,
+            )
+            log.debug(f"CKAN package_patch response: {ckan_response}")
+
+            # Email user that publication complete
+            if send_email:
+                await approval_granted_email(
+                    package_id, maintainer_name, [maintainer_email, admin_email]
+                )
+
+            # Return successful datacite_response
+            return ORJSONResponse(
+                datacite_response, status_code=datacite_response.get("status_code")
+            )
+
+        # Get error message
+        if datacite_response:
+            error_msg = get_error_message(datacite_response)
+        else:
+            error_msg = err_msg
+
+        await datacite_failed_email(
+            package_id, maintainer_name, maintainer_email, error_msg
+        )
+
+        # Return error datacite_response
+        return ORJSONResponse(
+            datacite_response, status_code=datacite_response.get("status_code", 500)
+        )
+
+
+async def publish_package_result(
+    package_id: str,
+    ckan: AsyncRemoteCKAN,
+    admin_info: dict,
+    is_external_doi: bool = False,
+    send_email: bool = True,
+) -> dict:
+    """Publish package like publish_package() but return result as dict.
+
+    Errors are returned rather than raised.
+
+    Returns:
+        dict: 'package_id', 'status_code' and 'response' (endpoint response body
+              or error detail)
+    """
+    try:
+        response = await publish_package(
+            package_id, ckan, admin_info, is_external_doi, send_email
+        )
+        status_code = response.status_code
+        content = orjson.loads(response.body)
+    except HTTPException as e:
+        status_code = e.status_code
+        content = {"detail": e.detail}
+    except Exception as e:
+        log.exception(f"Unexpected error publishing package '{package_id}'")
+        status_code = 500
+        content = {"detail": str(e)}
+
+    return {"package_id": package_id, "status_code": status_code, "response": content}
+
+
+async def publish_packages(
+    package_ids: AsyncIterable[str],
+    ckan: AsyncRemoteCKAN,
+    admin_info: dict,
+    concurrency: int,
+    is_external_doi: bool = False,
+    send_email: bool = False,
+) -> AsyncIterator[dict]:
+    """Publish many packages, at most 'concurrency' at a time.
+
+    Yields result of publish_package_result() for each package as soon as it
+    finishes, so results are not in input order.
+    If reading 'package_ids' fails then yields a final result with
+    'package_id' None.
+    """
+    results: asyncio.Queue[dict | None] = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks: set[asyncio.Task] = set()
+
+    async def publish(package_id: str):
+        try:
+            await results.put(
+                await publish_package_result(
+                    package_id, ckan, admin_info, is_external_doi, send_email
+                )
+            )
+        finally:
+            semaphore.release()
+
+    async def produce():
+        try:
+            async for package_id in package_ids:
+                await semaphore.acquire()
+                task = asyncio.create_task(publish(package_id))
+                tasks.add(task)
+                _running_publish_tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(_running_publish_tasks.discard)
+        except HTTPException as e:
+            await results.put(
+                {
+                    "package_id": None,
+                    "status_code": e.status_code,
+                    "response": {"detail": e.detail},
+                }
+            )
+        # Unlike gather(), wait() does not cancel the tasks if producer is cancelled
+        if tasks:
+            await asyncio.wait(set(tasks))
+        await results.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+    finally:
+        # Consumer went away (e.g. client disconnected): start no new publications,
+        # publications already started keep running so they are not left half done,
+        # they are referenced by _running_publish_tasks until they finish
+        producer.cancel()
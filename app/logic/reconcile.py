@@ -0,0 +1,258 @@
+"""Reconcile DOIs of the DOI database with CKAN packages and DataCite."""
+
+import logging
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+
+from fastapi import HTTPException
+from tortoise import connections
+
+from app.config import config_app
+from app.logic.datacite import iter_datacite_dois
+from app.logic.external import EXTERNAL_DOI_SITE_ID
+from app.logic.remote_ckan import AsyncRemoteCKAN, ckan_package_search_ids
+
+log = logging.getLogger(__name__)
+
+# DataCite states expected for each CKAN 'publication_state',
+# 'pub_pending' and 'approved' are also used for updates of published DOIs
+EXPECTED_DATACITE_STATES = {
+    "reserved": ("draft",),
+    "pub_pending": ("draft", "findable"),
+    "approved": ("draft", "findable"),
+    "published": ("findable",),
+}
+
+# Package DOIs of 'doi_realisation' following a (doi_key, doi_pk) cursor, ordered
+# like DataCite sorts DOIs: uppercase, by code point. 'metadata' is not read.
+DOI_KEY = "upper(prefix_id || '/' || suffix_id) COLLATE \"C\""
+SELECT_DOIS_AFTER = (
+    f"SELECT doi_pk, prefix_id, suffix_id, ckan_id, site_id, {DOI_KEY} AS doi_key "
+    "FROM doi_realisation "
+    f"WHERE ckan_entity = 'package' AND ({DOI_KEY}, doi_pk) > ($1, $2) "
+    "ORDER BY doi_key, doi_pk LIMIT $3"
+)
+
+
+def mismatch(
+    kind: str,
+    doi: str,
+    detail: str,
+    package: dict | None = None,
+    datacite_state: str | None = None,
+) -> dict:
+    """Return report line of a mismatch.
+
+    Args:
+        kind (str): type of mismatch, for example 'state_drift'
+        doi (str): DOI the mismatch was found for
+        detail (str): human readable description
+        package (dict | None): CKAN package of DOI, None if not known
+        datacite_state (str | None): state of DOI in DataCite, None if missing
+    """
+    package = package or {}
+    return {
+        "type": kind,
+        "doi": doi,
+        "package_id": package.get("id"),
+        "package_name": package.get("name"),
+        "publication_state": package.get("publication_state"),
+        "datacite_state": datacite_state,
+        "detail": detail,
+    }
+
+
+async def iter_db_dois(chunk_size: int) -> AsyncIterator[list[dict]]:
+    """Yield package DOI rows of the DOI database in chunks, sorted by 'doi_key'.
+
+    Rows are read with keyset pagination, one chunk at a time.
+    """
+    after = ("", 0)
+    while True:
+        chunk = await connections.get("default").execute_query_dict(
+            SELECT_DOIS_AFTER, [*after, chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        after = (chunk[-1]["doi_key"], chunk[-1]["doi_pk"])
+
+
+async def iter_datacite_states(page_size: int) -> AsyncIterator[tuple[str, str]]:
+    """Yield DOI and state of the DataCite client's DOIs, sorted by DOI.
+
+    DOIs are read page by page, only one page is held in memory.
+    Raises HTTPException if DataCite does not return DOIs sorted by DOI,
+    as they could not be compared with the DOI database.
+    """
+    last_key = ""
+    async for page in iter_datacite_dois(page_size):
+        for item in page:
+            key = item["doi"].upper()
+            if key < last_key:
+                raise HTTPException(
+                    status_code=502, detail="DataCite DOIs are not sorted by DOI"
+                )
+            last_key = key
+            yield item["doi"], item["state"]
+
+
+def check_doi(
+    row: dict, package: dict | None, datacite_state: str | None
+) -> list[dict]:
+    """Return mismatches of a DOI database row with its CKAN package and DataCite.
+
+    DataCite is only checked for DOIs minted by EnviDat, not for external DOIs.
+    """
+    doi = f"{row['prefix_id']}/{row['suffix_id']}"
+    in_datacite = (
+        row["prefix_id"] == config_app.DOI_PREFIX
+        and row["site_id"] != EXTERNAL_DOI_SITE_ID
+    )
+    mismatches = []
+
+    if in_datacite and datacite_state is None:
+        mismatches.append(
+            mismatch(
+                "missing_in_datacite",
+                doi,
+                "DOI is in the DOI database but not in DataCite",
+                package,
+            )
+        )
+
+    if package is None:
+        mismatches.append(
+            mismatch(
+                "ckan_package_missing",
+                doi,
+                f"CKAN package '{row['ckan_id']}' does not exist or cannot be read",
+                datacite_state=datacite_state,
+            )
+        )
+        return mismatches
+
+    package_doi = package.get("doi") or ""
+    if package_doi.lower() != doi.lower():
+        mismatches.append(
+            mismatch(
+                "doi_mismatch",
+                doi,
+                f"CKAN package has DOI '{package_doi}'"
+                if package_doi
+                else "CKAN package has no DOI",
+                package,
+                datacite_state,
+            )
+        )
+
+    publication_state = package.get("publication_state")
+    if not publication_state:
+        if package_doi:
+            mismatches.append(
+                mismatch(
+                    "missing_publication_state",
+                    doi,
+                    "CKAN package has a DOI but no 'publication_state'",
+                    package,
+                    datacite_state,
+                )
+            )
+    elif in_datacite and datacite_state is not None:
+        expected = EXPECTED_DATACITE_STATES.get(publication_state, ())
+        if datacite_state not in expected:
+            mismatches.append(
+                mismatch(
+                    "state_drift",
+                    doi,
+                    f"DataCite state '{datacite_state}' does not match "
+                    f"'publication_state' '{publication_state}', expected: "
+                    f"{', '.join(expected) or 'none'}",
+                    package,
+                    datacite_state,
+                )
+            )
+
+    return mismatches
+
+
+async def reconcile_dois(
+    ckan: AsyncRemoteCKAN,
+    chunk_size: int = config_app.RECONCILE_CHUNK_SIZE,
+    datacite_page_size: int = config_app.RECONCILE_DATACITE_PAGE_SIZE,
+) -> AsyncIterator[dict]:
+    """Yield mismatches between DOI database, CKAN packages and DataCite.
+
+    Package DOIs of the DOI database, read in chunks of 'chunk_size' rows, and
+    DOIs of the DataCite client, read page by page, are both sorted by DOI and
+    compared in lockstep. The CKAN packages of each chunk are read with one
+    'package_search', so memory does not grow with the number of DOIs.
+
+    The last item yielded is the 'summary' with counts of DOIs and mismatches.
+
+    Args:
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session of an admin
+        chunk_size (int): DOI database rows and CKAN packages read at a time
+        datacite_page_size (int): DOIs requested per DataCite page
+    """
+    start = time.monotonic()
+    counts = Counter()
+
+    datacite_dois = iter_datacite_states(datacite_page_size)
+    # Current DataCite DOI, and if a database row with the same DOI was found
+    datacite_doi = await anext(datacite_dois, None)
+    datacite_matched = False
+
+    async def skip_datacite_dois_before(key: str | None) -> AsyncIterator[dict]:
+        """Advance to DataCite DOI 'key', yield skipped DOIs missing in database."""
+        nonlocal datacite_doi, datacite_matched
+        while datacite_doi is not None and (
+            key is None or datacite_doi[0].upper() < key
+        ):
+            counts["datacite_dois"] += 1
+            if not datacite_matched:
+                counts["missing_in_db"] += 1
+                yield mismatch(
+                    "missing_in_db",
+                    datacite_doi[0],
+                    "DOI is in DataCite but not in the DOI database",
+                    datacite_state=datacite_doi[1],
+                )
+            datacite_doi = await anext(datacite_dois, None)
+            datacite_matched = False
+
+    async for chunk in iter_db_dois(chunk_size):
+        packages = await ckan_package_search_ids(
+            list({str(row["ckan_id"]) for row in chunk}), ckan
+        )
+        counts["db_dois"] += len(chunk)
+        counts["ckan_packages"] += len(packages)
+
+        for row in chunk:
+            async for item in skip_datacite_dois_before(row["doi_key"]):
+                yield item
+            datacite_state = None
+            if datacite_doi is not None and datacite_doi[0].upper() == row["doi_key"]:
+                datacite_state = datacite_doi[1]
+                datacite_matched = True
+            for item in check_doi(
+                row, packages.get(str(row["ckan_id"])), datacite_state
+            ):
+                counts[item["type"]] += 1
+                yield item
+
+    async for item in skip_datacite_dois_before(None):
+        yield item
+
+    summary = {
+        "db_dois": counts.pop("db_dois", 0),
+        "ckan_packages": counts.pop("ckan_packages", 0),
+        "datacite_dois": counts.pop("datacite_dois", 0),
+        "mismatches": dict(counts),
+        "duration_seconds": round(time.monotonic() - start, 3),
+    }
+    log.info(f"DOI reconciliation finished: {summary}")
+    yield {"summary": summary}
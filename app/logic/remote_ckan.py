@@ -1,51 +1,162 @@
-"""Utils that use RemoteCKAN to call actions from CKAN API."""
+"""Utils that use AsyncRemoteCKAN to call actions from CKAN API."""
 
+import hashlib
 import logging
+from collections.abc import AsyncIterator
+from datetime import datetime, timezone
 
-import requests
-from ckanapi import NotAuthorized, NotFound, RemoteCKAN, ValidationError
+import httpx
+import orjson
+from ckanapi import NotAuthorized, NotFound, ValidationError
+from ckanapi.common import prepare_action, reverse_apicontroller_action
 from fastapi import HTTPException
+from typing_extensions import Self
 
 from app.config import config_app
+from app.logic.metrics import instrumented_transport, stats_collector
+from app.utils import TTLCache
 
 log = logging.getLogger(__name__)
 
+# Resolved CKAN user info, keyed by hash of the API token used to fetch it
+ckan_user_cache = TTLCache(
+    maxsize=config_app.CKAN_USER_CACHE_SIZE, ttl=config_app.CKAN_USER_CACHE_TTL
+)
+stats_collector.register("ckan_user_cache", ckan_user_cache.stats)
+
+# CKAN packages as returned by 'package_show', keyed by hash of the API token
+# used to fetch them and package id or name, see ckan_package_show()
+ckan_package_cache = TTLCache(
+    maxsize=config_app.CKAN_PACKAGE_CACHE_SIZE, ttl=config_app.CKAN_PACKAGE_CACHE_TTL
+)
+stats_collector.register("ckan_package_cache", ckan_package_cache.stats)
+
+# Shared connection pool for all CKAN calls, see get_ckan_client()
+_ckan_client: httpx.AsyncClient | None = None
+
+
+def get_ckan_client() -> httpx.AsyncClient:
+    """Return shared async HTTP client for CKAN, creating it if needed.
+
+    The client keeps up to 'CKAN_POOL_SIZE' keep-alive connections open.
+    """
+    global _ckan_client
+    if _ckan_client is None or _ckan_client.is_closed:
+        log.debug("Opening CKAN HTTP client")
+        _ckan_client = httpx.AsyncClient(
+            timeout=config_app.CKAN_TIMEOUT,
+            transport=instrumented_transport(
+                "ckan",
+                phases={
+                    "user_show": "auth",
+                    "package_show": "ckan_read",
+                    "package_search": "ckan_read",
+                    "package_patch": "ckan_patch",
+                },
+                limits=httpx.Limits(
+                    max_connections=config_app.CKAN_POOL_SIZE,
+                    max_keepalive_connections=config_app.CKAN_POOL_SIZE,
+                ),
+            ),
+            headers={"User-Agent": f"{config_app.__NAME__}/{config_app.APP_VERSION}"},
+        )
+    return _ckan_client
+
+
+async def close_ckan_client():
+    """Close shared CKAN HTTP client and its connections."""
+    global _ckan_client
+    if _ckan_client is not None:
+        log.debug("Closing CKAN HTTP client")
+        await _ckan_client.aclose()
+        _ckan_client = None
+
+
+class AsyncRemoteCKAN:
+    """Async replacement for ckanapi.RemoteCKAN using the shared HTTP client.
+
+    Raises the same ckanapi exceptions as RemoteCKAN (NotFound, NotAuthorized,
+    ValidationError, ...) for errors returned by CKAN.
+    """
+
+    def __init__(self, address: str, apikey: str | None = None):
+        """Store CKAN address and API token used for calls."""
+        self.address = address
+        self.apikey = apikey
+
+    async def call_action(
+        self,
+        action: str,
+        data_dict: dict | None = None,
+        timeout: float | None = None,
+    ):
+        """Call CKAN API action and return decoded result.
+
+        Args:
+            action (str): the CKAN action name, for example 'package_show'
+            data_dict (dict): the dict to pass to the action as JSON
+            timeout (float): seconds to wait for CKAN, default is CKAN_TIMEOUT
+        """
+        path, data, headers = prepare_action(action, data_dict, self.apikey)
+        url = f"{self.address.rstrip('/')}/{path}"
+        response = await get_ckan_client().post(
+            url,
+            content=data,
+            headers=headers,
+            timeout=timeout or config_app.CKAN_TIMEOUT,
+            extensions={"operation": action},
+        )
+        return reverse_apicontroller_action(url, response.status_code, response.text)
+
 
 def get_ckan(api_token: str):
     """Get CKAN session once, to re-use the connection."""
-    return RemoteCKAN(address=config_app.CKAN_API_URL, apikey=api_token)
+    return AsyncRemoteCKAN(address=config_app.CKAN_API_URL, apikey=api_token)
+
+
+def get_user_cache_key(api_token: str) -> str:
+    """Return key for 'ckan_user_cache', the raw API token is never stored."""
+    return hashlib.sha256(api_token.encode("utf-8")).hexdigest()
+
+
+def invalidate_cached_user(api_token: str | None):
+    """Remove cached user info for an API token, e.g. after CKAN rejected it."""
+    if api_token:
+        log.debug("Invalidating cached CKAN user for rejected token")
+        ckan_user_cache.invalidate(get_user_cache_key(api_token))
 
 
-def ckan_call_action_handle_errors(
-    ckan: RemoteCKAN, action: str, data: dict | None = None
+async def ckan_call_action_handle_errors(
+    ckan: AsyncRemoteCKAN, action: str, data: dict | None = None
 ):
     """Wrapper for CKAN actions, handling errors.
 
-    An authorised RemoteCKAN instance is required.
+    An authorised AsyncRemoteCKAN instance is required.
     NOTE: some CKAN API actions do not require authorization and will still return a
     response even if authorization invalid!
     If CKAN API call fails then logs error and raises HTTPException.
 
     Args:
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
         action (str): the CKAN action name, for example 'package_create'
         data (dict): the dict to pass to the action, default is None
     """
     try:
         if data:
-            response = ckan.call_action(action, data)
+            response = await ckan.call_action(action, data)
         else:
-            response = ckan.call_action(action)
+            response = await ckan.call_action(action)
     except NotFound as e:
         log.exception(e)
         raise HTTPException(status_code=404, detail="Not found") from e
     except NotAuthorized as e:
         log.exception(e)
+        invalidate_cached_user(ckan.apikey)
         raise HTTPException(status_code=403, detail="Not authorized") from e
     except ValidationError as e:
         log.exception(e)
         raise HTTPException(status_code=500, detail=f"ValidationError: {e}") from e
-    except requests.exceptions.ConnectionError as e:
+    except httpx.TransportError as e:
         log.exception(e)
         raise HTTPException(status_code=502, detail="Connection error") from e
     except Exception as e:
@@ -55,8 +166,8 @@ def ckan_call_action_handle_errors(
     return response
 
 
-def ckan_call_action_return_exception(
-    ckan: RemoteCKAN, action: str, data: dict | None = None
+async def ckan_call_action_return_exception(
+    ckan: AsyncRemoteCKAN, action: str, data: dict | None = None
 ):
     """Handle exceptions from ckanapi while calling ckan action.
 
@@ -70,67 +181,298 @@ def ckan_call_action_return_exception(
     response even if authorization invalid!
 
     Args:
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
         action (str): the CKAN action name, for example 'package_create'
         data (dict): the dict to pass to the action, default is None
     """
     try:
         if data:
-            response = ckan.call_action(action, data)
+            response = await ckan.call_action(action, data)
         else:
-            response = ckan.call_action(action)
+            response = await ckan.call_action(action)
     except Exception as e:
         return {"success": False, "result": e}
 
     return {"success": True, "result": response}
 
 
-def ckan_package_show(package_id: str, ckan: RemoteCKAN):
+def get_package_cache_key(package_id: str, ckan: AsyncRemoteCKAN) -> str:
+    """Return 'ckan_package_cache' key of package id or name for the CKAN user.
+
+    Packages are cached per user, as 'package_show' output can differ per user,
+    for example resources or fields filtered by CKAN plugins.
+    """
+    user_key = get_user_cache_key(ckan.apikey) if ckan.apikey else "anonymous"
+    return f"{user_key}:{package_id}"
+
+
+def parse_ckan_timestamp(value: str | None) -> datetime | None:
+    """Return CKAN timestamp as UTC datetime truncated to milliseconds.
+
+    'package_show' returns e.g. '2024-01-01T12:34:56.123456', 'package_search'
+    with 'fl' returns the Solr value '2024-01-01T12:34:56.123Z'.
+    Returns None if value is empty or not a timestamp.
+    """
+    if not value:
+        return None
+    timestamp, _, fraction = value.removesuffix("Z").partition(".")
+    if fraction and not fraction.isdigit():
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+    return parsed.replace(
+        microsecond=int(fraction[:3].ljust(3, "0")) * 1000,
+        tzinfo=parsed.tzinfo or timezone.utc,
+    )
+
+
+def cache_package(package: dict, ckan: AsyncRemoteCKAN):
+    """Store package in 'ckan_package_cache' by id and name for the CKAN user."""
+    if not isinstance(package, dict) or not package.get("id"):
+        return
+    entry = {
+        "id": package["id"],
+        "name": package.get("name"),
+        "metadata_modified": package.get("metadata_modified"),
+        "json": orjson.dumps(package),
+    }
+    ckan_package_cache.set(get_package_cache_key(entry["id"], ckan), entry)
+    if entry["name"]:
+        ckan_package_cache.set(get_package_cache_key(entry["name"], ckan), entry)
+
+
+def invalidate_cached_package(package_id: str, ckan: AsyncRemoteCKAN):
+    """Remove package of CKAN user from 'ckan_package_cache', by id or name.
+
+    Packages cached for other users are revalidated when read,
+    see is_cached_package_current().
+    """
+    if entry := ckan_package_cache.get(get_package_cache_key(package_id, ckan)):
+        ckan_package_cache.invalidate(get_package_cache_key(entry["id"], ckan))
+        if entry["name"]:
+            ckan_package_cache.invalidate(get_package_cache_key(entry["name"], ckan))
+    ckan_package_cache.invalidate(get_package_cache_key(package_id, ckan))
+
+
+async def is_cached_package_current(entry: dict, ckan: AsyncRemoteCKAN) -> bool:
+    """Return True if cached package is unchanged and visible to the CKAN user.
+
+    Uses 'package_search', which is much cheaper than 'package_show' for large
+    packages and only returns packages the user is authorized to read.
+    """
+    cached_modified = parse_ckan_timestamp(entry["metadata_modified"])
+    if cached_modified is None:
+        return False
+    response = await ckan_call_action_return_exception(
+        ckan,
+        "package_search",
+        {
+            "fq": f'id:"{entry["id"]}"',
+            "fl": "id,metadata_modified",
+            "rows": 1,
+            "include_private": True,
+            "include_drafts": True,
+        },
+    )
+    if not response["success"]:
+        log.debug(f"Package revision check failed: {response['result']}")
+        return False
+    results = response["result"].get("results", [])
+    return bool(results) and (
+        parse_ckan_timestamp(results[0].get("metadata_modified")) == cached_modified
+    )
+
+
+async def ckan_package_show(package_id: str, ckan: AsyncRemoteCKAN):
     """Return CKAN package.
 
+    Packages are cached per CKAN user in 'ckan_package_cache' for
+    'CKAN_PACKAGE_CACHE_TTL' seconds. A cached package is only returned if its
+    'metadata_modified' is unchanged in CKAN and the user is authorized to read
+    it, see is_cached_package_current().
     If CKAN API call fails then logs error and raises HTTPException.
 
     Args:
         package_id (str): CKAN package id or name
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
     """
-    return ckan_call_action_handle_errors(ckan, "package_show", {"id": package_id})
+    cache_key = get_package_cache_key(package_id, ckan)
+    if (entry := ckan_package_cache.get(cache_key)) is not None:
+        if await is_cached_package_current(entry, ckan):
+            log.debug(f"Package '{package_id}' loaded from cache")
+            return orjson.loads(entry["json"])
+        invalidate_cached_package(package_id, ckan)
+
+    package = await ckan_call_action_handle_errors(
+        ckan, "package_show", {"id": package_id}
+    )
+    cache_package(package, ckan)
+    return package
 
 
-def ckan_package_patch(package_id: str, data: dict, ckan: RemoteCKAN):
+async def ckan_package_patch(package_id: str, data: dict, ckan: AsyncRemoteCKAN):
     """Patch a CKAN package.
 
+    The cached package is replaced by the patched package returned by CKAN.
     If CKAN API call fails then logs error and raises HTTPException.
 
     Args:
         package_id (str): CKAN package id or name
         data (dict): the dict with data used to update the CKAN package
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
     """
     update_data = {"id": package_id, **data}
-    return ckan_call_action_handle_errors(ckan, "package_patch", update_data)
+    invalidate_cached_package(package_id, ckan)
+    package = await ckan_call_action_handle_errors(ckan, "package_patch", update_data)
+    cache_package(package, ckan)
+    return package
+
+
+class CkanPackageUnitOfWork:
+    """Collect updates of a CKAN package and write them with one package_patch.
+
+    Each package_patch makes CKAN validate and re-index the whole package, so
+    updates made during a workflow are written together when flush() is called
+    or when the 'async with' block exits, also if it exits with an error.
+    Call flush() explicitly where CKAN must be updated before continuing.
 
+    Usage:
+        async with CkanPackageUnitOfWork(package_id, ckan) as package_update:
+            package_update.update({"doi": doi})
+            ...
+            package_update.update({"publication_state": "reserved"})
+    """
 
-def ckan_package_create(data: dict, ckan: RemoteCKAN):
+    def __init__(self, package_id: str, ckan: AsyncRemoteCKAN):
+        """Start unit of work without pending updates.
+
+        Args:
+            package_id (str): CKAN package id or name
+            ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
+        """
+        self.package_id = package_id
+        self.ckan = ckan
+        self.pending: dict = {}
+
+    def update(self, data: dict):
+        """Add field updates, written with the next flush."""
+        self.pending.update(data)
+
+    async def flush(self) -> dict | None:
+        """Write pending updates with one package_patch.
+
+        If CKAN API call fails then logs error and raises HTTPException.
+
+        Returns:
+            dict | None: patched package, None if there were no pending updates
+        """
+        if not self.pending:
+            return None
+        data, self.pending = self.pending, {}
+        log.debug(f"Patching package '{self.package_id}' fields: {list(data)}")
+        return await ckan_package_patch(self.package_id, data, self.ckan)
+
+    async def __aenter__(self) -> Self:
+        """Return unit of work."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        """Write pending updates, errors do not hide an error raised in block."""
+        if exc_type is None:
+            await self.flush()
+            return
+        try:
+            await self.flush()
+        except HTTPException as e:
+            log.error(f"Failed writing updates of package '{self.package_id}': {e}")
+
+
+async def ckan_package_create(data: dict, ckan: AsyncRemoteCKAN):
     """Create a CKAN package.
 
     If CKAN API call fails then logs error and raises HTTPException.
 
     Args:
         data (dict): the dict with data used to create the CKAN package
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
     """
-    return ckan_call_action_handle_errors(ckan, "package_create", data)
+    return await ckan_call_action_handle_errors(ckan, "package_create", data)
+
+
+async def ckan_package_search_names(
+    query: str, ckan: AsyncRemoteCKAN, rows: int = 1000
+) -> AsyncIterator[str]:
+    """Yield names of all CKAN packages matching a search query, page by page.
+
+    Private packages are included if the user is authorised to see them.
+    If CKAN API call fails then logs error and raises HTTPException.
+
+    Args:
+        query (str): Solr query passed as 'q' to CKAN 'package_search'
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
+        rows (int): number of packages requested per page
+    """
+    start = 0
+    while True:
+        response = await ckan_call_action_handle_errors(
+            ckan,
+            "package_search",
+            {
+                "q": query,
+                "fl": "id,name",
+                "rows": rows,
+                "start": start,
+                "sort": "name asc",
+                "include_private": True,
+            },
+        )
+        packages = response.get("results", [])
+        for package in packages:
+            yield package.get("name") or package.get("id")
+
+        start += len(packages)
+        if not packages or start >= response.get("count", 0):
+            return
+
+
+async def ckan_package_search_ids(
+    package_ids: list[str], ckan: AsyncRemoteCKAN
+) -> dict[str, dict]:
+    """Return CKAN packages by id, with one 'package_search' for all ids.
+
+    Private and draft packages are included if the user is authorised to see
+    them, packages that do not exist or cannot be seen are missing from the result.
+    If CKAN API call fails then logs error and raises HTTPException.
+
+    Args:
+        package_ids (list[str]): CKAN package ids, at most a few hundred
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
+    """
+    if not package_ids:
+        return {}
+    response = await ckan_call_action_handle_errors(
+        ckan,
+        "package_search",
+        {
+            "fq": f"id:({' OR '.join(package_ids)})",
+            "rows": len(package_ids),
+            "include_private": True,
+            "include_drafts": True,
+        },
+    )
+    return {package["id"]: package for package in response.get("results", [])}
 
 
-def ckan_current_package_list_with_resources(ckan: RemoteCKAN):
+async def ckan_current_package_list_with_resources(ckan: AsyncRemoteCKAN):
     """Return all current CKAN packages with resources.
 
     If CKAN API call fails then logs error and raises HTTPException.
 
     Args:
-        ckan (RemoteCKAN): authorised RemoteCKAN session.
+        ckan (AsyncRemoteCKAN): authorised AsyncRemoteCKAN session.
     """
-    return ckan_call_action_handle_errors(
+    return await ckan_call_action_handle_errors(
         ckan, "current_package_list_with_resources", {"limit": "100000"}
     )
@@ -0,0 +1,126 @@
+"""Retry DataCite calls with exponential backoff, without blocking the event loop."""
+
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from app.config import config_app
+from app.logic.metrics import record_retry
+
+log = logging.getLogger(__name__)
+
+# Status codes that indicate a temporary failure worth retrying
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Return seconds to wait from a 'Retry-After' header value.
+
+    Header can contain either a number of seconds or an HTTP date.
+    Returns None if value is missing or cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        log.warning(f"Could not parse Retry-After header: {value}")
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """Retry policy for calls returning DoiSuccess | DoiErrors style dicts.
+
+    Waits between attempts using exponential backoff with full jitter,
+    honours 'retry_after' returned with 429/503 responses and gives up when
+    'retries' is exhausted or waiting would exceed 'deadline' seconds in total.
+    Only responses with a status code in 'retry_status_codes' are retried.
+    Retries are counted in metrics with label 'upstream'.
+    """
+
+    def __init__(
+        self,
+        retries: int,
+        base_delay: float,
+        max_delay: float,
+        deadline: float,
+        retry_status_codes: frozenset[int] = RETRYABLE_STATUS_CODES,
+        upstream: str = "unknown",
+    ):
+        """Create policy, see class docstring for parameters."""
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_status_codes = retry_status_codes
+        self.upstream = upstream
+
+    def is_retryable(self, response: dict) -> bool:
+        """Return True if response status code indicates a temporary failure."""
+        return response.get("status_code") in self.retry_status_codes
+
+    def get_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Return seconds to wait before retry number 'attempt' (starts at 1)."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, backoff)
+
+    async def run(self, func: Callable[..., Awaitable[dict]], *args, **kwargs) -> dict:
+        """Await func until it succeeds, fails permanently or retries run out.
+
+        Exceptions raised by func are not retried and propagate to the caller.
+
+        Returns:
+            dict: the last response returned by func
+        """
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            response = await func(*args, **kwargs)
+            status_code = response.get("status_code")
+
+            if status_code in range(200, 300) or not self.is_retryable(response):
+                return response
+
+            attempt += 1
+            if attempt > self.retries:
+                log.warning(f"Giving up after {attempt} attempts: {status_code}")
+                return response
+
+            delay = self.get_delay(attempt, response.get("retry_after"))
+            elapsed = time.monotonic() - start
+            if elapsed + delay > self.deadline:
+                log.warning(
+                    f"Giving up after {attempt} attempts, retry in {delay:.1f}s "
+                    f"would exceed deadline of {self.deadline}s"
+                )
+                return response
+
+            log.debug(
+                f"Attempt {attempt} failed with status {status_code}, "
+                f"retrying in {delay:.1f}s"
+            )
+            record_retry(self.upstream, status_code)
+            await asyncio.sleep(delay)
+
+
+datacite_retry_policy = RetryPolicy(
+    retries=config_app.DATACITE_RETRIES,
+    base_delay=config_app.DATACITE_SLEEP_TIME,
+    max_delay=config_app.DATACITE_MAX_SLEEP_TIME,
+    deadline=config_app.DATACITE_RETRY_DEADLINE,
+    upstream="datacite",
+)
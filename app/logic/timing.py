@@ -0,0 +1,119 @@
+"""Per-request timing of phases, returned in the 'Server-Timing' header.
+
+Phases are recorded while a request handled by ServerTimingRoute runs,
+calls outside a request (e.g. background jobs) are not recorded.
+Phases can overlap, e.g. 'mint' includes the 'db' queries it runs.
+"""
+
+import logging
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import orjson
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+from app.config import config_app
+
+log = logging.getLogger(__name__)
+
+# Phase name -> [total seconds, number of calls] of the current request
+_request_timings: ContextVar[dict[str, list] | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_phase(phase: str, seconds: float):
+    """Add duration to phase of current request, ignored outside requests."""
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    timing = timings.setdefault(phase, [0.0, 0])
+    timing[0] += seconds
+    timing[1] += 1
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Record duration of block as phase of current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def format_server_timing(timings: dict[str, list], total: float) -> str:
+    """Return 'Server-Timing' header value, durations in milliseconds."""
+    metrics = [
+        f'{phase};desc="{count} calls";dur={seconds * 1000:.1f}'
+        for phase, (seconds, count) in timings.items()
+    ]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+class ServerTimingRoute(APIRoute):
+    """Custom APIRoute that times requests and their phases.
+
+    Adds a 'Server-Timing' header to responses, also to error responses of
+    HTTPExceptions, and logs requests slower than
+    'SLOW_REQUEST_THRESHOLD' seconds. For streaming responses only the time
+    until the response starts is included.
+    """
+
+    def get_route_handler(self) -> Callable:
+        """Original route handler for extension."""
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            """Route handler with timing of phases."""
+            timings: dict[str, list] = {}
+            token = _request_timings.set(timings)
+            start = time.perf_counter()
+            status_code = 500
+            try:
+                response = await original_route_handler(request)
+                status_code = response.status_code
+                response.headers["Server-Timing"] = format_server_timing(
+                    timings, time.perf_counter() - start
+                )
+                return response
+            except HTTPException as e:
+                # Headers of HTTPException are added to the error response
+                status_code = e.status_code
+                e.headers = {
+                    **(e.headers or {}),
+                    "Server-Timing": format_server_timing(
+                        timings, time.perf_counter() - start
+                    ),
+                }
+                raise
+            finally:
+                _request_timings.reset(token)
+                total = time.perf_counter() - start
+                if 0 < config_app.SLOW_REQUEST_THRESHOLD <= total:
+                    log_slow_request(request, self.path, status_code, total, timings)
+
+        return custom_route_handler
+
+
+def log_slow_request(
+    request: Request, route: str, status_code: int, total: float, timings: dict
+):
+    """Log request with its phases as one JSON line."""
+    entry = {
+        "event": "slow_request",
+        "method": request.method,
+        "route": route,
+        "path": request.url.path,
+        "status_code": status_code,
+        "duration_ms": round(total * 1000, 1),
+        "phases": {
+            phase: {"duration_ms": round(seconds * 1000, 1), "calls": count}
+            for phase, (seconds, count) in timings.items()
+        },
+    }
+    log.warning(f"Slow request: {orjson.dumps(entry).decode()}")
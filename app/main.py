@@ -5,10 +5,20 @@ import sys
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.api.router import api_router, error_router
 from app.config import config_app, log_level
 from app.db import init_db
+from app.logic.datacite import (
+    close_datacite_client,
+    conversion_pool,
+    get_datacite_client,
+)
+from app.logic.jobs import job_worker
+from app.logic.mail import close_mail_client, mail_sender
+from app.logic.metrics import MetricsMiddleware, mark_metrics_process_dead
+from app.logic.remote_ckan import close_ckan_client, get_ckan_client
 
 logging.basicConfig(
     level=log_level,
@@ -35,6 +45,7 @@ def get_application() -> FastAPI:
         },
         debug=config_app.DEBUG,
         root_path=config_app.ROOT_PATH,
+        default_response_class=ORJSONResponse,
     )
 
     log.debug(f"Allowed CORS origins: {config_app.BACKEND_CORS_ORIGINS}")
@@ -45,6 +56,7 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    _app.add_middleware(MetricsMiddleware, router=_app.router)
 
     return _app
 
@@ -56,7 +68,26 @@ init_db(app)
 app.include_router(api_router)
 app.include_router(error_router)
 
+
 @app.on_event("startup")
 async def startup_event():
     """Commands to run on server startup."""
     log.debug("Starting up FastAPI server.")
+    get_ckan_client()
+    get_datacite_client()
+    await conversion_pool.start()
+    job_worker.start()
+    mail_sender.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Commands to run on server shutdown."""
+    log.debug("Shutting down FastAPI server.")
+    await job_worker.stop()
+    await mail_sender.stop()
+    await conversion_pool.stop()
+    await close_ckan_client()
+    await close_datacite_client()
+    await close_mail_client()
+    mark_metrics_process_dead()
@@ -4,8 +4,10 @@ from enum import Enum
 
 from tortoise import fields, models
 from tortoise.contrib.pydantic import pydantic_model_creator
+from tortoise.validators import MaxLengthValidator
 
 from app.config import config_app
+from app.models.fields import CompressedTextField
 from app.models.validators import EmptyStringValidator
 
 
@@ -49,11 +51,15 @@ class DoiRealisation(models.Model):
     ckan_user = fields.CharField(
         max_length=256, default="admin", validators=[EmptyStringValidator()]
     )
-    metadata = fields.CharField(max_length=1000000, validators=[EmptyStringValidator()])
+    metadata = CompressedTextField(
+        validators=[EmptyStringValidator(), MaxLengthValidator(1000000)]
+    )
     metadata_format = fields.CharField(
         max_length=64, default="ckan", validators=[EmptyStringValidator()]
     )
     ckan_entity = fields.data.CharEnumField(CkanEntityType)
+    # Digest of DataCite payload last published successfully, see datacite_digest()
+    datacite_digest = fields.CharField(max_length=64, null=True)
     date_created = fields.DatetimeField(auto_now_add=True)
     date_modified = fields.DatetimeField(auto_now=True)
 
@@ -66,7 +72,44 @@ class DoiRealisation(models.Model):
 
         app = config_app.__NAME__
         table = "doi_realisation"
-        unique_together = ["prefix_id", "suffix_id"]
+        unique_together = (
+            ("prefix_id", "suffix_id"),
+            ("ckan_id", "site_id", "ckan_entity"),
+        )
+
+
+# Fields selected for the 'summary' view, excludes the large 'metadata' column
+DOI_REALISATION_SUMMARY_FIELDS = (
+    "doi_pk",
+    "prefix_id",
+    "suffix_id",
+    "ckan_id",
+    "ckan_name",
+    "ckan_entity",
+    "date_created",
+    "date_modified",
+)
+
+
+class DoiSuffixCounter(models.Model):
+    """Last numeric DOI suffix allocated for a prefix and suffix tag combo."""
+
+    counter_pk = fields.IntField(pk=True, generated=True)
+    prefix_id = fields.CharField(max_length=64, validators=[EmptyStringValidator()])
+    tag_id = fields.CharField(max_length=64, default="")
+    last_value = fields.BigIntField(default=0)
+
+    def __str__(self):
+        """Return the last allocated DOI."""
+        return f"{self.prefix_id}/{self.tag_id}{self.last_value}"
+
+    class Meta:
+        """Tortoise config."""
+
+        app = config_app.__NAME__
+        table = "doi_suffix_counter"
+        unique_together = ["prefix_id", "tag_id"]
+
 
 DoiPrefixPydantic = pydantic_model_creator(DoiPrefix, name="DoiPrefix")
 DoiPrefixInPydantic = pydantic_model_creator(
@@ -84,16 +127,21 @@ DoiPrefixEditPydantic = pydantic_model_creator(
     ],
 )
 DoiRealisationPydantic = pydantic_model_creator(DoiRealisation, name="DoiRealisation")
+DoiRealisationSummaryPydantic = pydantic_model_creator(
+    DoiRealisation,
+    name="DoiRealisationSummary",
+    include=DOI_REALISATION_SUMMARY_FIELDS,
+)
 DoiRealisationInPydantic = pydantic_model_creator(
     DoiRealisation,
     name="DoiRealisationIn",
     exclude_readonly=True,
-    exclude=["date_created", "date_modified"],
+    exclude=["date_created", "date_modified", "datacite_digest"],
 )
 DoiRealisationEditPydantic = pydantic_model_creator(
     DoiRealisation,
     name="DoiRealisationEdit",
     exclude_readonly=True,
     optional=[],
-    exclude=["date_created", "date_modified"],
+    exclude=["date_created", "date_modified", "datacite_digest"],
 )
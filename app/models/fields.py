@@ -0,0 +1,133 @@
+"""Custom model fields."""
+
+import logging
+import zlib
+from collections import UserString
+from typing import Any
+
+from tortoise.fields import Field
+
+log = logging.getLogger(__name__)
+
+# First byte of stored value, tells how the rest of the value is encoded:
+# RAW is text not compressed yet, as converted by 'compress-doi-metadata.sql',
+# INCOMPRESSIBLE is text stored as is because it did not get smaller
+FORMAT_RAW = b"\x00"
+FORMAT_ZLIB = b"\x01"
+FORMAT_INCOMPRESSIBLE = b"\x02"
+
+
+def compress_text(value: str, level: int = 6) -> bytes:
+    """Return text encoded for storage, zlib compressed with format marker.
+
+    Values that do not get smaller are stored uncompressed.
+    """
+    raw = value.encode("utf-8")
+    compressed = zlib.compress(raw, level)
+    if len(compressed) < len(raw):
+        return FORMAT_ZLIB + compressed
+    return FORMAT_INCOMPRESSIBLE + raw
+
+
+def decompress_text(value: bytes) -> str:
+    """Return text from value encoded with compress_text()."""
+    marker, data = value[:1], value[1:]
+    if marker == FORMAT_ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if marker in (FORMAT_RAW, FORMAT_INCOMPRESSIBLE):
+        return data.decode("utf-8")
+    raise ValueError(f"Unknown compressed text format marker: {marker!r}")
+
+
+class LazyCompressedText(UserString):
+    """String of a value encoded with compress_text(), decompressed on first use."""
+
+    def __init__(self, value: bytes):
+        """Keep encoded value without decompressing it."""
+        self._value = value
+        self._text: str | None = None
+
+    @property
+    def data(self) -> str:
+        """Return decompressed text."""
+        if self._text is None:
+            self._text = decompress_text(self._value)
+        return self._text
+
+
+class CompressedTextAttribute:
+    """Model attribute of a CompressedTextField, see CompressedTextField.model.
+
+    Values loaded from the database are decompressed on first access and
+    returned as normal string.
+    """
+
+    def __init__(self, name: str):
+        """Create attribute for field 'name'."""
+        self.name = name
+
+    def __get__(self, instance: Any, owner: Any = None) -> Any:
+        """Return value of field, decompressed if not yet done."""
+        if instance is None:
+            return self
+        try:
+            value = instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name) from None
+        if isinstance(value, LazyCompressedText):
+            value = instance.__dict__[self.name] = value.data
+        return value
+
+    def __set__(self, instance: Any, value: Any):
+        """Set value of field."""
+        instance.__dict__[self.name] = value
+
+
+class CompressedTextField(Field[str], str):  # type: ignore
+    """Text field stored zlib compressed as binary in the database.
+
+    The Python value is a normal string, decompressed when the attribute is first
+    read, so loading rows without reading the field does not decompress it.
+    values() queries return the field as LazyCompressedText.
+    Filtering on the field is not supported, the stored value is compressed.
+    """
+
+    indexable = False
+    SQL_TYPE = "BLOB"
+
+    class _db_postgres:
+        SQL_TYPE = "BYTEA"
+
+    def __init__(self, compression_level: int = 6, **kwargs: Any) -> None:
+        """Create field, 'compression_level' is passed to zlib (0-9)."""
+        self.compression_level = compression_level
+        super().__init__(**kwargs)
+
+    @property
+    def model(self) -> Any:
+        """Return model of field."""
+        return self._model
+
+    @model.setter
+    def model(self, model: Any):
+        """Set model of field, adds attribute decompressing values on access."""
+        self._model = model
+        if model is not None:
+            setattr(
+                model,
+                self.model_field_name,
+                CompressedTextAttribute(self.model_field_name),
+            )
+
+    def to_db_value(self, value: Any, instance: Any) -> bytes | None:
+        """Validate and compress string."""
+        self.validate(value)
+        if value is None:
+            return None
+        return compress_text(value, self.compression_level)
+
+    def to_python_value(self, value: Any) -> str | LazyCompressedText | None:
+        """Return value loaded from database, decompressed when first used."""
+        if value is None or isinstance(value, str):
+            return value
+        return LazyCompressedText(bytes(value))
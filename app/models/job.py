@@ -0,0 +1,56 @@
+"""Models associated with background jobs."""
+
+from enum import Enum
+
+from tortoise import fields, models
+from tortoise.contrib.pydantic import pydantic_model_creator
+
+from app.config import config_app
+from app.models.validators import EmptyStringValidator
+
+
+class JobType(str, Enum):
+    """Options for job type."""
+
+    PUBLISH = "publish"
+
+
+class JobStatus(str, Enum):
+    """Options for job status."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class DataciteJob(models.Model):
+    """A queued DataCite task, processed by the background job worker."""
+
+    job_pk = fields.IntField(pk=True, generated=True)
+    job_type = fields.data.CharEnumField(JobType, default=JobType.PUBLISH)
+    package_id = fields.CharField(max_length=256, validators=[EmptyStringValidator()])
+    params = fields.JSONField(default=dict)
+    status = fields.data.CharEnumField(JobStatus, default=JobStatus.QUEUED)
+    attempts = fields.IntField(default=0)
+    status_code = fields.IntField(null=True)
+    result = fields.JSONField(null=True)
+    ckan_user = fields.CharField(max_length=256, default="admin")
+    date_created = fields.DatetimeField(auto_now_add=True)
+    date_modified = fields.DatetimeField(auto_now=True)
+    date_started = fields.DatetimeField(null=True)
+    date_finished = fields.DatetimeField(null=True)
+
+    def __str__(self):
+        """Return job type and id."""
+        return f"{self.job_type.value} job {self.job_pk}"
+
+    class Meta:
+        """Tortoise config."""
+
+        app = config_app.__NAME__
+        table = "datacite_job"
+        indexes = (("status", "date_created"),)
+
+
+DataciteJobPydantic = pydantic_model_creator(DataciteJob, name="DataciteJob")
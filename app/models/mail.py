@@ -0,0 +1,42 @@
+"""Models associated with outgoing emails."""
+
+from enum import Enum
+
+from tortoise import fields, models
+
+from app.config import config_app
+from app.models.validators import EmptyStringValidator
+
+
+class EmailStatus(str, Enum):
+    """Options for email delivery status."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    DEAD = "dead"
+
+
+class EmailMessage(models.Model):
+    """An email in the outbox, delivered to the mailer API in the background."""
+
+    message_pk = fields.IntField(pk=True, generated=True)
+    template = fields.CharField(max_length=128, validators=[EmptyStringValidator()])
+    payload = fields.JSONField()
+    status = fields.data.CharEnumField(EmailStatus, default=EmailStatus.PENDING)
+    attempts = fields.IntField(default=0)
+    last_error = fields.TextField(null=True)
+    next_attempt_at = fields.DatetimeField()
+    date_created = fields.DatetimeField(auto_now_add=True)
+    date_sent = fields.DatetimeField(null=True)
+
+    def __str__(self):
+        """Return template and id."""
+        return f"'{self.template}' email {self.message_pk}"
+
+    class Meta:
+        """Tortoise config."""
+
+        app = config_app.__NAME__
+        table = "email_outbox"
+        indexes = (("status", "next_attempt_at"),)
@@ -1,9 +1,18 @@
-"""Utils module for DOI Publishing API, for debugging."""
+"""Utils module for DOI Publishing API."""
 
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+import orjson
 
 log = logging.getLogger(__name__)
 
+
 def fix_url_double_slash(url):
     """Removed double slashes from a URL.
 
@@ -15,3 +24,86 @@ def fix_url_double_slash(url):
         rest = rest.replace("//", "/")
         return f"{scheme}://{rest}"
     return url
+
+
+def stable_json(data: Any) -> bytes:
+    """Return compact UTF-8 JSON of data with sorted keys.
+
+    Equal dicts give equal JSON regardless of key order.
+    """
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)
+
+
+def stable_hash(data: Any) -> str:
+    """Return sha256 hex digest of JSON serializable data.
+
+    Keys are sorted, so equal dicts give the same digest regardless of key order.
+    """
+    return hashlib.sha256(stable_json(data)).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry expiry and size-based eviction.
+
+    Entries expire 'ttl' seconds after being set. When 'maxsize' is reached the
+    least recently used entry is evicted. Hit and miss counters are kept for
+    monitoring.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        """Create empty cache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value for key, or default if missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Store value for key, evicting least recently used entries if full."""
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove key from cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries and reset counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Return cache size and hit/miss counters."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
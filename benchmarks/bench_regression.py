@@ -0,0 +1,308 @@
+"""Benchmarks of hot functions, compared with stored baselines.
+
+Fails (exit code 1) if a function got slower than its baseline in
+benchmarks/baselines.json by more than --tolerance, e.g. after bumping the
+converter, pydantic or tortoise-orm. Each benchmark is timed alongside a
+pure Python calibration loop and baselines are scaled by its time, so they
+can be compared across machines and under varying load.
+
+Run from the repository root, database benchmarks need a local Postgres
+server (DB_HOST, DB_USER, DB_PASS) that may create databases:
+python -m benchmarks.bench_regression
+Store new baselines after an intended change with --update.
+"""
+
+import argparse
+import asyncio
+import inspect
+import os
+import platform
+import sys
+import time
+import uuid
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+
+import orjson
+
+from benchmarks.loadtest import (
+    DEFAULT_ENV,
+    create_database,
+    drop_database,
+    init_database,
+)
+from benchmarks.packages import make_package
+
+BASELINES = Path(__file__).resolve().parent / "baselines.json"
+
+# Package sizes of the conversion benchmarks, as (resources, authors)
+PACKAGE_SIZES = {"small": (5, 3), "typical": (20, 8), "large": (300, 30)}
+
+# Numbers of DOIs in the database for the suffix benchmarks
+DOI_ROWS = {"10k": 10_000, "100k": 100_000}
+
+# Rows in the database are seeded directly, metadata as uncompressed '{}'
+SEED_DOIS_SQL = """
+INSERT INTO doi_realisation (
+    prefix_id, suffix_id, ckan_id, ckan_name, site_id, tag_id, ckan_user,
+    metadata, metadata_format, ckan_entity, date_created, date_modified
+)
+SELECT '{prefix}', '{tag}' || i, md5(i::text)::uuid, 'benchmark-' || i,
+    'benchmark', '{tag}', 'admin', decode('007b7d', 'hex'), 'ckan', 'package',
+    now(), now()
+FROM generate_series({start}, {stop}) AS i
+"""
+
+
+async def time_calls(func: Callable, number: int) -> float:
+    """Return seconds taken by 'number' calls of func, awaiting coroutines."""
+    start = time.perf_counter()
+    for _ in range(number):
+        result = func()
+        if inspect.isawaitable(result):
+            await result
+    return time.perf_counter() - start
+
+
+async def autorange(func: Callable, min_time: float) -> int:
+    """Return number of calls taking at least 'min_time' seconds, like timeit."""
+    number = 1
+    while (elapsed := await time_calls(func, number)) < min_time:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    return number
+
+
+def calibration():
+    """Pure Python work, its time is used to scale baselines."""
+    return sorted(str(i * 7919 % 1000) for i in range(2000))
+
+
+async def measure(func: Callable, repeat: int, min_time: float) -> dict:
+    """Return best time per call of func and of calibration() in microseconds.
+
+    Batches of func and calibration() alternate, so both are measured under
+    the same load of the machine.
+    """
+    number = await autorange(func, min_time)
+    calibration_number = await autorange(calibration, min_time)
+    best = best_calibration = float("inf")
+    for _ in range(repeat):
+        best_calibration = min(
+            best_calibration, await time_calls(calibration, calibration_number)
+        )
+        best = min(best, await time_calls(func, number))
+    return {
+        "us": round(best / number * 1e6, 2),
+        "calibration_us": round(best_calibration / calibration_number * 1e6, 2),
+    }
+
+
+def cpu_cases() -> dict[str, Callable]:
+    """Return benchmarks that do not need the database."""
+    import httpx
+    from envidat_converters.logic.converter_logic.envidat_to_datacite import (
+        EnviDatToDataCite,
+    )
+
+    from app.logic.conversion import convert_package_to_datacite, xml_to_base64
+    from app.logic.datacite import format_response, validate_doi
+
+    cases = {}
+    for size, (resources, authors) in PACKAGE_SIZES.items():
+        package = make_package(resources=resources, authors=authors)
+        cases[f"convert_package_to_datacite[{size}]"] = (
+            lambda package=package: convert_package_to_datacite(package)
+        )
+
+    package = make_package()
+    xml = str(EnviDatToDataCite(package))
+    cases["xml_to_base64[typical]"] = lambda: xml_to_base64(xml)
+    cases["validate_doi"] = lambda: validate_doi(package, has_envidat_prefix=True)
+
+    doi = package["doi"]
+    response = httpx.Response(
+        201,
+        content=orjson.dumps(
+            {
+                "data": {
+                    "id": doi,
+                    "type": "dois",
+                    "attributes": {"doi": doi, "state": "draft", "xml": None},
+                }
+            }
+        ),
+    )
+    cases["format_response"] = lambda: format_response(response)
+    return cases
+
+
+async def seed_dois(start: int, stop: int):
+    """Insert DOIs with suffix IDs from start to stop, inclusive."""
+    from tortoise import connections
+
+    from app.config import config_app
+
+    await connections.get("default").execute_script(
+        SEED_DOIS_SQL.format(
+            prefix=config_app.DOI_PREFIX,
+            tag=config_app.DOI_SUFFIX_TAG,
+            start=start,
+            stop=stop,
+        )
+    )
+
+
+async def db_cases() -> AsyncIterator[tuple[str, Callable]]:
+    """Yield database benchmarks, seeding DOIs before those that need them."""
+    from app.config import config_app
+    from app.logic.minter import (
+        create_db_doi,
+        get_max_doi_suffix_id,
+        get_next_doi_suffix_id,
+    )
+    from app.models.doi import (
+        DoiRealisation,
+        DoiRealisationPydantic,
+        DoiSuffixCounter,
+    )
+
+    seeded = 0
+    for label, rows in DOI_ROWS.items():
+        await seed_dois(seeded + 1, rows)
+        seeded = rows
+        # Counter is seeded again from the highest suffix ID on the next call
+        await DoiSuffixCounter.all().delete()
+        yield f"get_max_doi_suffix_id[{label}]", lambda: get_max_doi_suffix_id(
+            config_app.DOI_PREFIX, config_app.DOI_SUFFIX_TAG
+        )
+        yield f"get_next_doi_suffix_id[{label}]", get_next_doi_suffix_id
+
+    package = make_package()
+    package["doi"] = ""
+    yield "create_db_doi[typical]", lambda: create_db_doi(
+        "admin", {**package, "id": str(uuid.uuid4()), "name": uuid.uuid4().hex}
+    )
+
+    dois = await DoiRealisation.all().limit(1000)
+    yield "DoiRealisationPydantic[1000]", lambda: [
+        DoiRealisationPydantic.model_validate(doi) for doi in dois
+    ]
+
+
+def load_baselines() -> dict:
+    """Return stored baselines by benchmark name, empty if there are none."""
+    if not BASELINES.exists():
+        return {}
+    return orjson.loads(BASELINES.read_bytes())["cases"]
+
+
+def save_baselines(baselines: dict, results: dict):
+    """Store results as baselines, keeping baselines of benchmarks not run."""
+    BASELINES.write_bytes(
+        orjson.dumps(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cases": dict(sorted({**baselines, **results}.items())),
+            },
+            option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE,
+        )
+    )
+
+
+def compare(baselines: dict, results: dict, tolerance: float) -> bool:
+    """Print results against baselines, return False on regressions.
+
+    Times are compared relative to calibration() measured alongside them.
+    """
+    print(f"{'case':<40} {'baseline µs':>12} {'current µs':>12} {'change':>8}")
+    passed = True
+    for name, result in results.items():
+        if (baseline := baselines.get(name)) is None:
+            print(f"{name:<40} {'':>12} {result['us']:>12.1f} {'':>8} new")
+            continue
+        # Baseline scaled to the speed of this machine
+        scaled_us = (
+            baseline["us"] / baseline["calibration_us"] * result["calibration_us"]
+        )
+        change = result["us"] / scaled_us - 1
+        status = ""
+        if change > tolerance:
+            status = "REGRESSED"
+            passed = False
+        print(f"{name:<40} {scaled_us:>12.1f} {result['us']:>12.1f} "
+              f"{change:>+8.0%} {status}")
+    return passed
+
+
+async def run(args: argparse.Namespace) -> dict[str, dict]:
+    """Run benchmarks matching --filter, return results of measure()."""
+    from tortoise import Tortoise
+
+    results = {}
+
+    async def run_case(name: str, func: Callable):
+        if args.filter and args.filter not in name:
+            return
+        results[name] = await measure(func, args.repeat, args.min_time)
+        print(f"{name:<40} {results[name]['us']:>12.1f} µs", file=sys.stderr)
+
+    for name, func in cpu_cases().items():
+        await run_case(name, func)
+
+    if args.no_db:
+        return results
+
+    db_name = os.environ["DB_NAME"]
+    await create_database(db_name)
+    try:
+        await init_database(db_name)
+        async for name, func in db_cases():
+            await run_case(name, func)
+    finally:
+        await Tortoise.close_connections()
+        await drop_database(db_name)
+    return results
+
+
+def main():
+    """Parse arguments, run benchmarks and compare or update baselines."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown compared to baseline, 0.3 is 30%%")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed batches per benchmark, the best is used")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="minimum seconds per timed batch")
+    parser.add_argument("--filter", help="only run benchmarks containing this")
+    parser.add_argument("--no-db", action="store_true",
+                        help="skip benchmarks that need the database")
+    parser.add_argument("--update", action="store_true",
+                        help="store results as new baselines")
+    args = parser.parse_args()
+
+    os.environ.update(
+        {
+            **DEFAULT_ENV,
+            **os.environ,
+            "IS_DOCKER": "True",
+            "DB_NAME": f"doi_benchmark_{uuid.uuid4().hex[:8]}",
+        }
+    )
+
+    results = asyncio.run(run(args))
+    baselines = load_baselines()
+
+    if args.update:
+        save_baselines(baselines, results)
+        print(f"Stored {len(results)} baselines in {BASELINES}")
+        return
+    if not compare(baselines, results, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
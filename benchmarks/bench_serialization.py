@@ -0,0 +1,68 @@
+"""Compare stdlib json and orjson serialization on real-sized EnviDat packages.
+
+Run from the repository root: python -m benchmarks.bench_serialization
+"""
+
+import json
+import timeit
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from benchmarks.packages import make_package
+
+SIZES = {"small": (5, 3), "typical": (20, 8), "large": (300, 30)}
+
+
+def cases(package: dict) -> dict:
+    """Return benchmark cases as {name: (before, after)}."""
+    xml = "<resource>" + json.dumps(package) + "</resource>"
+    payload = {"data": {"type": "dois", "attributes": {"xml": xml}}}
+    return {
+        "metadata snapshot": (
+            lambda: json.dumps(package),
+            lambda: orjson.dumps(package).decode(),
+        ),
+        "stable hash json": (
+            lambda: json.dumps(
+                package, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+            ).encode("utf-8"),
+            lambda: orjson.dumps(package, option=orjson.OPT_SORT_KEYS),
+        ),
+        "DataCite payload": (
+            lambda: json.dumps(payload),
+            lambda: orjson.dumps(payload),
+        ),
+        "response body": (
+            lambda: JSONResponse(package).body,
+            lambda: ORJSONResponse(package).body,
+        ),
+        "package parse": (
+            lambda: json.loads(json.dumps(package)),
+            lambda: orjson.loads(orjson.dumps(package)),
+        ),
+    }
+
+
+def best_time(func, number: int) -> float:
+    """Return best time per call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    """Print before/after time per call for each package size."""
+    print(f"{'case':<20} {'size':<8} {'bytes':>9} {'before µs':>10} "
+          f"{'after µs':>10} {'speedup':>8}")
+    for size, (resources, authors) in SIZES.items():
+        package = make_package(resources=resources, authors=authors)
+        size_bytes = len(orjson.dumps(package))
+        number = max(10, 2_000_000 // size_bytes)
+        for name, (before, after) in cases(package).items():
+            before_us = best_time(before, number)
+            after_us = best_time(after, number)
+            print(f"{name:<20} {size:<8} {size_bytes:>9} {before_us:>10.1f} "
+                  f"{after_us:>10.1f} {before_us / after_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
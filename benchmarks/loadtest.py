@@ -0,0 +1,330 @@
+"""End-to-end load test of the DataCite endpoints against local stand-ins.
+
+Starts the CKAN, DataCite and mailer stand-ins (benchmarks/standins.py),
+creates a fresh Postgres database, starts the API with uvicorn and takes
+each package through '/datacite/draft', '/datacite/request' and
+'/datacite/publish', many packages concurrently. Prints throughput and
+p50/p95/p99 latency per endpoint, use --output to save them as JSON for
+comparing releases. No network access is needed.
+
+Run from the repository root, with DB_HOST, DB_USER and DB_PASS of a local
+Postgres server that may create databases:
+python -m benchmarks.loadtest --packages 200 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import orjson
+
+from benchmarks.packages import make_package
+from benchmarks.standins import (
+    ADMIN_TOKEN,
+    USER_TOKEN,
+    add_behaviour_arguments,
+    get_standins,
+    start_server,
+    stop_servers,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+ENDPOINTS = ("draft", "request", "publish")
+
+# Values for settings the API requires, the DB_* ones can be overridden.
+# Upstream URLs are replaced with those of the stand-ins.
+DEFAULT_ENV = {
+    "IS_DOCKER": "True",
+    "APP_VERSION": "loadtest",
+    "DEBUG": "False",
+    "DB_HOST": "localhost",
+    "DB_USER": "postgres",
+    "DB_PASS": "postgres",
+    "CKAN_API_URL": "http://127.0.0.1:5000",
+    "DATACITE_API_URL": "http://127.0.0.1:5001/dois",
+    "EMAIL_ENDPOINT": "http://127.0.0.1:5002",
+    "DATACITE_CLIENT_ID": "LOADTEST",
+    "DATACITE_PASSWORD": "loadtest",
+    "DOI_PREFIX": "10.16904",
+    "DOI_SUFFIX_TAG": "envidat.",
+    "EMAIL_FROM": "loadtest@example.com",
+}
+
+
+def free_port() -> int:
+    """Return free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return nearest-rank percentile of values, 0 if there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(-(-percent * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+async def init_database(db_name: str, create: bool = False):
+    """Connect Tortoise ORM to database, creating it with the API schema."""
+    from tortoise import Tortoise
+
+    from app.config import config_app
+    from app.db import TORTOISE_ORM
+
+    await Tortoise.init(
+        db_url=config_app.DB_URI.rsplit("/", 1)[0] + f"/{db_name}",
+        modules={
+            config_app.__NAME__: TORTOISE_ORM["apps"][config_app.__NAME__]["models"]
+        },
+        _create_db=create,
+    )
+    if create:
+        await Tortoise.generate_schemas()
+
+
+async def create_database(db_name: str):
+    """Create database with the API schema."""
+    from tortoise import Tortoise
+
+    await init_database(db_name, create=True)
+    await Tortoise.close_connections()
+
+
+async def drop_database(db_name: str):
+    """Drop database created by create_database()."""
+    from tortoise import Tortoise
+
+    await init_database(db_name)
+    await Tortoise._drop_databases()
+
+
+def start_api(env: dict, port: int, log_path: Path | None) -> subprocess.Popen:
+    """Start API with uvicorn in a subprocess, writing its output to log_path."""
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "error", "--no-access-log",
+    ]
+    if log_path is None:
+        return subprocess.Popen(
+            command,
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT,
+        )
+    # The subprocess keeps its own handle, the file is closed here
+    with log_path.open("wb") as log_file:
+        return subprocess.Popen(
+            command,
+            cwd=ROOT,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+
+
+async def wait_for_api(client: httpx.AsyncClient, api: subprocess.Popen):
+    """Wait until API answers requests."""
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if api.poll() is not None:
+            raise RuntimeError(f"API exited with code {api.returncode}")
+        try:
+            if (await client.get("/openapi.json")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API did not start within 60 seconds")
+
+
+async def run_package(
+    client: httpx.AsyncClient, package_name: str, samples: dict[str, list]
+):
+    """Take package from draft to published, stop at the first failed step."""
+    steps = (
+        ("draft", USER_TOKEN),
+        ("request", USER_TOKEN),
+        ("publish", ADMIN_TOKEN),
+    )
+    for endpoint, token in steps:
+        start = time.perf_counter()
+        try:
+            response = await client.get(
+                f"/datacite/{endpoint}",
+                params={"package-id": package_name},
+                headers={"Authorization": token},
+            )
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        samples[endpoint].append((time.perf_counter() - start, status))
+        if status not in range(200, 300):
+            return
+
+
+def summarize(samples: dict[str, list], duration: float) -> dict:
+    """Return count, errors, throughput and latency percentiles per endpoint."""
+    results = {}
+    for endpoint, endpoint_samples in samples.items():
+        latencies = [seconds for seconds, _ in endpoint_samples]
+        statuses: dict[str, int] = {}
+        for _, status in endpoint_samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[endpoint] = {
+            "requests": len(endpoint_samples),
+            "errors": sum(
+                1 for _, status in endpoint_samples if status not in range(200, 300)
+            ),
+            "statuses": statuses,
+            "throughput_rps": round(len(endpoint_samples) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+    return results
+
+
+def print_report(report: dict):
+    """Print results as table."""
+    print(f"{report['packages']} packages, concurrency {report['concurrency']}, "
+          f"{report['duration_seconds']:.1f}s, "
+          f"{report['packages_per_second']:.2f} packages/s")
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, result in report["endpoints"].items():
+        print(f"{endpoint:<10} {result['requests']:>9} {result['errors']:>7} "
+              f"{result['throughput_rps']:>8.2f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+def git_version() -> str | None:
+    """Return 'git describe' of the tested tree, or None outside git."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """Run load test and return report."""
+    ckan, datacite, mailer = get_standins(args)
+    ports = [free_port() for _ in range(4)]
+    servers = [
+        await start_server(standin.app, "127.0.0.1", port)
+        for standin, port in zip((ckan, datacite, mailer), ports)
+    ]
+
+    db_name = f"doi_loadtest_{uuid.uuid4().hex[:8]}"
+    env = {
+        **DEFAULT_ENV,
+        **os.environ,
+        "IS_DOCKER": "True",
+        "DB_NAME": db_name,
+        "CKAN_API_URL": f"http://127.0.0.1:{ports[0]}",
+        "DATACITE_API_URL": f"http://127.0.0.1:{ports[1]}/dois",
+        "EMAIL_ENDPOINT": f"http://127.0.0.1:{ports[2]}",
+    }
+    os.environ.update(env)
+    await create_database(db_name)
+
+    package_names = []
+    for _ in range(args.packages):
+        package = make_package(resources=args.resources, authors=args.authors)
+        package.update({"doi": "", "publication_state": "", "private": True})
+        ckan.add_package(package)
+        package_names.append(package["name"])
+
+    api = start_api(env, ports[3], args.api_log)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{ports[3]}",
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            await wait_for_api(client, api)
+
+            samples: dict[str, list] = {endpoint: [] for endpoint in ENDPOINTS}
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(package_name: str):
+                async with semaphore:
+                    await run_package(client, package_name, samples)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(limited(name) for name in package_names))
+            duration = time.perf_counter() - start
+    finally:
+        api.terminate()
+        api.wait()
+        await stop_servers(servers)
+        if not args.keep_db:
+            await drop_database(db_name)
+
+    return {
+        "version": git_version(),
+        "packages": args.packages,
+        "concurrency": args.concurrency,
+        "standins": {
+            "ckan_latency": args.ckan_latency,
+            "datacite_latency": args.datacite_latency,
+            "mail_latency": args.mail_latency,
+            "error_rate": args.error_rate,
+        },
+        "duration_seconds": round(duration, 3),
+        "packages_per_second": round(args.packages / duration, 2),
+        "published": sum(
+            1 for state in datacite.dois.values() if state == "findable"
+        ),
+        "emails_sent": sum(mailer.sent.values()),
+        "endpoints": summarize(samples, duration),
+    }
+
+
+def main():
+    """Parse arguments, run load test and print report."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--packages", type=int, default=100,
+                        help="packages taken from draft to published")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="packages in progress at the same time")
+    parser.add_argument("--resources", type=int, default=20,
+                        help="resources per package")
+    parser.add_argument("--authors", type=int, default=8,
+                        help="authors per package")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="seconds to wait for each API response")
+    parser.add_argument("--output", type=Path,
+                        help="write report as JSON to this file")
+    parser.add_argument("--api-log", type=Path,
+                        help="write API output to this file, default discards it")
+    parser.add_argument("--keep-db", action="store_true",
+                        help="do not drop the database after the test")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        args.output.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
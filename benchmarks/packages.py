@@ -0,0 +1,75 @@
+"""Synthetic EnviDat packages for benchmarks and load tests.
+
+Sizes follow real EnviDat datasets: typical packages have a handful of
+authors and resources, large ones hundreds of resources.
+"""
+
+import json
+import uuid
+
+
+def make_author(i: int) -> dict:
+    """Return EnviDat author."""
+    return {
+        "name": f"Surname{i}",
+        "given_name": f"Given{i}",
+        "email": f"author{i}@example.com",
+        "affiliation": "Swiss Federal Institute for Forest, Snow and Landscape "
+                       "Research WSL",
+        "identifier": f"0000-0002-{i:04d}-0000",
+        "identifier_scheme": "orcid",
+        "data_credit": ["collection", "validation", "publication"],
+    }
+
+
+def make_resource(package_id: str, i: int) -> dict:
+    """Return CKAN resource of EnviDat package."""
+    return {
+        "id": str(uuid.uuid4()),
+        "package_id": package_id,
+        "name": f"measurements_station_{i:04d}.csv",
+        "description": "Half-hourly measurements of air temperature, relative "
+                       "humidity, wind speed and snow height. " * 3,
+        "format": "CSV",
+        "url": f"https://www.envidat.ch/dataset/{package_id}/resource/{i}.csv",
+        "size": 1024 * (i + 1),
+        "created": "2023-05-04T10:11:12.123456",
+        "last_modified": "2024-01-02T03:04:05.678901",
+        "restricted": json.dumps({"level": "public", "allowed_users": ""}),
+        "doi": "",
+        "resource_size": json.dumps({"size_value": "", "size_units": "kb"}),
+    }
+
+
+def make_package(resources: int = 20, authors: int = 8) -> dict:
+    """Return CKAN package in EnviDat schema with resources and authors."""
+    package_id = str(uuid.uuid4())
+    return {
+        "id": package_id,
+        "name": f"benchmark-{package_id[:8]}",
+        "title": "Long-term snow and meteorological measurements in the Swiss Alps",
+        "doi": "10.16904/envidat.123",
+        "notes": "Measurements from automatic weather stations. " * 40,
+        "author": json.dumps([make_author(i) for i in range(authors)]),
+        "maintainer": json.dumps(make_author(0)),
+        "publication": json.dumps(
+            {"publisher": "EnviDat", "publication_year": "2024"}
+        ),
+        "publication_state": "approved",
+        "private": False,
+        "license_id": "cc-by-sa",
+        "tags": [{"name": f"TAG {i}", "display_name": f"TAG {i}"} for i in range(15)],
+        "spatial": json.dumps(
+            {"type": "Point", "coordinates": [7.8, 46.8]}
+        ),
+        "date": json.dumps(
+            [{"date": "2020-01-01", "date_type": "collected", "end_date": "2024-01-01"}]
+        ),
+        "funding": json.dumps([{"institution": "WSL", "grant_number": "123"}]),
+        "related_identifiers": "",
+        "related_datasets": "",
+        "version": "1.0",
+        "resource_type_general": "dataset",
+        "organization": {"name": "wsl", "title": "WSL"},
+        "resources": [make_resource(package_id, i) for i in range(resources)],
+    }
@@ -0,0 +1,299 @@
+"""Local stand-ins for CKAN, DataCite and the mailer API, for load tests.
+
+Each stand-in answers the calls made by the API with configurable latency and
+error rate, state is kept in memory. Run them on their own with:
+python -m benchmarks.standins
+then start the API with CKAN_API_URL, DATACITE_API_URL and EMAIL_ENDPOINT
+pointing to them, see benchmarks/loadtest.py to do both in one go.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime
+
+import uvicorn
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import ORJSONResponse
+
+log = logging.getLogger(__name__)
+
+ADMIN_TOKEN = "loadtest-admin"
+USER_TOKEN = "loadtest-user"
+
+USERS = {
+    ADMIN_TOKEN: {
+        "name": "loadtest-admin",
+        "display_name": "Load Test Admin",
+        "email": "admin@example.com",
+        "sysadmin": True,
+    },
+    USER_TOKEN: {
+        "name": "loadtest-user",
+        "display_name": "Load Test User",
+        "email": "user@example.com",
+        "sysadmin": False,
+    },
+}
+
+
+@dataclass
+class Behaviour:
+    """Simulated latency in seconds and fraction of requests failing.
+
+    Latency of each request is drawn uniformly from 50% to 150% of 'latency'.
+    """
+
+    latency: float = 0.0
+    error_rate: float = 0.0
+
+    async def simulate(self) -> bool:
+        """Wait for simulated latency, return True if request should fail."""
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return random.random() < self.error_rate
+
+
+def ckan_error(status_code: int, error_type: str, message: str) -> ORJSONResponse:
+    """Return CKAN action error, parsed by ckanapi into its exceptions."""
+    return ORJSONResponse(
+        {"success": False, "error": {"__type": error_type, "message": message}},
+        status_code=status_code,
+    )
+
+
+def solr_timestamp(value: str) -> str:
+    """Return timestamp as CKAN's Solr index returns it, e.g. with 'fl' set.
+
+    Solr stores milliseconds and CKAN indexes timestamps with a 'Z' suffix.
+    """
+    return f"{value[:23]}Z"
+
+
+class CkanStandin:
+    """CKAN stand-in answering 'user_show', 'package_show', 'package_patch' and
+    'package_search' by id.
+
+    Users are authenticated with ADMIN_TOKEN or USER_TOKEN, packages are added
+    with add_package() or by POSTing them to '/_standin/packages', and can be
+    read by id or name.
+    """
+
+    def __init__(self, behaviour: Behaviour):
+        """Create stand-in without packages."""
+        self.behaviour = behaviour
+        self.packages: dict[str, dict] = {}
+        self.names: dict[str, str] = {}
+        self.app = FastAPI()
+        self.app.post("/api/action/{action}")(self.action)
+        self.app.post("/_standin/packages", status_code=201)(self.seed)
+
+    def add_package(self, package: dict):
+        """Add package, replacing a package with the same id."""
+        package.setdefault("metadata_modified", datetime.now().isoformat())
+        self.packages[package["id"]] = package
+        self.names[package["name"]] = package["id"]
+
+    async def seed(self, packages: list[dict]) -> dict:
+        """Add packages sent to the stand-in."""
+        for package in packages:
+            self.add_package(package)
+        return {"count": len(self.packages)}
+
+    def get_package(self, package_id: str) -> dict | None:
+        """Return package by id or name, or None."""
+        return self.packages.get(self.names.get(package_id, package_id))
+
+    async def action(
+        self,
+        action: str,
+        request: Request,
+        authorization: str | None = Header(default=None),
+    ) -> ORJSONResponse:
+        """Handle CKAN API action."""
+        if await self.behaviour.simulate():
+            return ckan_error(500, "Internal Server Error", "Simulated failure")
+        if (user := USERS.get(authorization)) is None:
+            return ckan_error(403, "Authorization Error", "Invalid API token")
+
+        data = await request.json() if await request.body() else {}
+        if action == "user_show":
+            return ORJSONResponse({"success": True, "result": user})
+        if action == "package_search":
+            # Only searches by id are supported: fq='id:"<id>"'
+            package_id = data.get("fq", "").partition(":")[2].strip('"')
+            results = [
+                {
+                    "id": package["id"],
+                    "metadata_modified": solr_timestamp(package["metadata_modified"]),
+                }
+                for package in [self.packages.get(package_id)]
+                if package
+            ]
+            return ORJSONResponse(
+                {"success": True, "result": {"count": len(results), "results": results}}
+            )
+        if action not in ("package_show", "package_patch"):
+            return ckan_error(400, "Validation Error", f"Unknown action {action}")
+        if (package := self.get_package(data.get("id", ""))) is None:
+            return ckan_error(404, "Not Found Error", "Package not found")
+        if action == "package_patch":
+            package.update({k: v for k, v in data.items() if k != "id"})
+            package["metadata_modified"] = datetime.now().isoformat()
+        return ORJSONResponse({"success": True, "result": package})
+
+
+class DataciteStandin:
+    """DataCite stand-in reserving draft DOIs (POST) and publishing them (PUT).
+
+    Failures are returned as 503, which the API retries.
+    """
+
+    def __init__(self, behaviour: Behaviour):
+        """Create stand-in without DOIs."""
+        self.behaviour = behaviour
+        self.dois: dict[str, str] = {}
+        self.app = FastAPI()
+        self.app.post("/dois")(self.create)
+        self.app.put("/dois/{doi:path}")(self.update)
+
+    async def create(self, request: Request) -> ORJSONResponse:
+        """Reserve draft DOI."""
+        if await self.behaviour.simulate():
+            return self.unavailable()
+        doi = (await request.json())["data"]["attributes"]["doi"]
+        if doi in self.dois:
+            return ORJSONResponse(
+                {"errors": [{"source": "doi", "title": "This DOI has already "
+                                                        "been taken"}]},
+                status_code=422,
+            )
+        self.dois[doi] = "draft"
+        return self.doi_response(doi, 201)
+
+    async def update(self, doi: str, request: Request) -> ORJSONResponse:
+        """Publish or update DOI."""
+        if await self.behaviour.simulate():
+            return self.unavailable()
+        attributes = (await request.json())["data"]["attributes"]
+        if not attributes.get("xml") or not attributes.get("url"):
+            return ORJSONResponse(
+                {"errors": [{"title": "Missing metadata"}]}, status_code=422
+            )
+        self.dois[doi] = "findable"
+        return self.doi_response(doi, 200)
+
+    def doi_response(self, doi: str, status_code: int) -> ORJSONResponse:
+        """Return DataCite DOI response."""
+        return ORJSONResponse(
+            {"data": {"id": doi, "type": "dois",
+                      "attributes": {"doi": doi, "state": self.dois[doi]}}},
+            status_code=status_code,
+        )
+
+    @staticmethod
+    def unavailable() -> ORJSONResponse:
+        """Return simulated DataCite outage."""
+        return ORJSONResponse(
+            {"errors": [{"status": "503", "title": "Simulated failure"}]},
+            status_code=503,
+        )
+
+
+class MailerStandin:
+    """Mailer API stand-in accepting email templates, counting sent emails."""
+
+    def __init__(self, behaviour: Behaviour):
+        """Create stand-in without sent emails."""
+        self.behaviour = behaviour
+        self.sent: dict[str, int] = {}
+        self.app = FastAPI()
+        self.app.post("/templates/{template}/json")(self.send)
+
+    async def send(self, template: str) -> ORJSONResponse:
+        """Accept email."""
+        if await self.behaviour.simulate():
+            return ORJSONResponse({"detail": "Simulated failure"}, status_code=503)
+        self.sent[template] = self.sent.get(template, 0) + 1
+        return ORJSONResponse({"success": True})
+
+
+async def start_server(app: FastAPI, host: str, port: int) -> uvicorn.Server:
+    """Serve app in the running event loop, return once it accepts requests."""
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host=host, port=port, log_level="warning", access_log=False
+        )
+    )
+    # Keep reference to task, the server is stopped with server.should_exit
+    server.task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server.task.done():
+            server.task.result()
+            raise RuntimeError(f"Server on port {port} stopped during startup")
+        await asyncio.sleep(0.01)
+    return server
+
+
+async def stop_servers(servers: list[uvicorn.Server]):
+    """Stop servers started with start_server()."""
+    for server in servers:
+        server.should_exit = True
+    await asyncio.gather(*(server.task for server in servers))
+
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser):
+    """Add latency and error rate options of the stand-ins to parser."""
+    parser.add_argument("--ckan-latency", type=float, default=0.05,
+                        help="mean CKAN response time in seconds")
+    parser.add_argument("--datacite-latency", type=float, default=0.2,
+                        help="mean DataCite response time in seconds")
+    parser.add_argument("--mail-latency", type=float, default=0.05,
+                        help="mean mailer response time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of stand-in responses that fail")
+
+
+def get_standins(
+    args: argparse.Namespace,
+) -> tuple[CkanStandin, DataciteStandin, MailerStandin]:
+    """Return stand-ins configured by add_behaviour_arguments() options."""
+    return (
+        CkanStandin(Behaviour(args.ckan_latency, args.error_rate)),
+        DataciteStandin(Behaviour(args.datacite_latency, args.error_rate)),
+        MailerStandin(Behaviour(args.mail_latency, args.error_rate)),
+    )
+
+
+async def serve_forever(args: argparse.Namespace):
+    """Run stand-ins until interrupted."""
+    ckan, datacite, mailer = get_standins(args)
+    ports = {"CKAN": args.ckan_port, "DataCite": args.datacite_port,
+             "mailer": args.mail_port}
+    servers = [
+        await start_server(standin.app, args.host, port)
+        for standin, port in zip((ckan, datacite, mailer), ports.values())
+    ]
+    for name, port in ports.items():
+        print(f"{name} stand-in listening on http://{args.host}:{port}")
+    try:
+        await asyncio.gather(*(server.task for server in servers))
+    finally:
+        await stop_servers(servers)
+
+
+def main():
+    """Parse arguments and run stand-ins."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ckan-port", type=int, default=5000)
+    parser.add_argument("--datacite-port", type=int, default=5001)
+    parser.add_argument("--mail-port", type=int, default=5002)
+    add_behaviour_arguments(parser)
+    asyncio.run(serve_forever(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+-- Migration: add datacite_job table used to queue background DataCite jobs
+
+CREATE TABLE IF NOT EXISTS public.datacite_job (
+    job_pk SERIAL PRIMARY KEY,
+    job_type VARCHAR(7) DEFAULT 'publish' NOT NULL,
+    package_id TEXT NOT NULL,
+    params JSONB DEFAULT '{}'::jsonb NOT NULL,
+    status VARCHAR(9) DEFAULT 'queued' NOT NULL,
+    attempts INT DEFAULT 0 NOT NULL,
+    status_code INT,
+    result JSONB,
+    ckan_user TEXT DEFAULT 'admin' NOT NULL,
+    date_created TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_modified TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_started TIMESTAMPTZ,
+    date_finished TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_datacite_job_status_created
+    ON public.datacite_job (status, date_created);
+
+ALTER TABLE public.datacite_job OWNER TO postgres;
+GRANT ALL ON TABLE public.datacite_job TO postgres;
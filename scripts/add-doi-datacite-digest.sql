@@ -0,0 +1,5 @@
+-- Migration: store digest of metadata last published to DataCite per DOI
+-- Used to skip DataCite updates when converted metadata did not change.
+
+ALTER TABLE public.doi_realisation
+    ADD COLUMN IF NOT EXISTS datacite_digest VARCHAR(64);
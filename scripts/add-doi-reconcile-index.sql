@@ -0,0 +1,6 @@
+-- Migration: index package DOIs by uppercase DOI, the order DataCite sorts DOIs in,
+-- used by the DOI reconciliation to read DOIs sorted with keyset pagination
+
+CREATE INDEX IF NOT EXISTS idx_doi_realisation_doi_key
+    ON public.doi_realisation ((upper(prefix_id || '/' || suffix_id) COLLATE "C"), doi_pk)
+    WHERE ckan_entity = 'package';
@@ -0,0 +1,30 @@
+-- Migration: add doi_suffix_counter used to allocate DOI suffixes
+-- The counter is seeded from the highest existing suffix by the API on first use,
+-- or explicitly with the INSERT below for every prefix and suffix tag in use.
+-- The suffix tag is the suffix without its trailing number, for example 'envidat.'
+
+CREATE TABLE IF NOT EXISTS public.doi_suffix_counter (
+    counter_pk SERIAL PRIMARY KEY,
+    prefix_id TEXT NOT NULL,
+    tag_id TEXT DEFAULT '' NOT NULL,
+    last_value BIGINT DEFAULT 0 NOT NULL,
+    CONSTRAINT unique_prefix_tag UNIQUE (prefix_id, tag_id),
+    CONSTRAINT counter_prefix_fk FOREIGN KEY (prefix_id)
+        REFERENCES public.doi_prefix(prefix_id)
+);
+
+ALTER TABLE public.doi_suffix_counter OWNER TO postgres;
+GRANT ALL ON TABLE public.doi_suffix_counter TO postgres;
+
+INSERT INTO public.doi_suffix_counter (prefix_id, tag_id, last_value)
+SELECT prefix_id, suffix_tag, MAX(suffix_number)
+FROM (
+    SELECT d.prefix_id,
+           regexp_replace(d.suffix_id, '\d+$', '') AS suffix_tag,
+           substring(d.suffix_id FROM '(\d+)$')::BIGINT AS suffix_number
+    FROM public.doi_realisation d
+    JOIN public.doi_prefix p ON p.prefix_id = d.prefix_id
+    WHERE d.suffix_id ~ '\d+$'
+) AS suffixes
+GROUP BY prefix_id, suffix_tag
+ON CONFLICT (prefix_id, tag_id) DO NOTHING;
@@ -0,0 +1,8 @@
+-- Migration: guarantee a DOI can only be minted once
+-- Required so concurrent minting detects suffix IDs that are already taken.
+-- Fails if duplicates already exist, list them first with:
+-- SELECT prefix_id, suffix_id, COUNT(*) FROM public.doi_realisation
+-- GROUP BY prefix_id, suffix_id HAVING COUNT(*) > 1;
+
+ALTER TABLE ONLY public.doi_realisation
+    ADD CONSTRAINT unique_prefix_suffix UNIQUE (prefix_id, suffix_id);
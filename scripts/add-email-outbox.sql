@@ -0,0 +1,19 @@
+-- Migration: add email_outbox table used to deliver emails in the background
+
+CREATE TABLE IF NOT EXISTS public.email_outbox (
+    message_pk SERIAL PRIMARY KEY,
+    template VARCHAR(128) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(7) DEFAULT 'pending' NOT NULL,
+    attempts INT DEFAULT 0 NOT NULL,
+    last_error TEXT,
+    next_attempt_at TIMESTAMPTZ NOT NULL,
+    date_created TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_sent TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next_attempt
+    ON public.email_outbox (status, next_attempt_at);
+
+ALTER TABLE public.email_outbox OWNER TO postgres;
+GRANT ALL ON TABLE public.email_outbox TO postgres;
@@ -0,0 +1,6 @@
+-- Migration: add 'external' ckan_site referenced by DOIs imported from external
+-- platforms. Their DOI prefixes are added to doi_prefix by the API on import.
+
+INSERT INTO public.ckan_site (site_id, description)
+VALUES ('external', 'DOIs registered on external platforms')
+ON CONFLICT (site_id) DO NOTHING;
@@ -0,0 +1,8 @@
+-- Migration: store doi_realisation.metadata compressed as binary
+-- Existing text is kept uncompressed, prefixed with format marker byte 0x00.
+-- Afterwards compress existing rows in batches with:
+-- python -m scripts.compress_doi_metadata
+
+ALTER TABLE public.doi_realisation
+    ALTER COLUMN metadata TYPE BYTEA
+    USING decode('00', 'hex') || convert_to(metadata, 'UTF8');
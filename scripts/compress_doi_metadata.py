@@ -0,0 +1,71 @@
+"""Compress doi_realisation.metadata rows still stored uncompressed.
+
+Run after 'compress-doi-metadata.sql' from the repository root:
+python -m scripts.compress_doi_metadata [--batch-size 500]
+
+Rows are rewritten in batches, each batch in its own transaction,
+so the script can be stopped and started again at any time.
+Rows that do not get smaller are marked as incompressible and not read again.
+"""
+
+import argparse
+import asyncio
+import logging
+
+from tortoise import Tortoise, connections
+from tortoise.transactions import in_transaction
+
+from app.db import TORTOISE_ORM
+from app.models.doi import DoiRealisation
+
+log = logging.getLogger(__name__)
+
+# Primary keys of rows with format marker 0x00 (uncompressed), after a cursor
+SELECT_UNCOMPRESSED = (
+    "SELECT doi_pk FROM doi_realisation "
+    "WHERE doi_pk > $1 AND get_byte(metadata, 0) = 0 "
+    "ORDER BY doi_pk LIMIT $2"
+)
+
+
+async def compress_metadata(batch_size: int) -> int:
+    """Rewrite uncompressed metadata in batches, return number of rows checked."""
+    after = 0
+    total = 0
+    while True:
+        rows = await connections.get("default").execute_query_dict(
+            SELECT_UNCOMPRESSED, [after, batch_size]
+        )
+        if not rows:
+            return total
+
+        pks = [row["doi_pk"] for row in rows]
+        async with in_transaction() as conn:
+            dois = await DoiRealisation.filter(doi_pk__in=pks).using_db(conn)
+            for doi in dois:
+                # Saving encodes metadata again, compressed if it gets smaller,
+                # else with the incompressible format marker
+                await doi.save(using_db=conn, update_fields=["metadata"])
+
+        after = pks[-1]
+        total += len(pks)
+        log.info(f"Compressed metadata of {total} rows, last doi_pk {after}")
+
+
+async def main(batch_size: int):
+    """Connect to database and compress metadata."""
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        total = await compress_metadata(batch_size)
+        log.info(f"Finished, {total} rows rewritten")
+    finally:
+        await connections.close_all()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.batch_size))
@@ -20,6 +20,10 @@ ALTER TABLE public.ckan_site OWNER TO postgres;
 ALTER TABLE ONLY public.ckan_site
 ADD CONSTRAINT unique_ckan_site_id UNIQUE (site_id);
 
+-- Site of DOIs imported from external platforms
+INSERT INTO public.ckan_site (site_id, description)
+VALUES ('external', 'DOIs registered on external platforms');
+
 -- TABLE doi_prefix
 
 CREATE TABLE public.doi_prefix (
@@ -43,11 +47,12 @@ CREATE TABLE public.doi_realisation (
     site_id TEXT NOT NULL,
     tag_id TEXT DEFAULT 'envidat.' NOT NULL,
     ckan_user TEXT DEFAULT 'admin' NOT NULL,
-    metadata TEXT NOT NULL,
+    metadata BYTEA NOT NULL,
     metadata_format TEXT DEFAULT 'ckan'::text,
     ckan_entity public.ckan_entity_type DEFAULT 'package'::public.ckan_entity_type NOT NULL,
+    datacite_digest VARCHAR(64),
     date_created TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    date_modified TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_modified TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 ALTER TABLE public.doi_realisation OWNER TO postgres;
@@ -65,6 +70,72 @@ ALTER TABLE public.doi_realisation
 ADD CONSTRAINT one_doi_per_package
 UNIQUE (ckan_id, site_id);
 
+ALTER TABLE ONLY public.doi_realisation
+    ADD CONSTRAINT unique_prefix_suffix UNIQUE (prefix_id, suffix_id);
+
+CREATE INDEX idx_doi_realisation_doi_key
+    ON public.doi_realisation ((upper(prefix_id || '/' || suffix_id) COLLATE "C"), doi_pk)
+    WHERE ckan_entity = 'package';
+
+-- TABLE doi_suffix_counter
+
+CREATE TABLE public.doi_suffix_counter (
+    counter_pk SERIAL PRIMARY KEY,
+    prefix_id TEXT NOT NULL,
+    tag_id TEXT DEFAULT '' NOT NULL,
+    last_value BIGINT DEFAULT 0 NOT NULL
+);
+
+ALTER TABLE public.doi_suffix_counter OWNER TO postgres;
+
+ALTER TABLE ONLY public.doi_suffix_counter
+    ADD CONSTRAINT unique_prefix_tag UNIQUE (prefix_id, tag_id);
+
+ALTER TABLE ONLY public.doi_suffix_counter
+    ADD CONSTRAINT counter_prefix_fk FOREIGN KEY (prefix_id) REFERENCES public.doi_prefix(prefix_id);
+
+-- TABLE datacite_job
+
+CREATE TABLE public.datacite_job (
+    job_pk SERIAL PRIMARY KEY,
+    job_type VARCHAR(7) DEFAULT 'publish' NOT NULL,
+    package_id TEXT NOT NULL,
+    params JSONB DEFAULT '{}'::jsonb NOT NULL,
+    status VARCHAR(9) DEFAULT 'queued' NOT NULL,
+    attempts INT DEFAULT 0 NOT NULL,
+    status_code INT,
+    result JSONB,
+    ckan_user TEXT DEFAULT 'admin' NOT NULL,
+    date_created TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_modified TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_started TIMESTAMPTZ,
+    date_finished TIMESTAMPTZ
+);
+
+CREATE INDEX idx_datacite_job_status_created
+    ON public.datacite_job (status, date_created);
+
+ALTER TABLE public.datacite_job OWNER TO postgres;
+
+-- TABLE email_outbox
+
+CREATE TABLE public.email_outbox (
+    message_pk SERIAL PRIMARY KEY,
+    template VARCHAR(128) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(7) DEFAULT 'pending' NOT NULL,
+    attempts INT DEFAULT 0 NOT NULL,
+    last_error TEXT,
+    next_attempt_at TIMESTAMPTZ NOT NULL,
+    date_created TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    date_sent TIMESTAMPTZ
+);
+
+CREATE INDEX idx_email_outbox_status_next_attempt
+    ON public.email_outbox (status, next_attempt_at);
+
+ALTER TABLE public.email_outbox OWNER TO postgres;
+
 -- access rights
 REVOKE ALL ON SCHEMA public FROM PUBLIC;
 REVOKE ALL ON SCHEMA public FROM postgres;
@@ -72,3 +143,6 @@ GRANT ALL ON SCHEMA public TO postgres;
 GRANT ALL ON SCHEMA public TO PUBLIC;
 
 GRANT ALL ON TABLE public.doi_realisation TO postgres;
+GRANT ALL ON TABLE public.doi_suffix_counter TO postgres;
+GRANT ALL ON TABLE public.datacite_job TO postgres;
+GRANT ALL ON TABLE public.email_outbox TO postgres;
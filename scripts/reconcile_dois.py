@@ -0,0 +1,71 @@
+"""Report mismatches between DOI database, CKAN packages and DataCite.
+
+Run from the repository root, for example in the nightly window:
+python -m scripts.reconcile_dois [--output report.ndjson] [--chunk-size 100]
+
+Writes one JSON line per mismatch followed by a 'summary' line.
+CKAN is read with 'CKAN_API_TOKEN', which must belong to an admin so that
+private packages are included. Exits with status 1 if mismatches were found.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from contextlib import nullcontext
+from typing import BinaryIO
+
+import orjson
+from tortoise import Tortoise, connections
+
+from app.config import config_app
+from app.db import TORTOISE_ORM
+from app.logic.datacite import close_datacite_client
+from app.logic.reconcile import reconcile_dois
+from app.logic.remote_ckan import close_ckan_client, get_ckan
+
+log = logging.getLogger(__name__)
+
+
+async def main(file: BinaryIO, chunk_size: int, datacite_page_size: int) -> int:
+    """Connect to database, write report to file and return number of mismatches."""
+    await Tortoise.init(config=TORTOISE_ORM)
+    mismatches = 0
+    try:
+        async for item in reconcile_dois(
+            get_ckan(config_app.CKAN_API_TOKEN), chunk_size, datacite_page_size
+        ):
+            if "summary" not in item:
+                mismatches += 1
+            file.write(orjson.dumps(item) + b"\n")
+            file.flush()
+    finally:
+        await close_ckan_client()
+        await close_datacite_client()
+        await connections.close_all()
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="report file, default is stdout")
+    parser.add_argument(
+        "--chunk-size", type=int, default=config_app.RECONCILE_CHUNK_SIZE
+    )
+    parser.add_argument(
+        "--datacite-page-size",
+        type=int,
+        default=config_app.RECONCILE_DATACITE_PAGE_SIZE,
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    if not config_app.CKAN_API_TOKEN:
+        sys.exit("CKAN_API_TOKEN is required to read CKAN packages")
+    with (
+        open(args.output, "wb") if args.output else nullcontext(sys.stdout.buffer)
+    ) as file:
+        mismatches = asyncio.run(
+            main(file, args.chunk_size, args.datacite_page_size)
+        )
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,31 @@
+"""Test app configuration."""
+
+from pathlib import Path
+
+from app.config import ConfigAppModel, env_example_keys
+
+ROOT = Path(__file__).parents[1]
+
+
+def test_settings_are_listed_in_env_example(monkeypatch):
+    """With IS_DOCKER=True only settings listed in 'env.example' are read."""
+    monkeypatch.chdir(ROOT)
+
+    assert set(ConfigAppModel.model_fields) <= set(env_example_keys())
+
+
+def test_settings_are_passed_to_containers(monkeypatch):
+    """Settings of 'env.example' are passed to the API container by compose."""
+    monkeypatch.chdir(ROOT)
+    keys = {key for key in env_example_keys() if key} - {
+        "NGINX_IMG_TAG",
+        "PYTHON_IMG_TAG",
+    }
+    for compose_file in (
+        "docker-compose.main.yml",
+        "docker-compose.staging.yml",
+        "docker-compose-without-proxy.yml",
+    ):
+        compose = (ROOT / compose_file).read_text()
+        missing = [key for key in keys if f"- {key}=${{{key}}}" not in compose]
+        assert not missing, f"{compose_file} does not pass {missing}"
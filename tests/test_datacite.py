@@ -0,0 +1,162 @@
+"""Test DataCite conversion and publication."""
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.logic import conversion, datacite
+from app.logic.conversion import ConversionPool
+from app.logic.datacite import (
+    datacite_xml_cache,
+    doi_resolution_cache,
+    format_response,
+    is_valid_doi,
+    iter_datacite_dois,
+    package_to_datacite_xml_base64,
+)
+from app.logic.retry import datacite_retry_policy
+
+
+class FakeConverter:
+    """Stand-in for EnviDatToDataCite that counts conversions."""
+
+    calls = 0
+
+    def __init__(self, package: dict):
+        """Convert package."""
+        FakeConverter.calls += 1
+        self.package = package
+
+    def __str__(self):
+        """Return XML."""
+        return f"<resource>{self.package['title']}</resource>"
+
+
+async def test_conversion_is_cached_by_package_content(monkeypatch):
+    """Equal packages are converted once, changed packages are converted again."""
+    monkeypatch.setattr(conversion, "EnviDatToDataCite", FakeConverter)
+    datacite_xml_cache.clear()
+    FakeConverter.calls = 0
+
+    first = await package_to_datacite_xml_base64({"id": "1", "title": "a"})
+    same = await package_to_datacite_xml_base64({"title": "a", "id": "1"})
+    changed = await package_to_datacite_xml_base64({"id": "1", "title": "b"})
+
+    assert first == same != changed
+    assert FakeConverter.calls == 2
+
+
+async def test_conversion_pool_runs_large_packages_in_worker():
+    """Packages above the in-process size limit are converted by a worker."""
+    pool = ConversionPool(processes=1, inprocess_max_size=100)
+    await pool.start()
+    try:
+        # Incomplete package, converter errors are raised like in process
+        package = {"id": "1", "doi": "10.16904/envidat.1"}
+        with pytest.raises(KeyError):
+            await pool.convert(package, size=10)
+        assert pool.stats()["inprocess"] == 1
+        with pytest.raises(KeyError):
+            await pool.convert(package, size=1000)
+        assert pool.stats()["failed"] == 1
+        assert pool.stats()["completed"] == 0
+    finally:
+        await pool.stop()
+
+
+@pytest.fixture
+def doi_org(monkeypatch):
+    """Replace DataCite client with stand-in for doi.org, return its requests."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "HEAD" and "nohead" in request.url.path:
+            return httpx.Response(405)
+        if "missing" in request.url.path:
+            return httpx.Response(404)
+        return httpx.Response(302, headers={"Location": "https://example.com"})
+
+    monkeypatch.setattr(
+        datacite,
+        "_datacite_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    doi_resolution_cache.clear()
+    yield requests
+    doi_resolution_cache.clear()
+
+
+async def test_doi_resolution_is_cached(doi_org):
+    """Registered DOIs are resolved once with HEAD, without following redirects."""
+    assert await is_valid_doi("10.5281/zenodo.1") is True
+    assert await is_valid_doi("https://doi.org/10.5281/ZENODO.1") is True
+
+    assert [request.method for request in doi_org] == ["HEAD"]
+
+
+async def test_missing_doi_is_cached(doi_org):
+    """DOIs that do not exist raise 404, also when read from cache."""
+    for _ in range(2):
+        with pytest.raises(HTTPException) as e:
+            await is_valid_doi("10.5281/missing")
+        assert e.value.status_code == 404
+
+    assert len(doi_org) == 1
+
+
+async def test_doi_resolution_falls_back_to_get(doi_org):
+    """DOIs are resolved with GET if HEAD is not allowed."""
+    assert await is_valid_doi("10.5281/nohead") is True
+
+    assert [request.method for request in doi_org] == ["HEAD", "GET"]
+
+
+async def test_datacite_dois_are_listed_by_cursor(monkeypatch):
+    """DOIs are listed page by page, following the 'next' link."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.params.get("page[cursor]") == "1":
+            data = [{"id": "10.16904/a", "attributes": {"state": "draft"}}]
+            links = {"next": "http://localhost:8001/dois?page[cursor]=abc"}
+        else:
+            data = [{"id": "10.16904/b", "attributes": {"state": "findable"}}]
+            links = {}
+        return httpx.Response(200, json={"data": data, "links": links})
+
+    monkeypatch.setattr(
+        datacite,
+        "_datacite_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+    pages = [page async for page in iter_datacite_dois(page_size=1)]
+
+    assert pages == [
+        [{"doi": "10.16904/a", "state": "draft"}],
+        [{"doi": "10.16904/b", "state": "findable"}],
+    ]
+    assert requests[0].url.params["client-id"] == "test_client"
+    assert requests[0].url.params["sort"] == "name"
+    assert requests[1].url.params["page[cursor]"] == "abc"
+
+
+def test_non_json_error_response_is_retryable():
+    """HTML error pages of a gateway are returned as retryable DoiErrors."""
+    response = httpx.Response(
+        503, text="<html>Service Unavailable</html>", headers={"Retry-After": "5"}
+    )
+
+    result = format_response(response)
+
+    assert result == {
+        "status_code": 503,
+        "errors": [{"status": "503", "title": "<html>Service Unavailable</html>"}],
+        "retry_after": 5.0,
+    }
+    assert datacite_retry_policy.is_retryable(result)
+    assert format_response(httpx.Response(502))["errors"][0]["title"] == (
+        "Bad Gateway"
+    )
@@ -1 +1,95 @@
 """Test DOI endpoints."""
+
+import json
+import uuid
+
+import httpx
+import pytest
+
+from app.auth import get_admin
+from app.config import config_app
+from app.main import app
+from app.models.doi import DOI_REALISATION_SUMMARY_FIELDS, DoiRealisation
+
+DOI_COUNT = 25
+
+
+@pytest.fixture
+async def client(test_db):
+    """Return client for API with admin authorization, DB holding some DOIs."""
+    await DoiRealisation.bulk_create(
+        [
+            DoiRealisation(
+                prefix_id=config_app.DOI_PREFIX,
+                suffix_id=f"{config_app.DOI_SUFFIX_TAG}{i}",
+                ckan_id=uuid.uuid4(),
+                ckan_name=f"package-{i}",
+                site_id="doi-publishing-api",
+                metadata="{}",
+                ckan_entity="package",
+            )
+            for i in range(DOI_COUNT)
+        ]
+    )
+    app.dependency_overrides[get_admin] = lambda: {"info": {"name": "admin"}}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+async def test_get_all_dois_without_limit(client):
+    """Without parameters all DOIs are returned as one list."""
+    response = await client.get("/dois")
+
+    assert response.status_code == 200
+    assert len(response.json()) == DOI_COUNT
+    assert "X-Next-Cursor" not in response.headers
+
+
+async def test_get_dois_pages_follow_cursor(client):
+    """Following 'X-Next-Cursor' returns every DOI exactly once, in order."""
+    pks = []
+    params = {"limit": 10}
+    while True:
+        response = await client.get("/dois", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 10
+        pks.extend(doi["doi_pk"] for doi in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["after"] = response.headers["X-Next-Cursor"]
+
+    assert len(pks) == DOI_COUNT
+    assert pks == sorted(set(pks))
+
+
+async def test_get_dois_ndjson_streams_all_rows(client, monkeypatch):
+    """NDJSON format returns one DOI per line, read from DB in chunks."""
+    monkeypatch.setattr(config_app, "DOIS_STREAM_CHUNK_SIZE", 4)
+
+    response = await client.get("/dois", params={"format": "ndjson", "limit": 10})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert len(lines) == 10
+
+    response = await client.get(
+        "/dois", params={"format": "ndjson", "after": lines[-1]["doi_pk"]}
+    )
+    rest = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rest) == DOI_COUNT - 10
+    assert rest[0]["doi_pk"] > lines[-1]["doi_pk"]
+
+
+async def test_get_dois_summary_view_excludes_metadata(client):
+    """Summary view returns identifiers without 'metadata', full view includes it."""
+    summary = (await client.get("/dois", params={"view": "summary"})).json()
+    assert len(summary) == DOI_COUNT
+    assert "metadata" not in summary[0]
+    assert summary[0]["ckan_name"] == "package-0"
+
+    doi_pk = summary[0]["doi_pk"]
+    response = await client.get(f"/dois/{doi_pk}", params={"view": "summary"})
+    assert set(response.json()) == set(DOI_REALISATION_SUMMARY_FIELDS)
+    response = await client.get(f"/dois/{doi_pk}")
+    assert response.json()["metadata"] == "{}"
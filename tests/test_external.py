@@ -0,0 +1,141 @@
+"""Test importing external DOIs."""
+
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.logic import external
+from app.logic.external import check_registered_dois, import_external_dois
+from app.models.doi import DoiPrefix, DoiRealisation
+
+ADMIN_INFO = {"name": "admin", "email": "admin@example.com"}
+
+
+@pytest.fixture
+def ckan_calls(monkeypatch):
+    """Return CKAN packages by name, calls to CKAN, doi.org and mailer recorded."""
+    packages = {
+        name: {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "publication_state": "approved",
+            "doi": "",
+        }
+        for name in ("first", "second", "third")
+    }
+    calls = {"patch": [], "email": []}
+
+    async def package_show(package_id, ckan):
+        return packages[package_id]
+
+    async def package_patch(package_id, data, ckan):
+        calls["patch"].append(package_id)
+
+    async def resolve(doi):
+        if "missing" in doi:
+            raise HTTPException(status_code=404, detail=f"DOI {doi} does not exist")
+        return True
+
+    async def send_email(*args):
+        calls["email"].append(args)
+
+    monkeypatch.setattr(external, "ckan_package_show", package_show)
+    monkeypatch.setattr(external, "ckan_package_patch", package_patch)
+    monkeypatch.setattr(external, "is_valid_doi", resolve)
+    monkeypatch.setattr(external, "external_import_email", send_email)
+    return {"packages": packages, "calls": calls}
+
+
+@pytest.fixture
+async def ckan(test_db, ckan_calls):
+    """Return CKAN calls of ckan_calls with a database created by Tortoise."""
+    return ckan_calls
+
+
+async def test_external_dois_are_imported_in_bulk(ckan):
+    """Valid DOIs are registered and published, invalid ones reported."""
+    result = await import_external_dois(
+        {
+            "first": "10.5281/zenodo.1",
+            "second": "10.5281/missing",
+            "third": "10.5281/zenodo.3",
+        },
+        None,
+        ADMIN_INFO,
+        concurrency=2,
+        send_email=True,
+    )
+
+    assert result["summary"]["imported"] == 2
+    assert [r["status_code"] for r in result["results"]] == [200, 404, 200]
+    assert sorted(ckan["calls"]["patch"]) == ["first", "third"]
+    assert len(ckan["calls"]["email"]) == 1
+    assert await DoiRealisation.filter(site_id="external").count() == 2
+
+
+async def test_external_import_is_repeatable(ckan):
+    """Importing the same DOI again succeeds, for another package it fails."""
+    await import_external_dois(
+        {"first": "10.5281/zenodo.1"}, None, ADMIN_INFO, concurrency=1
+    )
+    result = await import_external_dois(
+        {"first": "10.5281/zenodo.1", "second": "10.5281/ZENODO.1"},
+        None,
+        ADMIN_INFO,
+        concurrency=1,
+    )
+
+    assert [r["status_code"] for r in result["results"]] == [200, 409]
+    assert await DoiRealisation.filter(site_id="external").count() == 1
+    assert ckan["calls"]["email"] == []
+
+
+async def test_package_doi_in_url_format_is_accepted(ckan):
+    """DOI stored in the package as URL matches the imported short DOI."""
+    ckan["packages"]["first"]["doi"] = "https://doi.org/10.5281/ZENODO.1"
+
+    result = await import_external_dois(
+        {"first": "10.5281/zenodo.1"}, None, ADMIN_INFO, concurrency=1
+    )
+
+    assert result["results"][0]["status_code"] == 200
+
+
+async def test_doi_registered_concurrently_is_rejected(ckan):
+    """DOI inserted first by another import in another case wins, own row removed."""
+    first, second = ckan["packages"]["first"], ckan["packages"]["second"]
+    for package, suffix in ((second, "ZENODO.7"), (first, "zenodo.7")):
+        await DoiRealisation.create(
+            prefix_id="10.5281",
+            suffix_id=suffix,
+            ckan_id=package["id"],
+            ckan_name=package["name"],
+            site_id="external",
+            metadata="{}",
+            ckan_entity="package",
+        )
+
+    errors = await check_registered_dois({"first": ("10.5281/zenodo.7", first)})
+
+    assert errors["first"].status_code == 409
+    assert await DoiRealisation.filter(ckan_id=first["id"]).count() == 0
+    assert await DoiRealisation.filter(ckan_id=second["id"]).count() == 1
+
+
+async def test_external_dois_are_imported_with_production_schema(
+    schema_db, ckan_calls
+):
+    """Prefixes of external DOIs are registered before the DOIs reference them."""
+    result = await import_external_dois(
+        {"first": "10.5281/zenodo.1", "second": "10.1000/other.2"},
+        None,
+        ADMIN_INFO,
+        concurrency=2,
+    )
+
+    assert [r["status_code"] for r in result["results"]] == [200, 200]
+    assert await DoiRealisation.filter(site_id="external").count() == 2
+    assert sorted(
+        await DoiPrefix.all().values_list("prefix_id", flat=True)
+    ) == ["10.1000", "10.5281"]
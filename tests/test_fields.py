@@ -0,0 +1,90 @@
+"""Test custom model fields."""
+
+import json
+import uuid
+
+from tortoise import connections
+
+from app.config import config_app
+from app.models.doi import DoiRealisation, DoiRealisationPydantic
+from app.models.fields import (
+    FORMAT_INCOMPRESSIBLE,
+    FORMAT_RAW,
+    FORMAT_ZLIB,
+    LazyCompressedText,
+    compress_text,
+)
+from scripts.compress_doi_metadata import compress_metadata
+
+METADATA = json.dumps({"resources": [{"name": f"resource {i}"} for i in range(100)]})
+
+
+async def create_doi(**kwargs) -> DoiRealisation:
+    """Create DOI with METADATA."""
+    return await DoiRealisation.create(
+        prefix_id=config_app.DOI_PREFIX,
+        suffix_id=f"{config_app.DOI_SUFFIX_TAG}{uuid.uuid4().hex}",
+        ckan_id=uuid.uuid4(),
+        ckan_name="package",
+        site_id="doi-publishing-api",
+        metadata=METADATA,
+        ckan_entity="package",
+        **kwargs,
+    )
+
+
+async def get_stored_metadata(doi_pk: int) -> bytes:
+    """Return metadata column as stored in database."""
+    rows = await connections.get("default").execute_query_dict(
+        "SELECT metadata FROM doi_realisation WHERE doi_pk = $1", [doi_pk]
+    )
+    return rows[0]["metadata"]
+
+
+def test_compress_text_keeps_small_values_uncompressed():
+    """Values that do not shrink are stored with the incompressible marker."""
+    assert compress_text("{}") == FORMAT_INCOMPRESSIBLE + b"{}"
+    assert compress_text(METADATA).startswith(FORMAT_ZLIB)
+
+
+async def test_metadata_stored_compressed(test_db):
+    """Metadata is compressed in the database and loaded as the original text."""
+    doi = await create_doi()
+
+    stored = await get_stored_metadata(doi.doi_pk)
+    assert stored.startswith(FORMAT_ZLIB)
+    assert len(stored) < len(METADATA) / 5
+    assert (await DoiRealisation.get(doi_pk=doi.doi_pk)).metadata == METADATA
+
+
+async def test_metadata_decompressed_on_access(test_db):
+    """Loading rows does not decompress metadata until it is read."""
+    doi = await create_doi()
+
+    loaded = await DoiRealisation.get(doi_pk=doi.doi_pk)
+    assert isinstance(loaded.__dict__["metadata"], LazyCompressedText)
+    assert DoiRealisationPydantic.model_validate(loaded).metadata == METADATA
+    assert type(loaded.__dict__["metadata"]) is str
+    values = await DoiRealisation.filter(doi_pk=doi.doi_pk).values("metadata")
+    assert values[0]["metadata"] == METADATA
+
+
+async def test_compress_metadata_rewrites_raw_rows(test_db):
+    """Migration compresses rows stored before compression was introduced."""
+    dois = [await create_doi() for _ in range(3)]
+    small = await create_doi()
+    await connections.get("default").execute_query(
+        "UPDATE doi_realisation SET metadata = $1", [FORMAT_RAW + METADATA.encode()]
+    )
+    await connections.get("default").execute_query(
+        "UPDATE doi_realisation SET metadata = $1 WHERE doi_pk = $2",
+        [FORMAT_RAW + b"{}", small.doi_pk],
+    )
+
+    assert await compress_metadata(batch_size=2) == 4
+
+    for doi in dois:
+        assert (await get_stored_metadata(doi.doi_pk)).startswith(FORMAT_ZLIB)
+        assert (await DoiRealisation.get(doi_pk=doi.doi_pk)).metadata == METADATA
+    assert await get_stored_metadata(small.doi_pk) == FORMAT_INCOMPRESSIBLE + b"{}"
+    assert await compress_metadata(batch_size=2) == 0
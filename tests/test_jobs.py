@@ -0,0 +1,74 @@
+"""Test background job queue."""
+
+import asyncio
+from datetime import timedelta
+
+from tortoise import timezone
+
+from app.config import config_app
+from app.logic import jobs
+from app.logic.jobs import (
+    STALE_JOB_GRACE_PERIOD,
+    claim_next_job,
+    enqueue_publish_job,
+    requeue_stale_jobs,
+    run_job,
+)
+from app.models.job import DataciteJob, JobStatus
+
+ADMIN_INFO = {"name": "admin", "email": "admin@example.com"}
+
+
+async def test_enqueue_returns_existing_job_for_package(test_db):
+    """Queuing the same package twice does not create a second job."""
+    first = await enqueue_publish_job("package-a", ADMIN_INFO)
+    second = await enqueue_publish_job("package-a", ADMIN_INFO)
+
+    assert first.job_pk == second.job_pk
+    assert await DataciteJob.all().count() == 1
+
+
+async def test_concurrent_claims_never_return_same_job(test_db):
+    """Jobs locked by one worker are skipped by the others."""
+    for i in range(20):
+        await enqueue_publish_job(f"package-{i}", ADMIN_INFO)
+
+    claimed = await asyncio.gather(*(claim_next_job() for _ in range(30)))
+    claimed_ids = [job.job_pk for job in claimed if job is not None]
+
+    assert len(claimed_ids) == 20
+    assert len(set(claimed_ids)) == 20
+    assert await DataciteJob.filter(status=JobStatus.RUNNING).count() == 20
+
+
+async def test_stale_jobs_are_requeued(test_db):
+    """Jobs left running after a crash are queued again."""
+    await enqueue_publish_job("package-a", ADMIN_INFO)
+    job = await claim_next_job()
+    job.date_started = timezone.now() - timedelta(seconds=config_app.JOB_TIMEOUT + 1)
+    await job.save(update_fields=["date_started"])
+    assert await requeue_stale_jobs() == 0
+
+    job.date_started -= timedelta(seconds=STALE_JOB_GRACE_PERIOD)
+    await job.save(update_fields=["date_started"])
+    assert await requeue_stale_jobs() == 1
+    await job.refresh_from_db()
+    assert job.status == JobStatus.QUEUED
+
+
+async def test_job_running_too_long_fails(test_db, monkeypatch):
+    """Jobs are stopped after 'JOB_TIMEOUT' and not run a second time."""
+    async def publish_package(*args):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(jobs, "publish_package", publish_package)
+    monkeypatch.setattr(config_app, "JOB_TIMEOUT", 0.01)
+    await enqueue_publish_job("package-a", ADMIN_INFO)
+    job = await claim_next_job()
+
+    await run_job(job)
+
+    await job.refresh_from_db()
+    assert job.status == JobStatus.FAILED
+    assert job.status_code == 504
+    assert await requeue_stale_jobs() == 0
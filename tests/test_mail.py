@@ -0,0 +1,47 @@
+"""Test email outbox delivery."""
+
+import httpx
+import pytest
+
+from app.config import config_app
+from app.logic import mail
+from app.models.mail import EmailMessage, EmailStatus
+
+
+@pytest.fixture
+def mailer_status(monkeypatch):
+    """Replace mailer API with stub returning the status code in the list."""
+    status = [200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(status[0])
+
+    monkeypatch.setattr(
+        mail, "_mail_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    return status
+
+
+async def test_queued_email_is_delivered(test_db, mailer_status):
+    """Queued email is sent once and marked as sent."""
+    message = await mail.queue_email("datacite-request", {"to": "a@example.com"})
+
+    assert await mail.deliver_email(message.message_pk) == EmailStatus.SENT
+    assert await mail.deliver_email(message.message_pk) is None
+
+
+async def test_failed_email_is_dead_lettered(test_db, mailer_status, monkeypatch):
+    """Email is retried and marked as dead after 'MAIL_MAX_ATTEMPTS' failures."""
+    mailer_status[0] = 503
+    monkeypatch.setattr(mail.mail_retry_policy, "max_delay", 0)
+    message = await mail.queue_email("datacite-request", {"to": "a@example.com"})
+
+    statuses = [
+        await mail.deliver_email(message.message_pk)
+        for _ in range(config_app.MAIL_MAX_ATTEMPTS)
+    ]
+
+    assert statuses[:-1] == [EmailStatus.PENDING] * (config_app.MAIL_MAX_ATTEMPTS - 1)
+    assert statuses[-1] == EmailStatus.DEAD
+    message = await EmailMessage.get(message_pk=message.message_pk)
+    assert message.attempts == config_app.MAIL_MAX_ATTEMPTS
@@ -0,0 +1,90 @@
+"""Test metrics of API routes and upstream services."""
+
+import asyncpg
+import httpx
+from prometheus_client import REGISTRY
+from tortoise import connections
+
+from app.config import config_app
+from app.logic.metrics import InstrumentedConnection, InstrumentedTransport
+from app.main import app
+
+
+def sample(name: str, **labels) -> float:
+    """Return current value of metric sample, 0 if not recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+async def test_upstream_requests_are_recorded():
+    """Requests through instrumented transport are counted by status and timed."""
+    transport = InstrumentedTransport(
+        "test", httpx.MockTransport(lambda request: httpx.Response(503))
+    )
+    labels = {"upstream": "test", "operation": "package_show"}
+    before = sample("doi_api_upstream_requests_total", status="503", **labels)
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.post(
+            "http://ckan.test/api", extensions={"operation": "package_show"}
+        )
+
+    assert sample("doi_api_upstream_requests_total", status="503", **labels) == (
+        before + 1
+    )
+    assert sample("doi_api_upstream_request_duration_seconds_count", **labels) >= 1
+    assert sample("doi_api_upstream_requests_in_flight", upstream="test") == 0
+
+
+async def test_database_queries_are_recorded(test_db):
+    """Queries on instrumented asyncpg connections are timed by statement type."""
+    db = connections.get("default")
+    labels = {"upstream": "database", "operation": "SELECT"}
+    before = sample("doi_api_upstream_requests_total", status="ok", **labels)
+
+    conn = await asyncpg.connect(
+        host=db.host,
+        port=db.port,
+        user=db.user,
+        password=db.password,
+        database=db.database,
+        connection_class=InstrumentedConnection,
+    )
+    try:
+        await conn.fetch("SELECT 1")
+    finally:
+        await conn.close()
+
+    assert sample("doi_api_upstream_requests_total", status="ok", **labels) == (
+        before + 1
+    )
+
+
+async def test_metrics_endpoint_reports_routes_by_template(monkeypatch):
+    """API requests are labelled with route template, not the requested path."""
+    monkeypatch.setattr(config_app, "METRICS_TOKEN", "scrape")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        await c.get("/dois/123")
+        response = await c.get(
+            "/metrics", headers={"Authorization": "Bearer scrape"}
+        )
+
+    assert response.status_code == 200
+    assert 'route="/dois/{id}"' in response.text
+    assert "/dois/123" not in response.text
+    assert 'doi_api_component_hits_total{component="ckan_user_cache"}' in (
+        response.text
+    )
+
+
+async def test_metrics_endpoint_requires_token(monkeypatch):
+    """Metrics are disabled without METRICS_TOKEN and need the token otherwise."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        monkeypatch.setattr(config_app, "METRICS_TOKEN", None)
+        assert (await c.get("/metrics")).status_code == 404
+
+        monkeypatch.setattr(config_app, "METRICS_TOKEN", "scrape")
+        assert (await c.get("/metrics")).status_code == 401
+        response = await c.get("/metrics", headers={"Authorization": "Bearer other"})
+        assert response.status_code == 401
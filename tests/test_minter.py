@@ -0,0 +1,73 @@
+"""Test DOI minting."""
+
+import asyncio
+import uuid
+
+from app.config import config_app
+from app.logic.minter import create_db_doi, get_next_doi_suffix_id
+from app.models.doi import DoiRealisation
+
+PARALLEL_MINTS = 2000
+
+
+def make_package(**kwargs) -> dict:
+    """Return minimal CKAN package used for minting."""
+    package_id = str(uuid.uuid4())
+    return {"id": package_id, "name": f"package-{package_id}", **kwargs}
+
+
+async def test_next_suffix_id_continues_from_existing(test_db):
+    """Counter is seeded from the highest suffix ID already in the DB."""
+    await DoiRealisation.create(
+        prefix_id=config_app.DOI_PREFIX,
+        suffix_id=f"{config_app.DOI_SUFFIX_TAG}41",
+        ckan_id=uuid.uuid4(),
+        ckan_name="existing",
+        site_id="doi-publishing-api",
+        ckan_user="admin",
+        metadata="{}",
+        ckan_entity="package",
+    )
+    assert await get_next_doi_suffix_id() == 42
+    assert await get_next_doi_suffix_id() == 43
+
+
+async def test_parallel_minting_has_no_duplicates(test_db):
+    """Minting DOIs for many packages in parallel never reuses a DOI."""
+    packages = [make_package() for _ in range(PARALLEL_MINTS)]
+
+    dois = await asyncio.gather(*(create_db_doi("user", p) for p in packages))
+
+    assert None not in dois
+    assert len(set(dois)) == PARALLEL_MINTS
+    assert await DoiRealisation.all().count() == PARALLEL_MINTS
+
+
+async def test_parallel_minting_same_package_returns_one_doi(test_db):
+    """Concurrent requests for the same package all get the same DOI."""
+    package = make_package()
+
+    dois = await asyncio.gather(*(create_db_doi("user", package) for _ in range(20)))
+
+    assert len(set(dois)) == 1
+    assert await DoiRealisation.filter(ckan_id=package["id"]).count() == 1
+
+
+async def test_taken_suffix_id_is_skipped(test_db):
+    """A suffix ID inserted outside the minter is skipped, not reused."""
+    first_doi = await create_db_doi("user", make_package())
+    next_id = int(first_doi.rsplit(".", 1)[-1]) + 1
+    await DoiRealisation.create(
+        prefix_id=config_app.DOI_PREFIX,
+        suffix_id=f"{config_app.DOI_SUFFIX_TAG}{next_id}",
+        ckan_id=uuid.uuid4(),
+        ckan_name="manual",
+        site_id="doi-publishing-api",
+        ckan_user="admin",
+        metadata="{}",
+        ckan_entity="package",
+    )
+
+    doi = await create_db_doi("user", make_package())
+
+    assert doi == f"{config_app.DOI_PREFIX}/{config_app.DOI_SUFFIX_TAG}{next_id + 1}"
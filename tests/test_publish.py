@@ -0,0 +1,144 @@
+"""Test publishing packages with DataCite."""
+
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from app.config import config_app
+from app.logic import conversion, datacite, publish
+from app.logic.minter import create_db_doi
+from app.logic.publish import publish_package, publish_packages
+from app.models.doi import DoiRealisation
+
+ADMIN_INFO = {"name": "admin", "email": "admin@example.com"}
+
+
+class FakeConverter:
+    """Stand-in for EnviDatToDataCite."""
+
+    def __init__(self, package: dict):
+        """Convert package."""
+        self.package = package
+
+    def __str__(self):
+        """Return XML."""
+        return f"<resource>{self.package['title']}</resource>"
+
+
+@pytest.fixture
+async def package(test_db, monkeypatch):
+    """Return CKAN package with minted DOI, CKAN and DataCite calls recorded."""
+    package = {
+        "id": str(uuid.uuid4()),
+        "name": "package",
+        "title": "Title",
+        "publication_state": "approved",
+        "maintainer": json.dumps({"email": "maintainer@example.com"}),
+    }
+    package["doi"] = await create_db_doi("user", package)
+
+    calls = {"datacite": 0, "patch": 0}
+
+    async def package_show(package_id, ckan):
+        return package
+
+    async def package_patch(package_id, data, ckan):
+        calls["patch"] += 1
+
+    async def publish_datacite(package):
+        calls["datacite"] += 1
+        return {"status_code": 201, "result": {"data": {"id": package["doi"]}}}
+
+    async def send_email(*args):
+        pass
+
+    monkeypatch.setattr(conversion, "EnviDatToDataCite", FakeConverter)
+    monkeypatch.setattr(publish, "ckan_package_show", package_show)
+    monkeypatch.setattr(publish, "ckan_package_patch", package_patch)
+    monkeypatch.setattr(publish, "publish_datacite", publish_datacite)
+    monkeypatch.setattr(publish, "approval_granted_email", send_email)
+    package["calls"] = calls
+    return package
+
+
+async def test_unchanged_metadata_skips_datacite(package):
+    """Second publication of unchanged package only updates CKAN."""
+    first = await publish_package(package["id"], None, ADMIN_INFO)
+    second = await publish_package(package["id"], None, ADMIN_INFO)
+
+    assert first.status_code == 201
+    assert second.status_code == 200
+    assert json.loads(second.body)["unchanged"] is True
+    assert package["calls"] == {"datacite": 1, "patch": 2}
+
+
+async def test_changed_metadata_is_published(package):
+    """Publication after a DataCite relevant change calls DataCite again."""
+    await publish_package(package["id"], None, ADMIN_INFO)
+    package["title"] = "New title"
+    response = await publish_package(package["id"], None, ADMIN_INFO)
+
+    assert "unchanged" not in json.loads(response.body)
+    assert package["calls"]["datacite"] == 2
+    prefix_id, _, suffix_id = package["doi"].partition("/")
+    doi = await DoiRealisation.get(prefix_id=prefix_id, suffix_id=suffix_id)
+    assert doi.datacite_digest == await datacite.datacite_digest(package)
+    assert prefix_id == config_app.DOI_PREFIX
+
+
+async def test_failed_conversion_sends_failure_email(package, monkeypatch):
+    """Errors converting the package are reported like DataCite errors."""
+    emails = []
+
+    class BrokenConverter:
+        """Stand-in for EnviDatToDataCite failing on unexpected metadata."""
+
+        def __init__(self, package: dict):
+            """Fail converting package."""
+            raise KeyError("title")
+
+    async def publish_datacite(package):
+        BrokenConverter(package)
+
+    async def failed_email(*args):
+        emails.append(args)
+
+    monkeypatch.setattr(conversion, "EnviDatToDataCite", BrokenConverter)
+    monkeypatch.setattr(publish, "publish_datacite", publish_datacite)
+    monkeypatch.setattr(publish, "datacite_failed_email", failed_email)
+
+    response = await publish_package(package["id"], None, ADMIN_INFO)
+
+    assert response.status_code == 500
+    assert len(emails) == 1
+    assert package["calls"]["patch"] == 0
+
+
+async def test_started_publications_finish_when_consumer_stops(monkeypatch):
+    """Closing the results early starts no new publications, started ones finish."""
+    release = asyncio.Event()
+    started, finished = [], []
+
+    async def publish_package_result(package_id, *args):
+        started.append(package_id)
+        if package_id != "fast":
+            await release.wait()
+        finished.append(package_id)
+        return {"package_id": package_id, "status_code": 200, "response": {}}
+
+    async def package_ids():
+        for package_id in ("fast", "slow-1", "slow-2"):
+            yield package_id
+
+    monkeypatch.setattr(publish, "publish_package_result", publish_package_result)
+
+    results = publish_packages(package_ids(), None, ADMIN_INFO, concurrency=3)
+    assert (await anext(results))["package_id"] == "fast"
+    await results.aclose()
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.wait(set(publish._running_publish_tasks), timeout=5)
+    assert sorted(finished) == sorted(started) == ["fast", "slow-1", "slow-2"]
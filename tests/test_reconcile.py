@@ -0,0 +1,109 @@
+"""Test reconciliation of DOI database, CKAN packages and DataCite."""
+
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.config import config_app
+from app.logic import reconcile
+from app.logic.reconcile import reconcile_dois
+from app.models.doi import DoiRealisation
+
+PREFIX = config_app.DOI_PREFIX
+
+
+async def test_mismatches_are_reported(test_db, monkeypatch):
+    """DOIs are compared in lockstep sorted by DOI across sources, read in chunks."""
+    packages = {}
+    for name, publication_state, doi in [
+        ("consistent", "published", f"{PREFIX}/envidat.1"),
+        ("drifted", "published", f"{PREFIX}/envidat.2"),
+        ("unreserved", "", f"{PREFIX}/envidat.3"),
+        ("other-doi", "reserved", f"{PREFIX}/envidat.99"),
+    ]:
+        packages[name] = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "publication_state": publication_state,
+            "doi": doi,
+        }
+        await DoiRealisation.create(
+            prefix_id=PREFIX,
+            suffix_id=f"envidat.{len(packages)}",
+            ckan_id=packages[name]["id"],
+            ckan_name=name,
+            site_id="doi-publishing-api",
+            metadata="{}",
+            ckan_entity="package",
+        )
+    await DoiRealisation.create(
+        prefix_id=PREFIX,
+        suffix_id="envidat.5",
+        ckan_id=uuid.uuid4(),
+        ckan_name="deleted",
+        site_id="doi-publishing-api",
+        metadata="{}",
+        ckan_entity="package",
+    )
+    datacite = {
+        f"{PREFIX}/ENVIDAT.1": "findable",
+        f"{PREFIX}/envidat.2": "draft",
+        f"{PREFIX}/envidat.4": "draft",
+        f"{PREFIX}/envidat.5": "findable",
+        f"{PREFIX}/envidat.6": "draft",
+    }
+    searched = []
+
+    async def iter_datacite_dois(page_size):
+        items = [{"doi": doi, "state": state} for doi, state in datacite.items()]
+        for i in range(0, len(items), page_size):
+            yield items[i:i + page_size]
+
+    async def package_search_ids(package_ids, ckan):
+        searched.append(len(package_ids))
+        return {
+            package["id"]: package
+            for package in packages.values()
+            if package["id"] in package_ids
+        }
+
+    monkeypatch.setattr(reconcile, "iter_datacite_dois", iter_datacite_dois)
+    monkeypatch.setattr(reconcile, "ckan_package_search_ids", package_search_ids)
+
+    report = [
+        item
+        async for item in reconcile_dois(None, chunk_size=2, datacite_page_size=2)
+    ]
+
+    dois = [item["doi"].upper() for item in report[:-1]]
+    assert dois == sorted(dois)
+    mismatches = {(item["type"], item["doi"]) for item in report[:-1]}
+    assert mismatches == {
+        ("state_drift", f"{PREFIX}/envidat.2"),
+        ("missing_in_datacite", f"{PREFIX}/envidat.3"),
+        ("missing_publication_state", f"{PREFIX}/envidat.3"),
+        ("doi_mismatch", f"{PREFIX}/envidat.4"),
+        ("ckan_package_missing", f"{PREFIX}/envidat.5"),
+        ("missing_in_db", f"{PREFIX}/envidat.6"),
+    }
+    assert searched == [2, 2, 1]
+    summary = report[-1]["summary"]
+    assert summary["db_dois"] == 5
+    assert summary["datacite_dois"] == 5
+    assert sum(summary["mismatches"].values()) == 6
+
+
+async def test_unsorted_datacite_dois_are_rejected(test_db, monkeypatch):
+    """DataCite DOIs can only be compared in lockstep if sorted by DOI."""
+
+    async def iter_datacite_dois(page_size):
+        yield [{"doi": f"{PREFIX}/envidat.2", "state": "findable"}]
+        yield [{"doi": f"{PREFIX}/envidat.1", "state": "findable"}]
+
+    monkeypatch.setattr(reconcile, "iter_datacite_dois", iter_datacite_dois)
+
+    with pytest.raises(HTTPException) as e:
+        async for _ in reconcile_dois(None):
+            pass
+    assert e.value.status_code == 502
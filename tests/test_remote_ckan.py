@@ -0,0 +1,139 @@
+"""Test CKAN API helpers."""
+
+import pytest
+from ckanapi import NotAuthorized
+from fastapi import HTTPException
+
+from app.logic.remote_ckan import (
+    CkanPackageUnitOfWork,
+    ckan_package_cache,
+    ckan_package_patch,
+    ckan_package_show,
+)
+
+
+def solr_timestamp(value: str) -> str:
+    """Return timestamp as returned by Solr, in milliseconds with 'Z' suffix."""
+    return f"{value[:23]}Z"
+
+
+class FakeCKAN:
+    """Stand-in for AsyncRemoteCKAN with one package, records called actions."""
+
+    def __init__(self, package: dict, authorized: bool = True, apikey: str = "token"):
+        """Serve package, to authorized users only."""
+        self.package = package
+        self.authorized = authorized
+        self.apikey = apikey
+        self.actions = []
+
+    async def call_action(self, action: str, data: dict | None = None):
+        """Return result of CKAN action."""
+        self.actions.append(action)
+        if action == "package_search":
+            results = [
+                {"id": self.package["id"],
+                 "metadata_modified": solr_timestamp(self.package["metadata_modified"])}
+            ]
+            return {"count": 1, "results": results if self.authorized else []}
+        if not self.authorized:
+            raise NotAuthorized()
+        if action == "package_patch":
+            self.package.update(data, metadata_modified="2024-01-02T00:00:00.000001")
+        return dict(self.package)
+
+
+@pytest.fixture
+def package():
+    """Return CKAN package, with empty package cache."""
+    ckan_package_cache.clear()
+    yield {
+        "id": "1234",
+        "name": "package",
+        "metadata_modified": "2024-01-01T12:34:56.123456",
+    }
+    ckan_package_cache.clear()
+
+
+async def test_unchanged_package_is_read_from_cache(package):
+    """Cached package is returned after a revision check by id or name."""
+    ckan = FakeCKAN(package)
+
+    first = await ckan_package_show("package", ckan)
+    second = await ckan_package_show("1234", ckan)
+
+    assert first == second == package
+    assert ckan.actions == ["package_show", "package_search"]
+
+
+async def test_changed_package_is_fetched_again(package):
+    """Package modified in CKAN is fetched again."""
+    ckan = FakeCKAN(package)
+
+    await ckan_package_show("package", ckan)
+    package["metadata_modified"] = "2024-01-01T12:34:56.124"
+    result = await ckan_package_show("package", ckan)
+
+    assert result["metadata_modified"] == "2024-01-01T12:34:56.124"
+    assert ckan.actions == ["package_show", "package_search", "package_show"]
+
+
+async def test_patched_package_replaces_cached_package(package):
+    """Package returned by package_patch is cached."""
+    ckan = FakeCKAN(package)
+
+    await ckan_package_show("package", ckan)
+    await ckan_package_patch("package", {"doi": "10.16904/envidat.1"}, ckan)
+    result = await ckan_package_show("package", ckan)
+
+    assert result["doi"] == "10.16904/envidat.1"
+    assert ckan.actions == ["package_show", "package_patch", "package_search"]
+
+
+async def test_cached_package_requires_authorization(package):
+    """Users not authorized to read the package get an error, not the cache."""
+    await ckan_package_show("package", FakeCKAN(package))
+
+    with pytest.raises(HTTPException) as e:
+        await ckan_package_show("package", FakeCKAN(package, authorized=False))
+    assert e.value.status_code == 403
+
+
+async def test_packages_are_cached_per_user(package):
+    """Package read by one user is not returned from cache to another user."""
+    await ckan_package_show("package", FakeCKAN(package, apikey="service"))
+    ckan = FakeCKAN(package, apikey="user")
+
+    await ckan_package_show("package", ckan)
+    await ckan_package_show("package", ckan)
+
+    assert ckan.actions == ["package_show", "package_search"]
+
+
+async def test_unit_of_work_patches_package_once(package):
+    """Updates are written with one package_patch when the block exits."""
+    ckan = FakeCKAN(package)
+
+    async with CkanPackageUnitOfWork("1234", ckan) as package_update:
+        package_update.update({"doi": "10.16904/envidat.1"})
+        package_update.update({"publication_state": "reserved"})
+        assert ckan.actions == []
+
+    assert ckan.actions == ["package_patch"]
+    assert package["doi"] == "10.16904/envidat.1"
+    assert package["publication_state"] == "reserved"
+
+
+async def test_unit_of_work_flushes_pending_updates_only(package):
+    """Explicit flush writes pending updates, nothing is left to write on exit."""
+    ckan = FakeCKAN(package)
+
+    with pytest.raises(ValueError):
+        async with CkanPackageUnitOfWork("1234", ckan) as package_update:
+            assert await package_update.flush() is None
+            package_update.update({"doi": "10.16904/envidat.1"})
+            result = await package_update.flush()
+            raise ValueError()
+
+    assert result["doi"] == "10.16904/envidat.1"
+    assert ckan.actions == ["package_patch"]
@@ -0,0 +1,84 @@
+"""Test Server-Timing header and slow request log."""
+
+import logging
+
+import httpx
+from fastapi import APIRouter, FastAPI, HTTPException
+
+from app.config import config_app
+from app.logic.metrics import InstrumentedTransport
+from app.logic.timing import ServerTimingRoute, timed
+
+
+def timing_app() -> FastAPI:
+    """Return app with one timed route calling an instrumented CKAN client."""
+    router = APIRouter(route_class=ServerTimingRoute)
+
+    @router.get("/package")
+    async def package():
+        transport = InstrumentedTransport(
+            "ckan",
+            httpx.MockTransport(lambda request: httpx.Response(200)),
+            phases={"package_show": "ckan_read"},
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                await client.post(
+                    "http://ckan.test/api", extensions={"operation": "package_show"}
+                )
+        with timed("conversion"):
+            pass
+        return {"name": "test"}
+
+    @router.get("/missing")
+    async def missing():
+        with timed("conversion"):
+            pass
+        raise HTTPException(
+            status_code=404, detail="Not found", headers={"X-Test": "kept"}
+        )
+
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+async def test_server_timing_header_reports_phases():
+    """Phases recorded during the request are summed in Server-Timing header."""
+    transport = httpx.ASGITransport(app=timing_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        response = await c.get("/package")
+
+    assert response.status_code == 200
+    metrics = dict(
+        metric.split(";", 1) for metric in response.headers["Server-Timing"].split(", ")
+    )
+    assert metrics["ckan_read"].startswith('desc="2 calls";dur=')
+    assert metrics["conversion"].startswith('desc="1 calls";dur=')
+    assert metrics["total"].startswith("dur=")
+
+
+async def test_server_timing_header_is_added_to_errors():
+    """Error responses from HTTPException also report phases."""
+    transport = httpx.ASGITransport(app=timing_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        response = await c.get("/missing")
+
+    assert response.status_code == 404
+    assert response.headers["X-Test"] == "kept"
+    assert response.headers["Server-Timing"].startswith('conversion;desc="1 calls"')
+
+
+async def test_slow_request_is_logged(monkeypatch, caplog):
+    """Requests above the threshold are logged with their phases."""
+    monkeypatch.setattr(config_app, "SLOW_REQUEST_THRESHOLD", 1e-9)
+    transport = httpx.ASGITransport(app=timing_app())
+    with caplog.at_level(logging.WARNING, logger="app.logic.timing"):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.get("/package")
+
+    [record] = caplog.records
+    assert '"event":"slow_request"' in record.message
+    assert '"route":"/package"' in record.message
+    assert '"ckan_read":{"duration_ms":' in record.message
+